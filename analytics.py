@@ -0,0 +1,190 @@
+from datetime import date, timedelta
+
+from flask import current_app
+
+import availability
+from catalog import CatalogCache
+
+try:
+    import numpy as np
+except ImportError:  # the dashboard falls back to the trigger-maintained counters
+    np = None
+
+# Longest window the endpoint will compute, in days
+MAX_WINDOW_DAYS = 3 * 366
+# Stays that count as sold room-nights
+SOLD_STATUSES = ('unconfirmed', 'checked_in', 'checked_out')
+
+# Bumped on every booking write so cached windows are recomputed
+ANALYTICS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bookings_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO bookings_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS analytics_bookings_insert AFTER INSERT ON bookings
+BEGIN UPDATE bookings_version SET version = version + 1 WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_bookings_update AFTER UPDATE ON bookings
+BEGIN UPDATE bookings_version SET version = version + 1 WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_bookings_delete AFTER DELETE ON bookings
+BEGIN UPDATE bookings_version SET version = version + 1 WHERE id = 1; END;
+'''
+
+
+def ensure_schema(db):
+    db.executescript(ANALYTICS_SCHEMA)
+
+
+def available():
+    return np is not None
+
+
+def data_version(db):
+    """(bookings version, catalog version): changes whenever any booking or cabin does"""
+    # Cabin changes alter the room-nights on offer, so both stamps key the cache
+    row = db.execute('''
+        SELECT (SELECT version FROM bookings_version WHERE id = 1),
+               (SELECT version FROM catalog_version WHERE id = 1)
+    ''').fetchone()
+    return tuple(row)
+
+
+def _load(db, start, end):
+    """Cabins plus every non-cancelled stay overlapping [start, end) as arrays"""
+    cabins = db.execute('SELECT id, name FROM cabins ORDER BY id').fetchall()
+    # Room revenue excludes breakfast, as ADR and RevPAR are room metrics.
+    # Past windows also read the stays the scheduler has archived, so the
+    # check_in lower bound must cover the longest stay in either table.
+    longest = max(availability.longest_stay(db, SOLD_STATUSES, table)
+                  for table in ('bookings', 'bookings_archive'))
+    earliest = (start - timedelta(days=longest)).isoformat()
+    stays = '''
+        SELECT cabin_id, substr(check_in, 1, 10), substr(check_out, 1, 10),
+               (total_price - CASE WHEN breakfast_included THEN ? * num_nights * num_guests ELSE 0 END)
+               / num_nights
+        FROM {table}
+        WHERE status IN ("unconfirmed", "checked_in", "checked_out")
+        AND check_in >= ? AND check_in < ? AND check_out > ?
+        AND num_nights > 0
+    '''
+    params = (availability.BREAKFAST_PRICE, earliest, end.isoformat(), start.isoformat())
+    rows = db.execute(stays.format(table='bookings') + ' UNION ALL ' + stays.format(table='bookings_archive'),
+                      params * 2).fetchall()
+    cabin_ids = np.array([c['id'] for c in cabins], dtype=np.int64)
+    if rows:
+        cabin_col, check_in, check_out, rate = zip(*rows)
+    else:
+        cabin_col, check_in, check_out, rate = (), (), (), ()
+    return (cabins, cabin_ids,
+            np.array(cabin_col, dtype=np.int64),
+            np.array(check_in, dtype='datetime64[D]'),
+            np.array(check_out, dtype='datetime64[D]'),
+            np.array(rate, dtype=np.float64))
+
+
+def _ratios(nights, revenue, capacity):
+    """Occupancy, ADR and RevPAR from sold nights, room revenue and nights on offer"""
+    shape = np.shape(nights)
+    occupancy = np.divide(nights, capacity, out=np.zeros(shape), where=capacity > 0)
+    adr = np.divide(revenue, nights, out=np.zeros(shape), where=nights > 0)
+    revpar = np.divide(revenue, capacity, out=np.zeros(shape), where=capacity > 0)
+    return occupancy, adr, revpar
+
+
+def compute(db, start, end):
+    """Daily, monthly, per-cabin and fleet occupancy, ADR and RevPAR for [start, end)
+
+    Each stay adds +1 (and +rate) on its first night in the window and -1
+    on the day after its last, so one cumulative sum over these difference
+    arrays yields the rooms sold and room revenue for every day; the cost
+    is linear in bookings plus days, not their product.
+    """
+    cabins, cabin_ids, cabin_col, check_in, check_out, rate = _load(db, start, end)
+    days = (end - start).days
+    origin = np.datetime64(start.isoformat(), 'D')
+
+    # Drop stays whose cabin has since been deleted
+    position = np.searchsorted(cabin_ids, cabin_col)
+    known = position < len(cabin_ids)
+    known[known] = cabin_ids[position[known]] == cabin_col[known]
+    position, check_in, check_out, rate = position[known], check_in[known], check_out[known], rate[known]
+
+    first = np.clip((check_in - origin).astype(np.int64), 0, days)
+    last = np.clip((check_out - origin).astype(np.int64), 0, days)
+    nights = last - first
+
+    sold = np.cumsum(np.bincount(first, minlength=days + 1) - np.bincount(last, minlength=days + 1))[:days]
+    daily_revenue = np.cumsum(np.bincount(first, rate, days + 1) - np.bincount(last, rate, days + 1))[:days]
+    # Float cumulative sums drift by a few ulps where the total returns to zero
+    daily_revenue = np.round(daily_revenue, 2)
+    sold = sold.astype(np.float64)
+    on_offer = np.full(days, float(len(cabin_ids)))
+    occupancy, adr, revpar = _ratios(sold, daily_revenue, on_offer)
+
+    dates = origin + np.arange(days)
+    daily = [{'date': str(d), 'rooms_sold': int(n), 'occupancy': round(float(o), 4),
+              'room_revenue': round(float(r), 2), 'adr': round(float(a), 2), 'revpar': round(float(p), 2)}
+             for d, n, o, r, a, p in zip(dates, sold, occupancy, daily_revenue, adr, revpar)]
+
+    months, month_index = np.unique(dates.astype('datetime64[M]'), return_inverse=True)
+    month_sold = np.bincount(month_index, sold, len(months))
+    month_revenue = np.bincount(month_index, daily_revenue, len(months))
+    month_offer = np.bincount(month_index, on_offer, len(months))
+    m_occupancy, m_adr, m_revpar = _ratios(month_sold, month_revenue, month_offer)
+    monthly = [{'month': str(m), 'rooms_sold': int(n), 'occupancy': round(float(o), 4),
+                'room_revenue': round(float(r), 2), 'adr': round(float(a), 2), 'revpar': round(float(p), 2)}
+               for m, n, o, r, a, p in zip(months, month_sold, m_occupancy, month_revenue, m_adr, m_revpar)]
+
+    cabin_nights = np.bincount(position, nights, len(cabin_ids))
+    cabin_revenue = np.bincount(position, nights * rate, len(cabin_ids))
+    c_occupancy, c_adr, c_revpar = _ratios(cabin_nights, cabin_revenue, np.full(len(cabin_ids), float(days)))
+    by_cabin = [{'cabin_id': c['id'], 'name': c['name'], 'nights_sold': int(n),
+                 'occupancy': round(float(o), 4), 'room_revenue': round(float(r), 2),
+                 'adr': round(float(a), 2), 'revpar': round(float(p), 2)}
+                for c, n, o, r, a, p in zip(cabins, cabin_nights, c_occupancy, cabin_revenue, c_adr, c_revpar)]
+
+    total_sold, total_revenue, total_offer = sold.sum(), daily_revenue.sum(), on_offer.sum()
+    f_occupancy, f_adr, f_revpar = _ratios(np.array([total_sold]), np.array([total_revenue]),
+                                           np.array([total_offer]))
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': days,
+        'cabins': len(cabin_ids),
+        'fleet': {'rooms_sold': int(total_sold), 'occupancy': round(float(f_occupancy[0]), 4),
+                  'room_revenue': round(float(total_revenue), 2), 'adr': round(float(f_adr[0]), 2),
+                  'revpar': round(float(f_revpar[0]), 2)},
+        'daily': daily,
+        'monthly': monthly,
+        'by_cabin': by_cabin,
+    }
+
+
+def get_cache():
+    cache = current_app.extensions.get('analytics_cache')
+    database = current_app.config['DATABASE']
+    if cache is None or cache.database != database:
+        cache = CatalogCache(max_entries=current_app.config['ANALYTICS_CACHE_MAX_ENTRIES'])
+        cache.database = database
+        current_app.extensions['analytics_cache'] = cache
+    return cache
+
+
+def occupancy(db, start, end):
+    """Cached ``compute`` for one window; any booking or cabin write invalidates it"""
+    if np is None:
+        raise RuntimeError('numpy is required for occupancy analytics')
+    return get_cache().get((start, end), data_version(db), lambda: compute(db, start, end))
+
+
+def last_days(db, days, today=None):
+    """Occupancy for the ``days`` nights up to and including last night"""
+    end = today or date.today()
+    return occupancy(db, end - timedelta(days=days), end)
+
+
+def init_app(app):
+    app.config.setdefault('ANALYTICS_CACHE_MAX_ENTRIES', 64)
@@ -0,0 +1,289 @@
+import hashlib
+import hmac
+import json
+from functools import wraps
+
+from flask import Response, current_app, make_response, request, session
+
+import analytics
+import availability
+import catalog
+import pagination
+import repository
+import reviews
+from replication import get_read_db
+
+API_PREFIX = '/api/v1'
+MAX_BATCH = 500
+SYNC_PAGE_SIZE = 200
+
+CABIN_FIELDS = ('id', 'name', 'cabin_number', 'capacity', 'price_per_night', 'description', 'amenities',
+                'image_url', 'rating', 'review_count', 'version')
+BOOKING_FIELDS = ('id', 'cabin_id', 'cabin_name', 'check_in', 'check_out', 'num_nights', 'num_guests',
+                  'breakfast_included', 'observations', 'total_price', 'status', 'created_at')
+REVIEW_FIELDS = ('id', 'user_name', 'rating', 'comment', 'created_at')
+
+
+class ApiError(Exception):
+    """An error answered as {"error": message} with ``status``"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _error(error):
+    return _json({'error': error.message}, error.status)
+
+
+def _json(payload, status=200):
+    # No indentation or spaces, and non-ASCII text as is rather than escaped
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=str)
+    return Response(body, status=status, mimetype='application/json')
+
+
+def _caller():
+    """'admin' or 'client' for a signed-in session, 'partner' for an API token, else None"""
+    if 'user_id' in session:
+        return session.get('role')
+    supplied = request.headers.get('Authorization', '')
+    for token in current_app.config['API_TOKENS']:
+        if hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return 'partner'
+    return None
+
+
+def allow(*callers):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            caller = _caller()
+            if caller is None:
+                raise ApiError(401, 'Sign in or send an API token')
+            if caller not in callers:
+                raise ApiError(403, 'Not available to this client')
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _fields(allowed, param='fields'):
+    """The ?fields= subset of ``allowed`` to return, in request order; all of them by default"""
+    if not request.args.get(param):
+        return allowed
+    fields = tuple(name.strip() for name in request.args[param].split(',') if name.strip())
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ApiError(400, f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def _ids(name):
+    """Integer ids from ?name=1,2,3 or the JSON body's list, at most MAX_BATCH"""
+    if request.method == 'POST':
+        body = request.get_json(silent=True) if request.get_data() else {}
+        if not isinstance(body, dict):
+            raise ApiError(400, 'The request body must be a JSON object')
+        values = body.get(name) or []
+        # JSON ids must be integers already; bools are ints in Python but not ids
+        if not isinstance(values, list) or any(type(value) is not int for value in values):
+            raise ApiError(400, f'{name} must be a list of integer ids')
+    else:
+        values = [value for value in request.args.get(name, '').split(',') if value]
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise ApiError(400, f'{name} must be a list of integer ids')
+    if len(ids) > MAX_BATCH:
+        raise ApiError(400, f'At most {MAX_BATCH} {name} per request')
+    return ids
+
+
+def cabin_json(cabin, fields=CABIN_FIELDS):
+    count = cabin['review_count'] or 0
+    values = {
+        'amenities': [a.strip() for a in (cabin['amenities'] or '').split(',') if a.strip()],
+        'price_per_night': float(cabin['price_per_night']),
+        'rating': round(cabin['rating_sum'] / count, 2) if count else None,
+        'review_count': count,
+    }
+    return {name: values[name] if name in values else cabin[name] for name in fields}
+
+
+def booking_json(booking, fields=BOOKING_FIELDS):
+    return {name: bool(booking[name]) if name == 'breakfast_included' else booking[name] for name in fields}
+
+
+def _etag(*parts):
+    # Covers the URL and caller too, since fields, cursors and visibility change the body
+    key = repr(parts + (request.full_path, session.get('user_id'), _caller()))
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def _stamp(response, tag):
+    # Weak, because response compression changes the bytes but not the meaning
+    response.set_etag(tag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional(build, *version):
+    """JSON of ``build()``, or 304 when the client's If-None-Match still matches
+
+    With a ``version`` (stamps the body depends on), the tag is derived from
+    it and a match skips ``build`` entirely; without one the body is built
+    and hashed.
+    """
+    if version:
+        tag = _etag(*version)
+        if request.if_none_match.contains_weak(tag):
+            return _stamp(make_response('', 304), tag)
+        return _stamp(_json(build()), tag)
+    response = _json(build())
+    tag = hashlib.sha1(response.get_data()).hexdigest()[:20]
+    if request.if_none_match.contains_weak(tag):
+        return _stamp(make_response('', 304), tag)
+    return _stamp(response, tag)
+
+
+def _get_cabin(db, cabin_id):
+    cabin = catalog.get_cabin(db, cabin_id)
+    if cabin is None:
+        raise ApiError(404, 'Cabin not found')
+    return cabin
+
+
+@allow('admin', 'client', 'partner')
+def cabins_view():
+    """Cabins changed since ``updated_since`` (a version cursor; 0 for everything), oldest first
+
+    Returns the changed cabins, the ids of cabins deleted since, and
+    ``next`` to pass as updated_since on the following call; ``more`` says
+    whether another page is waiting.
+    """
+    try:
+        since = int(request.args.get('updated_since', 0))
+    except ValueError:
+        raise ApiError(400, 'updated_since must be the integer cursor from a previous response')
+    fields = _fields(CABIN_FIELDS)
+    limit = pagination.page_size(SYNC_PAGE_SIZE)
+    db = get_read_db()
+
+    def build():
+        changes = repository.cabin_changes(db, since, limit + 1)
+        more = len(changes) > limit
+        changes = changes[:limit]
+        cabins = repository.cabins_by_ids(db, [row['id'] for row in changes if not row['deleted']])
+        return {
+            'cabins': [cabin_json(cabin, fields) for cabin in cabins],
+            'deleted': [row['id'] for row in changes if row['deleted']],
+            'next': str(changes[-1]['version'] if changes else since),
+            'more': more,
+        }
+
+    return conditional(build, catalog.current_version(db)[0])
+
+
+@allow('admin', 'client', 'partner')
+def cabin_view(cabin_id):
+    """One cabin with its rating histogram and a keyset page of reviews"""
+    fields = _fields(CABIN_FIELDS)
+    db = get_read_db()
+    cabin = _get_cabin(db, cabin_id)
+
+    def build():
+        page = reviews.review_page(db, cabin_id)
+        return {
+            'cabin': cabin_json(cabin, fields),
+            'ratings': dict(reviews.rating_summary(cabin)['histogram']),
+            'reviews': [{name: review[name] for name in REVIEW_FIELDS} for review in page.rows],
+            'next': page.next_cursor,
+        }
+
+    return conditional(build)
+
+
+@allow('admin', 'client', 'partner')
+def cabin_availability_view(cabin_id):
+    db = get_read_db()
+    cabin = _get_cabin(db, cabin_id)
+    # The calendar starts today, so the tag comes from the body rather than a version
+    return conditional(lambda: availability.cabin_calendar(db, cabin))
+
+
+@allow('admin', 'client')
+def bookings_view():
+    """The caller's bookings newest first (every booking for admins), a keyset page at a time"""
+    fields = _fields(BOOKING_FIELDS)
+    db = get_read_db()
+
+    def build():
+        if session.get('role') == 'admin':
+            rows, page = repository.list_bookings(db, request.args.get('status'))
+        else:
+            rows, page = repository.list_user_bookings(db, session['user_id'])
+        return {'bookings': [booking_json(row, fields) for row in rows], 'next': page.next_cursor}
+
+    return conditional(build, *analytics.data_version(db))
+
+
+@allow('admin', 'client')
+def booking_view(booking_id):
+    fields = _fields(BOOKING_FIELDS)
+    db = get_read_db()
+    if session.get('role') == 'admin':
+        booking = repository.booking_detail(db, booking_id)
+    else:
+        booking = repository.user_booking_detail(db, booking_id, session['user_id'])
+    if booking is None:
+        raise ApiError(404, 'Booking not found')
+    return conditional(lambda: {'booking': booking_json(booking, fields)})
+
+
+@allow('admin', 'client', 'partner')
+def batch_view():
+    """Many cabins and bookings by id, one query each
+
+    ``?cabins=1,2&bookings=3,4``, or a POST body {"cabins": [...],
+    "bookings": [...]} for long lists; ``cabin_fields`` and
+    ``booking_fields`` select fields. Ids that do not exist, or bookings
+    that are not the caller's, are listed under "missing".
+    """
+    cabin_ids, booking_ids = _ids('cabins'), _ids('bookings')
+    if booking_ids and _caller() == 'partner':
+        raise ApiError(403, 'Bookings are not available to this client')
+    cabin_fields = _fields(CABIN_FIELDS, 'cabin_fields')
+    booking_fields = _fields(BOOKING_FIELDS, 'booking_fields')
+    db = get_read_db()
+
+    def build():
+        payload = {'missing': {}}
+        if cabin_ids:
+            cabins = repository.cabins_by_ids(db, cabin_ids)
+            found = {cabin['id'] for cabin in cabins}
+            payload['cabins'] = [cabin_json(cabin, cabin_fields) for cabin in cabins]
+            payload['missing']['cabins'] = [i for i in cabin_ids if i not in found]
+        if booking_ids:
+            owner = None if session.get('role') == 'admin' else session['user_id']
+            bookings = repository.bookings_by_ids(db, booking_ids, owner)
+            found = {booking['id'] for booking in bookings}
+            payload['bookings'] = [booking_json(booking, booking_fields) for booking in bookings]
+            payload['missing']['bookings'] = [i for i in booking_ids if i not in found]
+        return payload
+
+    return conditional(build)
+
+
+def init_app(app):
+    # Bearer tokens for partner clients, which may read the catalog and availability
+    app.config.setdefault('API_TOKENS', [])
+    app.register_error_handler(ApiError, _error)
+    app.add_url_rule(f'{API_PREFIX}/cabins', 'api_cabins', cabins_view)
+    app.add_url_rule(f'{API_PREFIX}/cabins/<int:cabin_id>', 'api_cabin', cabin_view)
+    app.add_url_rule(f'{API_PREFIX}/cabins/<int:cabin_id>/availability', 'api_cabin_availability',
+                     cabin_availability_view)
+    app.add_url_rule(f'{API_PREFIX}/bookings', 'api_bookings', bookings_view)
+    app.add_url_rule(f'{API_PREFIX}/bookings/<int:booking_id>', 'api_booking', booking_view)
+    app.add_url_rule(f'{API_PREFIX}/batch', 'api_batch', batch_view, methods=['GET', 'POST'])
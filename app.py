@@ -1,10 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, stream_template, request, redirect, url_for, session, flash, jsonify
 from datetime import datetime, timedelta
-import sqlite3
+import io
 import os
+import sqlite3
 from functools import wraps
+import db as dbpool
+from db import get_db
+from replication import get_read_db
+import availability
+import stats
+import pagination
+import catalog
+import images
+import assets
+import reviews
+import passwords
+import metrics
+import transfers
+import analytics
+import scheduler
+import search
+import writes
+import fragments
+import migrations
+import maintenance
+import replication
+import repository
+import api
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-change-in-production'
@@ -17,16 +39,24 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['DATABASE'] = DATABASE
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+app.config['AVAILABILITY_INDEX'] = os.environ.get('AVAILABILITY_INDEX') == '1'
+app.config['AVAILABILITY_INDEX_MAX_AGE'] = float(os.environ.get('AVAILABILITY_INDEX_MAX_AGE', 1.0))
+app.config['METRICS_SERVER_TIMING'] = os.environ.get('SERVER_TIMING') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SCHEDULER_IN_PROCESS'] = os.environ.get('SCHEDULER') == '1'
+app.config['WRITE_QUEUE'] = os.environ.get('WRITE_QUEUE') == '1'
+app.config['DB_REPLICAS'] = [path for path in os.environ.get('DB_REPLICAS', '').split(',') if path]
+app.config['DB_REPLICA_SYNC_IN_PROCESS'] = os.environ.get('REPLICA_SYNC') == '1'
+app.config['API_TOKENS'] = [token for token in os.environ.get('API_TOKENS', '').split(',') if token]
+if os.environ.get('JINJA_BYTECODE_CACHE_DIR'):
+    app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ['JINJA_BYTECODE_CACHE_DIR']
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # Database helper functions
-def get_db():
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
-
 def init_db():
     """Initialize the database with tables"""
     with app.app_context():
@@ -35,6 +65,44 @@ def init_db():
             db.cursor().executescript(f.read())
         db.commit()
 
+def prepare_db(db):
+    """Create missing tables and the indexes the hot queries rely on"""
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+        with app.open_resource('schema.sql', mode='r') as f:
+            db.executescript(f.read())
+    availability.ensure_indexes(db)
+    availability.ensure_schema(db)
+    pagination.ensure_indexes(db)
+    # Before stats: its totals also count archived bookings
+    scheduler.ensure_schema(db)
+    stats.ensure_schema(db)
+    catalog.ensure_schema(db)
+    reviews.ensure_schema(db)
+    analytics.ensure_schema(db)
+    search.ensure_schema(db)
+    fragments.ensure_schema(db)
+    passwords.ensure_schema(db)
+    db.commit()
+    migrations.migrate(db)
+
+dbpool.init_app(app, setup=prepare_db)
+metrics.init_app(app)
+stats.init_app(app)
+catalog.init_app(app)
+images.init_app(app)
+assets.init_app(app)
+reviews.init_app(app)
+passwords.init_app(app)
+transfers.init_app(app)
+analytics.init_app(app)
+scheduler.init_app(app)
+search.init_app(app)
+writes.init_app(app)
+fragments.init_app(app)
+maintenance.init_app(app)
+replication.init_app(app)
+api.init_app(app)
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -70,10 +138,39 @@ def login():
         email = (request.form.get('email') or '').strip().lower()
         password = request.form.get('password')
         
-        db = get_db()
-        user = db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        # Refuse before hashing anything once an email or address has too many recent failures
+        throttle = passwords.get_throttle()
+        if not throttle.allow(get_db(), email, request.remote_addr):
+            flash('Too many failed login attempts. Please wait a few minutes and try again.')
+            return render_template('login.html'), 429
+        
+        user = repository.find_user_by_email(get_db(), email)
+        # Don't hold a pooled connection while waiting on the hashing pool
+        dbpool.close_db()
+        
+        hasher = passwords.get_hasher()
+        try:
+            # Unknown emails are checked against a dummy hash, so the response
+            # time does not tell which accounts exist
+            pwhash = user['password'] if user is not None else hasher.dummy_hash()
+            valid = hasher.verify(pwhash, password or '') and user is not None
+        except passwords.HashingBusy:
+            flash('The server is busy right now. Please try again in a moment.')
+            return render_template('login.html'), 503
         
-        if user and check_password_hash(user['password'], password):
+        if valid:
+            try:
+                throttle.reset(get_db(), email)
+            except writes.WriteBusy:
+                pass
+            # Upgrade hashes made with older cost parameters while we have the password
+            if hasher.needs_rehash(user['password']):
+                try:
+                    new_hash = hasher.hash(password)
+                    writes.run(get_db(), repository.set_password, user['id'], new_hash)
+                except (passwords.HashingBusy, writes.WriteBusy):
+                    pass
+            
             session['user_id'] = user['id']
             session['name'] = user['name']
             session['role'] = user['role']
@@ -83,6 +180,10 @@ def login():
             else:
                 return redirect(url_for('client_dashboard'))
         else:
+            try:
+                throttle.record_failure(get_db(), email, request.remote_addr)
+            except writes.WriteBusy:
+                pass
             flash('Invalid email or password')
     
     return render_template('login.html')
@@ -99,21 +200,24 @@ def signup():
         if role not in allowed_roles:
             role = 'client'
         
-        db = get_db()
-        
         # Check if user already exists
-        existing_user = db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
-        if existing_user:
+        if repository.email_registered(get_db(), email):
             flash('Email already registered')
             return redirect(url_for('signup'))
         
         # Create new user
-        hashed_password = generate_password_hash(password)
-        db.execute(
-            'INSERT INTO users (name, email, password, phone, role) VALUES (?, ?, ?, ?, ?)',
-            (name, email, hashed_password, phone, role)
-        )
-        db.commit()
+        dbpool.close_db()
+        try:
+            hashed_password = passwords.get_hasher().hash(password or '')
+        except passwords.HashingBusy:
+            flash('The server is busy right now. Please try again in a moment.')
+            return render_template('signup.html'), 503
+        try:
+            writes.run(get_db(), repository.create_user, name, email, hashed_password, phone, role)
+        except sqlite3.IntegrityError:
+            # Someone registered the same email while the password was hashing
+            flash('Email already registered')
+            return redirect(url_for('signup'))
         
         flash('Registration successful! Please login.')
         return redirect(url_for('login'))
@@ -129,88 +233,75 @@ def logout():
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    db = get_db()
+    db = get_read_db()
     
-    # Get statistics
-    total_bookings = db.execute('SELECT COUNT(*) as count FROM bookings').fetchone()['count']
-    total_sales = db.execute('SELECT SUM(total_price) as total FROM bookings WHERE status != "cancelled"').fetchone()['total'] or 0
-    check_ins = db.execute('SELECT COUNT(*) as count FROM bookings WHERE status = "checked_in"').fetchone()['count']
+    # Get statistics (maintained incrementally by triggers, see stats.py)
+    counters = stats.read(db)
+    total_bookings = counters['total_bookings']
+    total_sales = counters['total_sales']
+    check_ins = counters['checked_in']
     
     # Get today's arrivals
-    today = datetime.now().date()
-    todays_arrivals = db.execute('''
-        SELECT b.*, c.name as cabin_name, u.name as guest_name, u.email as guest_email
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        JOIN users u ON b.user_id = u.id
-        WHERE DATE(b.check_in) = ? AND b.status = "unconfirmed"
-        ORDER BY b.check_in
-    ''', (today,)).fetchall()
+    todays_arrivals = repository.arrivals(db, datetime.now().date())
     
     # Get recent bookings
-    recent_bookings = db.execute('''
-        SELECT b.*, c.name as cabin_name, u.name as guest_name
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        JOIN users u ON b.user_id = u.id
-        ORDER BY b.created_at DESC
-        LIMIT 10
-    ''').fetchall()
-    
-    # Calculate occupancy rate (simplified)
-    total_cabins = db.execute('SELECT COUNT(*) as count FROM cabins').fetchone()['count']
-    occupied_cabins = db.execute('''
-        SELECT COUNT(DISTINCT cabin_id) as count 
-        FROM bookings 
-        WHERE status = "checked_in" OR status = "unconfirmed"
-    ''').fetchone()['count']
-    occupancy_rate = (occupied_cabins / total_cabins * 100) if total_cabins > 0 else 0
+    recent_bookings = repository.recent_bookings(db)
+    
+    # Occupancy, ADR and RevPAR over the selected window of nights
+    days = request.args.get('days', 30, type=int)
+    if days not in (7, 30, 90):
+        days = 30
+    window = None
+    if analytics.available():
+        window = analytics.last_days(db, days)['fleet']
+        occupancy_rate = window['occupancy'] * 100
+    else:
+        # Without numpy, fall back to the share of cabins with any active booking
+        total_cabins = counters['total_cabins']
+        occupied_cabins = counters['occupied_cabins']
+        occupancy_rate = (occupied_cabins / total_cabins * 100) if total_cabins > 0 else 0
     
     return render_template('admin_dashboard.html',
                          total_bookings=total_bookings,
                          total_sales=total_sales,
                          check_ins=check_ins,
                          occupancy_rate=occupancy_rate,
+                         window=window,
+                         days=days,
                          todays_arrivals=todays_arrivals,
                          recent_bookings=recent_bookings)
 
+@app.route('/admin/analytics/occupancy')
+@admin_required
+def admin_occupancy():
+    if not analytics.available():
+        return jsonify(error='numpy is not installed'), 503
+    today = datetime.now().date()
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if 'start' in request.args else today - timedelta(days=30)
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if 'end' in request.args else today
+    except ValueError:
+        return jsonify(error='start and end must be YYYY-MM-DD'), 400
+    if not 0 < (end - start).days <= analytics.MAX_WINDOW_DAYS:
+        return jsonify(error=f'end must be after start and at most {analytics.MAX_WINDOW_DAYS} days later'), 400
+    return jsonify(analytics.occupancy(get_read_db(), start, end))
+
 @app.route('/admin/bookings')
 @admin_required
 def admin_bookings():
-    db = get_db()
-    
     status_filter = request.args.get('status', 'all')
     
-    query = '''
-        SELECT b.*, c.name as cabin_name, c.cabin_number, 
-               u.name as guest_name, u.email as guest_email
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        JOIN users u ON b.user_id = u.id
-    '''
-    
-    if status_filter != 'all':
-        query += ' WHERE b.status = ?'
-        bookings = db.execute(query + ' ORDER BY b.created_at DESC', (status_filter,)).fetchall()
-    else:
-        bookings = db.execute(query + ' ORDER BY b.created_at DESC').fetchall()
-    
-    return render_template('admin_bookings.html', bookings=bookings, status_filter=status_filter)
+    # ?stream=1 renders the whole list as the cursor yields rows
+    bookings, page = repository.list_bookings(get_read_db(), None if status_filter == 'all' else status_filter,
+                                              stream=pagination.wants_stream())
+    if page is None:
+        return stream_template('admin_bookings.html', bookings=bookings, page=None, status_filter=status_filter)
+    return render_template('admin_bookings.html', bookings=bookings, page=page, status_filter=status_filter)
 
 @app.route('/admin/booking/<int:booking_id>')
 @admin_required
 def admin_booking_detail(booking_id):
-    db = get_db()
-    
-    booking = db.execute('''
-        SELECT b.*, c.name as cabin_name, c.cabin_number, c.price_per_night,
-               u.name as guest_name, u.email as guest_email, u.phone as guest_phone,
-               u.national_id
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        JOIN users u ON b.user_id = u.id
-        WHERE b.id = ?
-    ''', (booking_id,)).fetchone()
+    booking = repository.booking_detail(get_read_db(), booking_id)
     
     if not booking:
         flash('Booking not found')
@@ -221,35 +312,30 @@ def admin_booking_detail(booking_id):
 @app.route('/admin/booking/<int:booking_id>/check-in', methods=['POST'])
 @admin_required
 def check_in_booking(booking_id):
-    db = get_db()
-    db.execute('UPDATE bookings SET status = "checked_in" WHERE id = ?', (booking_id,))
-    db.commit()
+    writes.run(get_db(), availability.set_status, booking_id, 'checked_in')
     flash('Guest checked in successfully')
     return redirect(url_for('admin_booking_detail', booking_id=booking_id))
 
 @app.route('/admin/booking/<int:booking_id>/check-out', methods=['POST'])
 @admin_required
 def check_out_booking(booking_id):
-    db = get_db()
-    db.execute('UPDATE bookings SET status = "checked_out" WHERE id = ?', (booking_id,))
-    db.commit()
+    writes.run(get_db(), availability.set_status, booking_id, 'checked_out')
+    availability.release_booking(booking_id)
     flash('Guest checked out successfully')
     return redirect(url_for('admin_booking_detail', booking_id=booking_id))
 
 @app.route('/admin/booking/<int:booking_id>/delete', methods=['POST'])
 @admin_required
 def delete_booking(booking_id):
-    db = get_db()
-    db.execute('DELETE FROM bookings WHERE id = ?', (booking_id,))
-    db.commit()
+    writes.run(get_db(), availability.delete_booking, booking_id)
+    availability.release_booking(booking_id)
     flash('Booking deleted successfully')
     return redirect(url_for('admin_bookings'))
 
 @app.route('/admin/cabins')
 @admin_required
 def admin_cabins():
-    db = get_db()
-    cabins = db.execute('SELECT * FROM cabins ORDER BY cabin_number').fetchall()
+    cabins = repository.list_cabins_by_number(get_read_db())
     return render_template('admin_cabins.html', cabins=cabins)
 
 @app.route('/admin/cabin/add', methods=['GET', 'POST'])
@@ -268,16 +354,12 @@ def add_cabin():
         if 'image_file' in request.files:
             file = request.files['image_file']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"cabin_{cabin_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_url = f'/static/uploads/{filename}'
+                # Stored by content hash; resized variants are built in the background
+                image_url = images.store_upload(file, app.config['UPLOAD_FOLDER'])
         
-        db = get_db()
-        db.execute('''
-            INSERT INTO cabins (name, cabin_number, capacity, price_per_night, description, amenities, image_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, cabin_number, capacity, price_per_night, description, amenities, image_url))
-        db.commit()
+        writes.run(get_db(), repository.create_cabin, dict(
+            name=name, cabin_number=cabin_number, capacity=capacity, price_per_night=price_per_night,
+            description=description, amenities=amenities, image_url=image_url))
         
         flash('Cabin added successfully')
         return redirect(url_for('admin_cabins'))
@@ -287,8 +369,6 @@ def add_cabin():
 @app.route('/admin/cabin/<int:cabin_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def edit_cabin(cabin_id):
-    db = get_db()
-    
     if request.method == 'POST':
         name = request.form.get('name')
         cabin_number = request.form.get('cabin_number')
@@ -302,94 +382,189 @@ def edit_cabin(cabin_id):
         if 'image_file' in request.files:
             file = request.files['image_file']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"cabin_{cabin_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_url = f'/static/uploads/{filename}'
+                # Stored by content hash; resized variants are built in the background
+                image_url = images.store_upload(file, app.config['UPLOAD_FOLDER'])
         
-        db.execute('''
-            UPDATE cabins 
-            SET name = ?, cabin_number = ?, capacity = ?, price_per_night = ?, 
-                description = ?, amenities = ?, image_url = ?
-            WHERE id = ?
-        ''', (name, cabin_number, capacity, price_per_night, description, amenities, image_url, cabin_id))
-        db.commit()
+        writes.run(get_db(), repository.update_cabin, cabin_id, dict(
+            name=name, cabin_number=cabin_number, capacity=capacity, price_per_night=price_per_night,
+            description=description, amenities=amenities, image_url=image_url))
         
         flash('Cabin updated successfully')
         return redirect(url_for('admin_cabins'))
     
-    cabin = db.execute('SELECT * FROM cabins WHERE id = ?', (cabin_id,)).fetchone()
+    cabin = repository.find_cabin(get_read_db(), cabin_id)
     return render_template('admin_edit_cabin.html', cabin=cabin)
 
 @app.route('/admin/cabin/<int:cabin_id>/delete', methods=['POST'])
 @admin_required
 def delete_cabin(cabin_id):
-    db = get_db()
-    db.execute('DELETE FROM cabins WHERE id = ?', (cabin_id,))
-    db.commit()
+    writes.run(get_db(), repository.delete_cabin, cabin_id)
     flash('Cabin deleted successfully')
     return redirect(url_for('admin_cabins'))
 
+@app.route('/admin/db-stats')
+@admin_required
+def admin_db_stats():
+    pool_stats = dbpool.get_pool().stats()
+    if app.config['DB_REPLICAS']:
+        pool_stats['replicas'] = replication.stats()
+    return jsonify(pool_stats)
+
+@app.route('/admin/bookings/import', methods=['GET', 'POST'])
+@admin_required
+def admin_import_bookings():
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV or JSONL file')
+            return redirect(url_for('admin_import_bookings'))
+        fmt = transfers.guess_format(upload.filename)
+        # Parse the upload as a text stream rather than reading it into memory
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace', newline='')
+        result = transfers.import_bookings(get_db(), stream, fmt, dry_run='dry_run' in request.form)
+    return render_template('admin_import.html', result=result)
+
+@app.route('/admin/export/<table>.<fmt>')
+@admin_required
+def admin_export(table, fmt):
+    if table not in transfers.EXPORTS or fmt not in transfers.FORMATS:
+        return 'Unknown export', 404
+    return transfers.export_response(table, fmt)
+
 @app.route('/admin/users')
 @admin_required
 def admin_users():
-    db = get_db()
-    users = db.execute('SELECT * FROM users ORDER BY created_at DESC').fetchall()
-    return render_template('admin_users.html', users=users)
+    users, page = repository.list_users(get_read_db(), stream=pagination.wants_stream())
+    if page is None:
+        return stream_template('admin_users.html', users=users, page=None)
+    return render_template('admin_users.html', users=users, page=page)
 
 # Client routes
 @app.route('/client/dashboard')
 @login_required
 def client_dashboard():
-    db = get_db()
+    db = get_read_db()
     
     # Get available cabins
-    cabins = db.execute('SELECT * FROM cabins ORDER BY price_per_night').fetchall()
+    cabins = catalog.list_cabins(db)
     
     # Get user's bookings
-    user_bookings = db.execute('''
-        SELECT b.*, c.name as cabin_name, c.cabin_number, c.image_url
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        WHERE b.user_id = ?
-        ORDER BY b.created_at DESC
-        LIMIT 5
-    ''', (session['user_id'],)).fetchall()
+    user_bookings = repository.recent_user_bookings(db, session['user_id'])
     
     return render_template('client_dashboard.html', cabins=cabins, bookings=user_bookings)
 
 @app.route('/client/cabins')
 @login_required
 def client_cabins():
-    db = get_db()
-    cabins = db.execute('SELECT * FROM cabins ORDER BY price_per_night').fetchall()
-    return render_template('client_cabins.html', cabins=cabins)
+    db = get_read_db()
+    return catalog.conditional_render(
+        db, lambda version: render_template('client_cabins.html', cabins=catalog.list_cabins(db, version)))
+
+@app.route('/client/search')
+@login_required
+def search_cabins():
+    wants_json = request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+    q = request.args.get('q', '').strip()
+    selected = request.args.getlist('amenity')
+    check_in = request.args.get('check_in', '')
+    check_out = request.args.get('check_out', '')
+    guests = request.args.get('guests', '')
+    min_price = request.args.get('min_price', '')
+    max_price = request.args.get('max_price', '')
+    searched = any(value for key, value in request.args.items() if key != 'format')
+    
+    error = None
+    try:
+        guests = int(guests or 1)
+        min_price = float(min_price) if min_price else None
+        max_price = float(max_price) if max_price else None
+        if check_in or check_out:
+            check_in = datetime.strptime(check_in, '%Y-%m-%d').date().isoformat()
+            check_out = datetime.strptime(check_out, '%Y-%m-%d').date().isoformat()
+        if check_in and check_out <= check_in:
+            error = 'Check-out date must be after check-in date'
+        elif guests < 1:
+            error = 'Number of guests must be at least 1'
+        elif min_price is not None and max_price is not None and max_price < min_price:
+            error = 'Maximum price must not be below the minimum price'
+    except ValueError:
+        error = 'Invalid search dates, guest count or price'
+    
+    form = dict(q=q, selected=selected, check_in=check_in, check_out=check_out, guests=guests,
+                min_price=min_price, max_price=max_price)
+    if error:
+        if wants_json:
+            return jsonify({'error': error}), 400
+        flash(error)
+        return render_template('client_search.html', cabins=None, facets=[], **form)
+    
+    results = search.search(get_read_db(), q, selected, guests, min_price, max_price, check_in, check_out)
+    
+    if wants_json:
+        return jsonify({
+            'q': q,
+            'amenities': selected,
+            'check_in': check_in or None,
+            'check_out': check_out or None,
+            'guests': guests,
+            'min_price': min_price,
+            'max_price': max_price,
+            'cabins': [dict(cabin) for cabin in results['cabins']],
+            'facets': [{'amenity': name, 'count': count} for name, count in results['facets']],
+        })
+    return render_template('client_search.html', cabins=results['cabins'] if searched else None,
+                           facets=results['facets'], **form)
 
 @app.route('/client/cabin/<int:cabin_id>')
 @login_required
 def cabin_detail(cabin_id):
-    db = get_db()
-    cabin = db.execute('SELECT * FROM cabins WHERE id = ?', (cabin_id,)).fetchone()
+    db = get_read_db()
+    cabin = catalog.get_cabin(db, cabin_id)
     
     if not cabin:
         flash('Cabin not found')
         return redirect(url_for('client_cabins'))
     
-    # Get reviews for this cabin
-    reviews = db.execute('''
-        SELECT r.*, u.name as user_name
-        FROM reviews r
-        JOIN users u ON r.user_id = u.id
-        WHERE r.cabin_id = ?
-        ORDER BY r.created_at DESC
-    ''', (cabin_id,)).fetchall()
+    # Get reviews for this cabin, one page at a time
+    page = reviews.review_page(db, cabin_id)
     
-    return render_template('cabin_detail.html', cabin=cabin, reviews=reviews)
+    return render_template('cabin_detail.html', cabin=cabin, reviews=page.rows, page=page)
+
+@app.route('/client/cabin/<int:cabin_id>/calendar')
+@login_required
+def cabin_calendar(cabin_id):
+    db = get_read_db()
+    cabin = catalog.get_cabin(db, cabin_id)
+    if not cabin:
+        return jsonify(error='Cabin not found'), 404
+    return jsonify(availability.cabin_calendar(db, cabin))
+
+@app.route('/client/cabin/<int:cabin_id>/quote', methods=['GET', 'POST'])
+@login_required
+def cabin_quote(cabin_id):
+    db = get_read_db()
+    cabin = catalog.get_cabin(db, cabin_id)
+    if not cabin:
+        return jsonify(error='Cabin not found'), 404
+    # POST {"quotes": [{check_in, check_out, guests, breakfast_included}, ...]} or one stay as query args
+    if request.method == 'POST':
+        stays = (request.get_json(silent=True) or {}).get('quotes')
+        if not isinstance(stays, list) or not all(isinstance(stay, dict) for stay in stays):
+            return jsonify(error='Expected {"quotes": [...]}'), 400
+        if len(stays) > availability.MAX_QUOTES:
+            return jsonify(error=f'At most {availability.MAX_QUOTES} quotes per request'), 400
+    else:
+        stays = [request.args.to_dict()]
+    quotes = [availability.quote(db, cabin, stay.get('check_in'), stay.get('check_out'),
+                                 stay.get('guests', 1), stay.get('breakfast_included') in (True, '1', 'true', 'on'))
+              for stay in stays]
+    return jsonify(quotes=quotes)
 
 @app.route('/client/cabin/<int:cabin_id>/book', methods=['GET', 'POST'])
 @login_required
 def book_cabin(cabin_id):
-    db = get_db()
-    cabin = db.execute('SELECT * FROM cabins WHERE id = ?', (cabin_id,)).fetchone()
+    cabin = catalog.get_cabin(get_read_db(), cabin_id)
     
     if not cabin:
         flash('Cabin not found')
@@ -412,40 +587,26 @@ def book_cabin(cabin_id):
             check_in_date = datetime.strptime(check_in, '%Y-%m-%d')
             check_out_date = datetime.strptime(check_out, '%Y-%m-%d')
             num_nights = (check_out_date - check_in_date).days
+            # Store canonical ISO dates so range comparisons in SQL stay correct
+            check_in = check_in_date.date().isoformat()
+            check_out = check_out_date.date().isoformat()
             
             if num_nights <= 0:
                 flash('Check-out date must be after check-in date')
                 return redirect(url_for('book_cabin', cabin_id=cabin_id))
             
-            cabin_price = float(cabin['price_per_night']) * num_nights
-            breakfast_price = 15 * num_nights * int(guests) if breakfast_included else 0
-            total_price = cabin_price + breakfast_price
-            
-            # Check if cabin is available
-            conflicting_bookings = db.execute('''
-                SELECT COUNT(*) as count FROM bookings 
-                WHERE cabin_id = ? 
-                AND status IN ("unconfirmed", "checked_in")
-                AND (
-                    (check_in <= ? AND check_out >= ?)
-                    OR (check_in <= ? AND check_out >= ?)
-                    OR (check_in >= ? AND check_out <= ?)
-                )
-            ''', (cabin_id, check_in, check_in, check_out, check_out, check_in, check_out)).fetchone()
+            total_price = availability.booking_total(cabin['price_per_night'], num_nights,
+                                                     guests, breakfast_included)
             
-            if conflicting_bookings['count'] > 0:
+            # Check availability and create the booking atomically
+            try:
+                availability.create_booking(get_db(), session['user_id'], cabin_id, check_in, check_out,
+                                            num_nights, guests, observations, breakfast_included,
+                                            total_price)
+            except availability.BookingConflict:
                 flash('Cabin is not available for selected dates')
                 return redirect(url_for('book_cabin', cabin_id=cabin_id))
             
-            # Create booking
-            db.execute('''
-                INSERT INTO bookings (user_id, cabin_id, check_in, check_out, num_nights, 
-                                    num_guests, observations, breakfast_included, total_price, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "unconfirmed")
-            ''', (session['user_id'], cabin_id, check_in, check_out, num_nights, 
-                  guests, observations, breakfast_included, total_price))
-            db.commit()
-            
             flash('Booking created successfully!')
             return redirect(url_for('client_bookings'))
         except (ValueError, TypeError) as e:
@@ -462,29 +623,16 @@ def book_cabin(cabin_id):
 @app.route('/client/bookings')
 @login_required
 def client_bookings():
-    db = get_db()
-    
-    bookings = db.execute('''
-        SELECT b.*, c.name as cabin_name, c.cabin_number, c.image_url
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        WHERE b.user_id = ?
-        ORDER BY b.created_at DESC
-    ''', (session['user_id'],)).fetchall()
-    
-    return render_template('client_bookings.html', bookings=bookings)
+    bookings, page = repository.list_user_bookings(get_read_db(), session['user_id'],
+                                                   stream=pagination.wants_stream())
+    if page is None:
+        return stream_template('client_bookings.html', bookings=bookings, page=None)
+    return render_template('client_bookings.html', bookings=bookings, page=page)
 
 @app.route('/client/booking/<int:booking_id>')
 @login_required
 def client_booking_detail(booking_id):
-    db = get_db()
-    
-    booking = db.execute('''
-        SELECT b.*, c.name as cabin_name, c.cabin_number, c.price_per_night, c.image_url
-        FROM bookings b
-        JOIN cabins c ON b.cabin_id = c.id
-        WHERE b.id = ? AND b.user_id = ?
-    ''', (booking_id, session['user_id'])).fetchone()
+    booking = repository.user_booking_detail(get_read_db(), booking_id, session['user_id'])
     
     if not booking:
         flash('Booking not found')
@@ -498,15 +646,14 @@ def cancel_booking(booking_id):
     db = get_db()
     
     # Verify booking belongs to user
-    booking = db.execute('SELECT * FROM bookings WHERE id = ? AND user_id = ?', 
-                        (booking_id, session['user_id'])).fetchone()
+    booking = repository.find_user_booking(get_read_db(), booking_id, session['user_id'])
     
     if not booking:
         flash('Booking not found')
         return redirect(url_for('client_bookings'))
     
-    db.execute('UPDATE bookings SET status = "cancelled" WHERE id = ?', (booking_id,))
-    db.commit()
+    writes.run(db, availability.set_status, booking_id, 'cancelled', session['user_id'])
+    availability.release_booking(booking_id)
     
     flash('Booking cancelled successfully')
     return redirect(url_for('client_bookings'))
@@ -517,10 +664,7 @@ def add_review(booking_id):
     db = get_db()
     
     # Verify booking belongs to user and is completed
-    booking = db.execute('''
-        SELECT * FROM bookings 
-        WHERE id = ? AND user_id = ? AND status = "checked_out"
-    ''', (booking_id, session['user_id'])).fetchone()
+    booking = repository.find_user_booking(get_read_db(), booking_id, session['user_id'], 'checked_out')
     
     if not booking:
         flash('Cannot review this booking')
@@ -529,23 +673,7 @@ def add_review(booking_id):
     rating = request.form.get('rating')
     comment = request.form.get('comment', '')
     
-    # Check if review already exists
-    existing_review = db.execute('''
-        SELECT id FROM reviews WHERE booking_id = ?
-    ''', (booking_id,)).fetchone()
-    
-    if existing_review:
-        db.execute('''
-            UPDATE reviews SET rating = ?, comment = ?
-            WHERE booking_id = ?
-        ''', (rating, comment, booking_id))
-    else:
-        db.execute('''
-            INSERT INTO reviews (user_id, cabin_id, booking_id, rating, comment)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session['user_id'], booking['cabin_id'], booking_id, rating, comment))
-    
-    db.commit()
+    writes.run(db, reviews.save_review, session['user_id'], booking['cabin_id'], booking_id, rating, comment)
     flash('Review submitted successfully')
     return redirect(url_for('client_booking_detail', booking_id=booking_id))
 
@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import current_app, request, abort, Response
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Directories under static/ that are fingerprinted and served from /assets/
+ASSET_DIRS = ('css', 'js')
+# A year is the practical maximum; fingerprinted URLs never change content
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/csv', 'application/json',
+                      'application/javascript', 'text/javascript', 'image/svg+xml'}
+
+
+class Asset:
+    """One static file, its fingerprinted name and its precompressed bodies"""
+
+    def __init__(self, logical, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(logical)
+        self.logical = logical
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.fingerprinted = f'{stem}.{digest}{ext}'
+        self.etag = digest
+        self.mimetype = mimetypes.guess_type(logical)[0] or 'application/octet-stream'
+        self.bodies = {'identity': data, 'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(data, quality=11)
+
+
+class AssetManifest:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._lock = threading.Lock()
+        self.by_logical = {}
+        self.by_fingerprint = {}
+        self.digest = ''
+        self.build()
+
+    def build(self):
+        by_logical = {}
+        for directory in ASSET_DIRS:
+            root = os.path.join(self.static_folder, directory)
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    logical = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                    by_logical[logical] = Asset(logical, path)
+        # Changes when any asset does, for validators of pages that link them
+        digest = hashlib.sha256(' '.join(sorted(a.fingerprinted for a in by_logical.values())).encode())
+        with self._lock:
+            self.by_logical = by_logical
+            self.by_fingerprint = {a.fingerprinted: a for a in by_logical.values()}
+            self.digest = digest.hexdigest()[:12]
+
+    def is_stale(self):
+        return any(not os.path.exists(a.path) or os.path.getmtime(a.path) != a.mtime
+                   for a in self.by_logical.values())
+
+
+def get_manifest():
+    manifest = current_app.extensions.get('assets')
+    if manifest is None:
+        manifest = AssetManifest(current_app.static_folder)
+        current_app.extensions['assets'] = manifest
+    elif current_app.debug and manifest.is_stale():
+        manifest.build()
+    return manifest
+
+
+def asset_url(logical):
+    """URL of the fingerprinted copy of static/<logical>, for templates"""
+    asset = get_manifest().by_logical.get(logical)
+    if asset is None:
+        return f'{current_app.static_url_path}/{logical}'
+    return f'/assets/{asset.fingerprinted}'
+
+
+def _best_encoding(available):
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+def serve_asset(filename):
+    asset = get_manifest().by_fingerprint.get(filename)
+    if asset is None:
+        abort(404)
+    encoding = _best_encoding(asset.bodies)
+    response = Response(asset.bodies[encoding], mimetype=asset.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f'{asset.etag}-{encoding}')
+    return response.make_conditional(request)
+
+
+def add_cache_headers(response):
+    # Uploaded images are never overwritten in place: a new upload gets a new name
+    if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('uploads/'):
+        response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def compress_response(response):
+    """Compress dynamic text responses above COMPRESS_MIN_SIZE on the fly"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = _best_encoding(('br', 'gzip') if brotli is not None else ('gzip',))
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=current_app.config['COMPRESS_BROTLI_QUALITY']))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL']))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    # A strong validator no longer matches once the bytes change
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
+    app.after_request(add_cache_headers)
+    app.after_request(compress_response)
@@ -0,0 +1,468 @@
+import json
+import threading
+import time
+from datetime import date, timedelta
+from bisect import bisect_left
+
+from flask import current_app
+
+try:
+    import numpy as np
+except ImportError:  # IntervalIndex.busy falls back to testing cabin by cabin
+    np = None
+
+import writes
+from catalog import CatalogCache
+
+# Bookings in these states hold the cabin for their dates
+BLOCKING_STATUSES = ('unconfirmed', 'checked_in')
+BOOKING_STATUSES = ('unconfirmed', 'checked_in', 'checked_out', 'cancelled')
+BREAKFAST_PRICE = 15  # per guest per night
+CALENDAR_DAYS = 366
+MAX_QUOTES = 100
+
+# Stays are half-open intervals [check_in, check_out): a guest checking out
+# on the 5th does not conflict with one checking in on the 5th.
+OVERLAP_SQL = '''
+    SELECT 1 FROM bookings
+    WHERE cabin_id = ?
+    AND status IN ("unconfirmed", "checked_in")
+    AND check_in < ? AND check_out > ?
+    LIMIT 1
+'''
+
+
+class BookingConflict(Exception):
+    pass
+
+
+# Per-cabin stamp bumped whenever a booking that could block the cabin's
+# dates is written, so a memoized calendar is dropped for that cabin only
+CALENDAR_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cabin_calendar_version (
+    cabin_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS calendar_bookings_insert AFTER INSERT ON bookings
+BEGIN
+    INSERT INTO cabin_calendar_version (cabin_id, version) VALUES (NEW.cabin_id, 1)
+    ON CONFLICT (cabin_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS calendar_bookings_update
+AFTER UPDATE OF check_in, check_out, status, cabin_id ON bookings
+BEGIN
+    INSERT INTO cabin_calendar_version (cabin_id, version) VALUES (OLD.cabin_id, 1)
+    ON CONFLICT (cabin_id) DO UPDATE SET version = version + 1;
+    INSERT INTO cabin_calendar_version (cabin_id, version) VALUES (NEW.cabin_id, 1)
+    ON CONFLICT (cabin_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS calendar_bookings_delete AFTER DELETE ON bookings
+BEGIN
+    INSERT INTO cabin_calendar_version (cabin_id, version) VALUES (OLD.cabin_id, 1)
+    ON CONFLICT (cabin_id) DO UPDATE SET version = version + 1;
+END;
+'''
+
+
+def booking_total(price_per_night, num_nights, num_guests, breakfast_included):
+    """Price of a stay: the nightly rate plus breakfast per guest per night"""
+    cabin_price = float(price_per_night) * num_nights
+    breakfast_price = BREAKFAST_PRICE * num_nights * int(num_guests) if breakfast_included else 0
+    return cabin_price + breakfast_price
+
+
+def ensure_schema(db):
+    db.executescript(CALENDAR_SCHEMA)
+
+
+def ensure_indexes(db):
+    """Create the indexes used by overlap detection"""
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_cabin_status_dates
+        ON bookings (cabin_id, status, check_in, check_out)
+    ''')
+    # Covering index for the multi-cabin search, plus (status, num_nights)
+    # so the longest blocking stay (which bounds the check_in range) is one
+    # seek per status.
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_status_dates_cabin
+        ON bookings (status, check_in, check_out, cabin_id)
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_status_nights ON bookings (status, num_nights)')
+
+
+class IntervalIndex:
+    """Per-cabin sorted booking intervals held in memory
+
+    For each cabin the blocking stays are kept sorted by check-in, together
+    with a running maximum of their check-out dates. A range [start, end) is
+    free when every stay starting before ``end`` has already ended by
+    ``start``, which is one bisect plus one lookup. The cabins taken during
+    a range are that same test for every cabin, run over a numpy snapshot
+    of all the cabins' stays that is rebuilt only after the stays change.
+
+    Other workers write bookings this process never sees. refresh() reads
+    the bookings_version stamp at most once per ``max_age`` seconds and,
+    when it has moved, reloads just the cabins whose cabin_calendar_version
+    differs from the one their stays were loaded at.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cabins = {}
+        self._owner = {}
+        self._versions = {}
+        self._stamp = None
+        self._checked = 0.0
+        self._snapshot = None
+
+    def warm(self, db):
+        # Stamps first: a write landing between the reads leaves stamps
+        # older than the rows, which only costs one extra reload
+        stamp = _bookings_stamp(db)
+        versions = dict(db.execute('SELECT cabin_id, version FROM cabin_calendar_version').fetchall())
+        stays = _stays_by_cabin(db.execute('''
+            SELECT id, cabin_id, check_in, check_out FROM bookings
+            WHERE status IN ("unconfirmed", "checked_in")
+        '''))
+        with self._lock:
+            self._cabins.clear()
+            self._owner.clear()
+            for cabin_id, cabin_stays in stays.items():
+                self._load(cabin_id, cabin_stays)
+            self._versions = versions
+            self._stamp = stamp
+            self._checked = time.monotonic()
+
+    def refresh(self, db, max_age=0.0):
+        """Reload the cabins whose bookings changed, if ``max_age`` seconds passed since the last look"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked < max_age:
+                return
+            self._checked = now
+        stamp = _bookings_stamp(db)
+        if stamp == self._stamp:
+            return
+        versions = dict(db.execute('SELECT cabin_id, version FROM cabin_calendar_version').fetchall())
+        with self._lock:
+            changed = [cabin_id for cabin_id, version in versions.items()
+                       if self._versions.get(cabin_id, 0) != version]
+        stays = _stays_by_cabin(db.execute('''
+            SELECT id, cabin_id, check_in, check_out FROM bookings
+            WHERE cabin_id IN (SELECT value FROM json_each(?))
+            AND status IN ("unconfirmed", "checked_in")
+        ''', (json.dumps(changed),))) if changed else {}
+        with self._lock:
+            for cabin_id in changed:
+                self._load(cabin_id, stays.get(cabin_id, ()))
+                self._versions[cabin_id] = versions[cabin_id]
+            self._stamp = stamp
+
+    def invalidate(self, cabin_id):
+        """Make the next refresh() run now and reload ``cabin_id`` whatever its version"""
+        with self._lock:
+            self._versions[cabin_id] = None
+            self._stamp = None
+            self._checked = 0.0
+
+    def _load(self, cabin_id, stays):
+        # Replace the cabin's stays; the caller holds the lock. Everything
+        # kept per cabin is a tuple of strings and ints, which the garbage
+        # collector stops tracking, so a million stays add nothing to the
+        # full collections that run while requests are served.
+        old = self._cabins.pop(cabin_id, None)
+        for _, _, booking_id in old['stays'] if old else ():
+            self._owner.pop(booking_id, None)
+        self._snapshot = None
+        if not stays:
+            return
+        stays = tuple(sorted(stays))
+        max_end = []
+        latest = ''
+        for _, check_out, booking_id in stays:
+            latest = max(latest, check_out)
+            max_end.append(latest)
+            self._owner[booking_id] = cabin_id
+        self._cabins[cabin_id] = {'stays': stays, 'starts': tuple(stay[0] for stay in stays),
+                                  'max_end': tuple(max_end), 'arrays': None}
+
+    def add(self, cabin_id, check_in, check_out, booking_id):
+        with self._lock:
+            entry = self._cabins.get(cabin_id)
+            self._load(cabin_id, (entry['stays'] if entry else ()) + ((check_in, check_out, booking_id),))
+
+    def remove(self, booking_id):
+        with self._lock:
+            cabin_id = self._owner.get(booking_id)
+            if cabin_id is None:
+                return
+            self._load(cabin_id, tuple(s for s in self._cabins[cabin_id]['stays'] if s[2] != booking_id))
+
+    @staticmethod
+    def _free(entry, check_in, check_out):
+        pos = bisect_left(entry['starts'], check_out)
+        return pos == 0 or entry['max_end'][pos - 1] <= check_in
+
+    def is_free(self, cabin_id, check_in, check_out):
+        with self._lock:
+            entry = self._cabins.get(cabin_id)
+            return not entry or self._free(entry, check_in, check_out)
+
+    def busy(self, check_in, check_out):
+        """Ids of the cabins with a blocking stay during [check_in, check_out)"""
+        with self._lock:
+            if np is None:
+                return [cabin_id for cabin_id, entry in self._cabins.items()
+                        if not self._free(entry, check_in, check_out)]
+            if self._snapshot is None:
+                self._snapshot = self._build_snapshot()
+            cabin_ids, offsets, starts, max_end = self._snapshot
+        if not len(cabin_ids):
+            return []
+        # Per cabin, how many stays start before check_out; the running
+        # maximum check-out of the last of them decides the overlap
+        before = np.add.reduceat(starts < np.datetime64(check_out[:10], 'D'), offsets)
+        last = max_end[np.maximum(offsets + before - 1, 0)]
+        return cabin_ids[(before > 0) & (last > np.datetime64(check_in[:10], 'D'))].tolist()
+
+    def _build_snapshot(self):
+        # Each cabin's arrays are converted once and reused until its stays
+        # change, so a rebuild after a booking is mostly one concatenate
+        cabin_ids, starts, max_end = [], [], []
+        for cabin_id, entry in self._cabins.items():
+            if entry['arrays'] is None:
+                entry['arrays'] = (np.array([day[:10] for day in entry['starts']], dtype='datetime64[D]'),
+                                   np.array([day[:10] for day in entry['max_end']], dtype='datetime64[D]'))
+            cabin_ids.append(cabin_id)
+            starts.append(entry['arrays'][0])
+            max_end.append(entry['arrays'][1])
+        if not cabin_ids:
+            return np.array([], dtype=np.int64), None, None, None
+        offsets = np.cumsum([0] + [len(days) for days in starts[:-1]])
+        return np.array(cabin_ids, dtype=np.int64), offsets, np.concatenate(starts), np.concatenate(max_end)
+
+
+def _stays_by_cabin(rows):
+    stays = {}
+    for row in rows:
+        stays.setdefault(row['cabin_id'], []).append((row['check_in'], row['check_out'], row['id']))
+    return stays
+
+
+def _bookings_stamp(db):
+    # Bumped by the analytics triggers on every booking write
+    row = db.execute('SELECT version FROM bookings_version WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+
+def get_index(db):
+    """Return the warmed, recently refreshed interval index, or None when it is disabled
+
+    The index is checked against the database at most once per
+    AVAILABILITY_INDEX_MAX_AGE seconds; this worker's own booking writes
+    make the next call check at once.
+    """
+    if not current_app.config.get('AVAILABILITY_INDEX'):
+        return None
+    index = current_app.extensions.get('availability_index')
+    if index is None:
+        index = IntervalIndex()
+        index.warm(db)
+        current_app.extensions['availability_index'] = index
+    else:
+        index.refresh(db, current_app.config.get('AVAILABILITY_INDEX_MAX_AGE', 1.0))
+    return index
+
+
+def is_available(db, cabin_id, check_in, check_out):
+    index = get_index(db)
+    if index is not None:
+        return index.is_free(cabin_id, check_in, check_out)
+    return db.execute(OVERLAP_SQL, (cabin_id, check_out, check_in)).fetchone() is None
+
+
+def insert_booking(db, user_id, cabin_id, check_in, check_out, num_nights, num_guests,
+                   observations, breakfast_included, total_price):
+    """Check for overlaps and insert the booking; the caller holds the write transaction
+
+    Raises BookingConflict when the dates are taken.
+    """
+    if db.execute(OVERLAP_SQL, (cabin_id, check_out, check_in)).fetchone():
+        raise BookingConflict()
+    return db.execute('''
+        INSERT INTO bookings (user_id, cabin_id, check_in, check_out, num_nights,
+                            num_guests, observations, breakfast_included, total_price, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "unconfirmed")
+    ''', (user_id, cabin_id, check_in, check_out, num_nights,
+          num_guests, observations, breakfast_included, total_price)).lastrowid
+
+
+def create_booking(db, user_id, cabin_id, check_in, check_out, num_nights, num_guests,
+                   observations, breakfast_included, total_price):
+    """Check for overlaps and insert the booking in one write transaction
+
+    The write lock is held from before the overlap check until the commit,
+    whether the transaction is run here or by the write queue, so two
+    concurrent requests for the same dates cannot both pass it.
+    Raises BookingConflict when the dates are taken.
+    """
+    # Only the locked query decides: an in-memory index can lag behind
+    # bookings written or cancelled by other workers
+    booking_id = writes.run(db, insert_booking, user_id, cabin_id, check_in, check_out, num_nights,
+                            num_guests, observations, breakfast_included, total_price)
+    index = current_app.extensions.get('availability_index')
+    if index is not None:
+        index.invalidate(cabin_id)
+    return booking_id
+
+
+def set_status(db, booking_id, status, user_id=None):
+    """Move a booking to ``status``, optionally only if it belongs to ``user_id``; returns rows changed"""
+    if user_id is None:
+        changed = db.execute('UPDATE bookings SET status = ? WHERE id = ?', (status, booking_id)).rowcount
+    else:
+        changed = db.execute('UPDATE bookings SET status = ? WHERE id = ? AND user_id = ?',
+                             (status, booking_id, user_id)).rowcount
+    index = current_app.extensions.get('availability_index')
+    if changed and index is not None and status in BLOCKING_STATUSES:
+        # A booking moving back into a blocking status (say, a cancelled
+        # one checked in) was released from the index; reload its cabin
+        row = db.execute('SELECT cabin_id FROM bookings WHERE id = ?', (booking_id,)).fetchone()
+        index.invalidate(row[0])
+    return changed
+
+
+def delete_booking(db, booking_id):
+    return db.execute('DELETE FROM bookings WHERE id = ?', (booking_id,)).rowcount
+
+
+def release_booking(booking_id):
+    """Forget a booking that no longer blocks its cabin (cancelled, checked out, deleted)"""
+    index = current_app.extensions.get('availability_index')
+    if index is not None:
+        index.remove(booking_id)
+
+
+def longest_stay(db, statuses=BLOCKING_STATUSES, table='bookings'):
+    """Nights in the longest stay in ``table`` with one of ``statuses``, 0 when there is none"""
+    # One MAX per status, so each is a single seek on (status, num_nights)
+    seeks = ', '.join(f'COALESCE((SELECT MAX(num_nights) FROM {table} WHERE status = ?), 0)'
+                      for _ in statuses)
+    return db.execute(f'SELECT MAX({seeks}, 0)', statuses).fetchone()[0]
+
+
+def busy_cabins(db, check_in, check_out):
+    """SQL subquery (and its parameters) selecting cabins taken during [check_in, check_out)
+
+    No blocking stay is longer than the longest blocking one on record, so
+    only bookings that start within that many nights before ``check_in``
+    can overlap; bounding check_in on both sides keeps the index range
+    small however far ahead guests book. Cancelled and past stays are left
+    out of the bound, so one long stay that no longer blocks cannot widen
+    every search.
+    """
+    longest = longest_stay(db)
+    earliest = (date.fromisoformat(check_in) - timedelta(days=longest)).isoformat()
+    return '''
+        SELECT cabin_id FROM bookings
+        WHERE status IN ("unconfirmed", "checked_in")
+        AND check_in >= ? AND check_in < ? AND check_out > ?
+    ''', [earliest, check_out, check_in]
+
+
+def get_calendar_cache():
+    cache = current_app.extensions.get('calendar_cache')
+    database = current_app.config['DATABASE']
+    if cache is None or cache.database != database:
+        cache = CatalogCache(max_entries=current_app.config.get('CALENDAR_CACHE_MAX_ENTRIES', 1024))
+        cache.database = database
+        current_app.extensions['calendar_cache'] = cache
+    return cache
+
+
+def _calendar_version(db, cabin_id):
+    row = db.execute('SELECT version FROM cabin_calendar_version WHERE cabin_id = ?', (cabin_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def _load_bitmap(db, cabin_id, start, days):
+    end = start + timedelta(days=days)
+    bitmap = bytearray(days)
+    for check_in, check_out in db.execute('''
+        SELECT substr(check_in, 1, 10), substr(check_out, 1, 10) FROM bookings
+        WHERE cabin_id = ?
+        AND status IN ("unconfirmed", "checked_in")
+        AND check_in < ? AND check_out > ?
+    ''', (cabin_id, end.isoformat(), start.isoformat())):
+        first = max(0, (date.fromisoformat(check_in) - start).days)
+        last = min(days, (date.fromisoformat(check_out) - start).days)
+        if last > first:
+            bitmap[first:last] = b'\x01' * (last - first)
+    return bytes(bitmap)
+
+
+def occupancy_bitmap(db, cabin_id, start, days=CALENDAR_DAYS):
+    """One byte per night from ``start``: 1 when a blocking booking holds it
+
+    Memoized per cabin until one of its bookings changes.
+    """
+    return get_calendar_cache().get((cabin_id, start, days), _calendar_version(db, cabin_id),
+                                    lambda: _load_bitmap(db, cabin_id, start, days))
+
+
+def cabin_calendar(db, cabin, start=None, days=CALENDAR_DAYS):
+    """Day-by-day availability and nightly price for ``cabin``, plus the blocked ranges"""
+    start = start or date.today()
+    bitmap = occupancy_bitmap(db, cabin['id'], start, days)
+    price = float(cabin['price_per_night'])
+    calendar, blocked = [], []
+    for offset, taken in enumerate(bitmap):
+        day = (start + timedelta(days=offset)).isoformat()
+        calendar.append({'date': day, 'available': not taken, 'price': price})
+        if taken:
+            if blocked and blocked[-1]['end'] == day:
+                blocked[-1]['end'] = (start + timedelta(days=offset + 1)).isoformat()
+            else:
+                blocked.append({'start': day, 'end': (start + timedelta(days=offset + 1)).isoformat()})
+    return {
+        'cabin_id': cabin['id'],
+        'start': start.isoformat(),
+        'end': (start + timedelta(days=days)).isoformat(),
+        'price_per_night': price,
+        'breakfast_price': BREAKFAST_PRICE,
+        'capacity': cabin['capacity'],
+        'days': calendar,
+        'blocked': blocked,
+    }
+
+
+def quote(db, cabin, check_in, check_out, guests=1, breakfast_included=False, start=None):
+    """Price and availability of one stay, answered from the bitmap where it reaches"""
+    result = {'check_in': check_in, 'check_out': check_out, 'guests': guests,
+              'breakfast_included': bool(breakfast_included)}
+    try:
+        first = date.fromisoformat(str(check_in))
+        last = date.fromisoformat(str(check_out))
+        guests = int(guests)
+    except (TypeError, ValueError):
+        return dict(result, error='check_in and check_out must be YYYY-MM-DD, guests a number')
+    nights = (last - first).days
+    start = start or date.today()
+    if nights <= 0:
+        return dict(result, error='check_out must be after check_in')
+    if first < start:
+        return dict(result, error='check_in is in the past')
+    if not 1 <= guests <= cabin['capacity']:
+        return dict(result, error=f'guests must be between 1 and {cabin["capacity"]}')
+    offset = (first - start).days
+    if offset + nights <= CALENDAR_DAYS:
+        bitmap = occupancy_bitmap(db, cabin['id'], start)
+        free = not any(bitmap[offset:offset + nights])
+    else:
+        free = is_available(db, cabin['id'], first.isoformat(), last.isoformat())
+    return dict(result, guests=guests, nights=nights, available=free,
+                total=booking_total(cabin['price_per_night'], nights, guests, breakfast_included))
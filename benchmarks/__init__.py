@@ -0,0 +1,14 @@
+"""Benchmark and load-test tooling for RentBnb
+
+datagen  - fill a database with seeded synthetic data at a chosen scale
+driver   - replay a weighted mix of routes and report latency, throughput
+           and per-route query counts as JSON
+search_availability, login_throughput, write_throughput, render_cache -
+           focused single-feature benchmarks
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.datagen --db /tmp/bench.db --cabins 10000 --bookings 1000000
+    python -m benchmarks.driver --db /tmp/bench.db --requests 5000 --out run.json
+    python -m benchmarks.driver --db /tmp/bench.db --compare run.json
+"""
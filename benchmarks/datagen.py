@@ -0,0 +1,195 @@
+"""Seeded synthetic data generator for the RentBnb schema
+
+Usage: python -m benchmarks.datagen --db /tmp/bench.db --cabins 10000 \\
+           --bookings 1000000 --reviews 200000 --users 50000
+
+Bookings are laid out per cabin as a non-overlapping timeline around
+today: stays that have ended are checked out (or cancelled), the current
+one is checked in and future ones are unconfirmed. Every generated user,
+and the admin account, has the password given by --password.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+ADMIN_EMAIL = 'admin@wildoasis.com'
+DEFAULT_PASSWORD = 'benchmark'
+
+NAMES = ['Pine', 'Cedar', 'Birch', 'Maple', 'Aspen', 'Willow', 'Spruce', 'Oak', 'Alder', 'Elm']
+PLACES = ['Ridge', 'Hollow', 'Lake', 'Creek', 'Meadow', 'Summit', 'Grove', 'Bay', 'Canyon', 'Falls']
+AMENITIES = ['WiFi', 'Kitchen', 'Fireplace', 'Hot Tub', 'BBQ', 'Boat Dock', 'Hiking Trails',
+             'Game Room', 'Fire Pit', 'Deck', 'Hammock', 'Sauna', 'Lakeside', 'Pet Friendly']
+WORDS = ['cozy', 'quiet', 'rustic', 'spacious', 'bright', 'secluded', 'modern', 'charming',
+         'views', 'forest', 'lake', 'mountain', 'porch', 'stars', 'river', 'family']
+CHUNK = 50000
+
+
+def _chunks(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bulk_insert(db, sql, rows):
+    for batch in _chunks(rows):
+        db.executemany(sql, batch)
+
+
+def _timestamp(day, rng):
+    return datetime.combine(day, datetime.min.time()).replace(
+        hour=rng.randrange(24), minute=rng.randrange(60), second=rng.randrange(60)
+    ).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate(path, cabins=1000, bookings=100000, reviews=20000, users=5000,
+             seed=1, password=DEFAULT_PASSWORD, verbose=True):
+    """Create ``path`` with the schema and the requested amount of data
+
+    Raw rows are loaded with synchronous writes off and no secondary
+    indexes or triggers; the app's own schema setup then builds indexes,
+    triggers and the precomputed aggregates in one pass at the end.
+    """
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    def log(message):
+        if verbose:
+            print(f'[{time.perf_counter() - started:6.1f}s] {message}', flush=True)
+
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode = off')
+    db.execute('PRAGMA synchronous = off')
+    db.execute('PRAGMA cache_size = -262144')
+    with open(os.path.join(ROOT, 'schema.sql')) as f:
+        db.executescript(f.read())
+    db.execute('DELETE FROM cabins')
+    db.execute('DELETE FROM users WHERE id != 1')
+
+    # One real hash shared by every account keeps generation fast
+    pwhash = generate_password_hash(password)
+    db.execute('UPDATE users SET password = ?, email = ? WHERE id = 1', (pwhash, ADMIN_EMAIL))
+    today = date.today()
+    _bulk_insert(db, '''
+        INSERT INTO users (id, name, email, password, phone, role, created_at)
+        VALUES (?, ?, ?, ?, ?, 'client', ?)
+    ''', ((i + 2, f'Guest {i}', f'guest{i}@example.com', pwhash, f'+1555{i:07d}',
+           _timestamp(today - timedelta(days=rng.randrange(1500, 2000)), rng))
+          for i in range(users)))
+    log(f'{users} users')
+
+    def cabin_rows():
+        for i in range(cabins):
+            amenities = ', '.join(rng.sample(AMENITIES, rng.randint(2, 6)))
+            description = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize()
+            yield (i + 1, f'{rng.choice(NAMES)} {rng.choice(PLACES)} {i}', f'C{i:06d}',
+                   rng.randint(2, 10), float(rng.randint(80, 600)), description, amenities, None)
+
+    _bulk_insert(db, '''
+        INSERT INTO cabins (id, name, cabin_number, capacity, price_per_night,
+                            description, amenities, image_url)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', cabin_rows())
+    prices = dict(db.execute('SELECT id, price_per_night FROM cabins'))
+    capacities = dict(db.execute('SELECT id, capacity FROM cabins'))
+    log(f'{cabins} cabins')
+
+    # The first ``extra`` cabins take one more booking, so the total is exact
+    per_cabin, extra = divmod(bookings, max(cabins, 1))
+    # Average stay plus gap is ~6 nights; put about a quarter of the timeline in the future
+    span = (per_cabin + (extra > 0)) * 6
+    checked_out = []
+
+    def booking_rows():
+        booking_id = 0
+        for cabin_id in range(1, cabins + 1):
+            day = today - timedelta(days=int(span * 0.75) + rng.randrange(7))
+            price = prices[cabin_id]
+            for _ in range(per_cabin + (cabin_id <= extra)):
+                booking_id += 1
+                day += timedelta(days=rng.randint(0, 4))
+                nights = rng.randint(1, 7)
+                check_out = day + timedelta(days=nights)
+                guests = rng.randint(1, capacities[cabin_id])
+                breakfast = rng.random() < 0.3
+                total = price * nights + (15 * nights * guests if breakfast else 0)
+                if check_out <= today:
+                    status = 'checked_out' if rng.random() < 0.9 else 'cancelled'
+                elif day <= today:
+                    status = 'checked_in'
+                else:
+                    status = 'unconfirmed' if rng.random() < 0.92 else 'cancelled'
+                user_id = rng.randint(2, users + 1)
+                if status == 'checked_out':
+                    checked_out.append((booking_id, user_id, cabin_id, check_out))
+                created = _timestamp(day - timedelta(days=rng.randint(1, 90)), rng)
+                yield (booking_id, user_id, cabin_id, day.isoformat(), check_out.isoformat(), nights,
+                       guests, '', breakfast, total, status, created)
+                day = check_out
+
+    _bulk_insert(db, '''
+        INSERT INTO bookings (id, user_id, cabin_id, check_in, check_out, num_nights, num_guests,
+                              observations, breakfast_included, total_price, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', booking_rows())
+    log(f'{db.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]} bookings')
+
+    reviewed = rng.sample(checked_out, min(reviews, len(checked_out)))
+
+    def review_rows():
+        for booking_id, user_id, cabin_id, check_out in reviewed:
+            rating = rng.choices([1, 2, 3, 4, 5], weights=[3, 5, 12, 35, 45])[0]
+            comment = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))).capitalize()
+            yield (user_id, cabin_id, booking_id, rating, comment,
+                   _timestamp(check_out + timedelta(days=rng.randint(0, 10)), rng))
+
+    _bulk_insert(db, '''
+        INSERT INTO reviews (user_id, cabin_id, booking_id, rating, comment, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', review_rows())
+    db.commit()
+    log(f'{len(reviewed)} reviews')
+
+    # Indexes, triggers and aggregates exactly as the app creates them
+    import app as rentbnb
+    db.row_factory = sqlite3.Row
+    rentbnb.prepare_db(db)
+    db.execute('ANALYZE')
+    db.commit()
+    db.execute('PRAGMA journal_mode = wal')
+    db.close()
+    log('indexes, triggers and aggregates built')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='Database file to create (overwritten)')
+    parser.add_argument('--cabins', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    args = parser.parse_args()
+    generate(args.db, args.cabins, args.bookings, args.reviews, args.users, args.seed, args.password)
+
+
+if __name__ == '__main__':
+    main()
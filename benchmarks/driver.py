@@ -0,0 +1,335 @@
+"""Replay a weighted mix of RentBnb routes and report per-route performance
+
+Usage:
+    python -m benchmarks.driver --db /tmp/bench.db --requests 5000 --out run.json
+    python -m benchmarks.driver --db /tmp/bench.db --compare run.json
+    python -m benchmarks.driver --url http://127.0.0.1:5000 --processes 8 --requests 5000
+
+By default requests go through the Flask test client in this process, which
+also lets the driver count SQL statements per request. With --url the same
+mix is sent over HTTP from several processes instead (no query counts).
+The database must have been created by benchmarks.datagen; in-process runs
+work on a copy of it, so repeated runs see the same data.
+"""
+import argparse
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.datagen import ADMIN_EMAIL, DEFAULT_PASSWORD  # noqa: E402
+
+# Route name -> relative weight in the mix
+DEFAULT_MIX = {
+    'client_dashboard': 30,
+    'cabin_detail': 30,
+    'book_cabin': 10,
+    'admin_dashboard': 10,
+    'admin_bookings': 20,
+}
+CLIENT_SESSIONS = 8
+REGRESSION_THRESHOLD = 0.10
+
+_local = threading.local()
+
+
+def _count_statement(statement):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Workload:
+    """Picks the next request from the mix; identical for both transports"""
+
+    def __init__(self, cabin_ids, num_users, mix, seed):
+        self.cabin_ids = cabin_ids
+        self.num_users = num_users
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.rng = random.Random(seed)
+
+    def next(self):
+        route = self.rng.choices(self.names, self.weights)[0]
+        cabin_id = self.rng.choice(self.cabin_ids)
+        if route == 'client_dashboard':
+            return route, 'GET', '/client/dashboard', None
+        if route == 'cabin_detail':
+            return route, 'GET', f'/client/cabin/{cabin_id}', None
+        if route == 'book_cabin':
+            check_in = date.today() + timedelta(days=self.rng.randint(1, 365))
+            nights = self.rng.randint(1, 7)
+            form = {'check_in': check_in.isoformat(),
+                    'check_out': (check_in + timedelta(days=nights)).isoformat(),
+                    'guests': str(self.rng.randint(1, 4))}
+            return route, 'POST', f'/client/cabin/{cabin_id}/book', form
+        if route == 'admin_dashboard':
+            return route, 'GET', '/admin/dashboard', None
+        if route == 'admin_bookings':
+            status = self.rng.choice(['all', 'all', 'unconfirmed', 'checked_in', 'checked_out'])
+            return route, 'GET', f'/admin/bookings?status={status}', None
+        raise ValueError(route)
+
+
+def _database_shape(path):
+    db = sqlite3.connect(path)
+    try:
+        cabin_ids = [row[0] for row in db.execute('SELECT id FROM cabins')]
+        num_users = db.execute("SELECT COUNT(*) FROM users WHERE role = 'client'").fetchone()[0]
+        counts = {table: db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('cabins', 'bookings', 'reviews', 'users')}
+    finally:
+        db.close()
+    return cabin_ids, num_users, counts
+
+
+def _snapshot(path, folder):
+    # Bookings made during a run would change the next run's dataset, so
+    # every in-process run works on its own copy
+    copy = os.path.join(folder, os.path.basename(path))
+    source, target = sqlite3.connect(path), sqlite3.connect(copy)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return copy
+
+
+def run_in_process(args, mix):
+    os.chdir(ROOT)
+    import app as rentbnb
+
+    app = rentbnb.app
+    app.config['DATABASE'] = _snapshot(args.db, tempfile.mkdtemp(prefix='rentbnb-bench-'))
+    app.config['DB_TRACE'] = _count_statement
+    cabin_ids, num_users, counts = _database_shape(args.db)
+
+    def session(email):
+        client = app.test_client()
+        client.post('/login', data={'email': email, 'password': args.password})
+        return client
+
+    admin = session(ADMIN_EMAIL)
+    clients = [session(f'guest{i}@example.com') for i in range(min(CLIENT_SESSIONS, num_users))]
+
+    samples = {}
+    lock = threading.Lock()
+    per_thread = args.requests // args.concurrency
+
+    def worker(seed):
+        workload = Workload(cabin_ids, num_users, mix, seed)
+        rng = random.Random(seed)
+        for i in range(per_thread + (1 if seed < args.requests % args.concurrency else 0)):
+            route, method, url, form = workload.next()
+            client = admin if route.startswith('admin') else rng.choice(clients)
+            _local.queries = 0
+            t0 = time.perf_counter()
+            response = client.open(url, method=method, data=form)
+            response.get_data()
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                samples.setdefault(route, []).append((elapsed, response.status_code, _local.queries))
+
+    # Warm caches and connections so the first requests don't skew p99
+    warm = Workload(cabin_ids, num_users, mix, -1)
+    for _ in range(min(50, args.requests)):
+        route, method, url, form = warm.next()
+        if method == 'GET':
+            (admin if route.startswith('admin') else clients[0]).get(url).get_data()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started, counts
+
+
+def _http_worker(job):
+    base_url, password, cabin_ids, num_users, mix, seed, count = job
+
+    def opener(email):
+        jar = http.cookiejar.CookieJar()
+        op = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect)
+        data = urllib.parse.urlencode({'email': email, 'password': password}).encode()
+        try:
+            op.open(base_url + '/login', data=data)
+        except urllib.error.HTTPError:
+            pass
+        return op
+
+    admin = opener(ADMIN_EMAIL)
+    client = opener(f'guest{seed % max(num_users, 1)}@example.com')
+    workload = Workload(cabin_ids, num_users, mix, seed)
+    samples = {}
+    for _ in range(count):
+        route, method, url, form = workload.next()
+        op = admin if route.startswith('admin') else client
+        data = urllib.parse.urlencode(form).encode() if form else None
+        t0 = time.perf_counter()
+        try:
+            with op.open(base_url + url, data=data) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        samples.setdefault(route, []).append(((time.perf_counter() - t0) * 1000, status, None))
+    return samples
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Measure the handler itself, not the page a POST redirects to
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def run_over_http(args, mix):
+    cabin_ids, num_users, counts = _database_shape(args.db)
+    per_process = args.requests // args.processes
+    jobs = [(args.url.rstrip('/'), args.password, cabin_ids, num_users, mix, n,
+             per_process + (1 if n < args.requests % args.processes else 0))
+            for n in range(args.processes)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(_http_worker, jobs)
+    elapsed = time.perf_counter() - started
+    samples = {}
+    for result in results:
+        for route, rows in result.items():
+            samples.setdefault(route, []).extend(rows)
+    return samples, elapsed, counts
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    total = 0
+    for route, rows in sorted(samples.items()):
+        latencies = sorted(r[0] for r in rows)
+        queries = [r[2] for r in rows if r[2] is not None]
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        total += len(rows)
+        routes[route] = {
+            'requests': len(rows),
+            'throughput_rps': len(rows) / elapsed if elapsed else None,
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'p99_ms': _percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'queries_per_request': sum(queries) / len(queries) if queries else None,
+            'statuses': statuses,
+        }
+    return {'elapsed_s': elapsed, 'requests': total,
+            'throughput_rps': total / elapsed if elapsed else None, 'routes': routes}
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['elapsed_s']:.1f}s "
+          f"({report['throughput_rps']:.1f} req/s)")
+    print(f"{'route':<18}{'reqs':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}  statuses")
+    for route, r in report['routes'].items():
+        queries = f"{r['queries_per_request']:.1f}" if r['queries_per_request'] is not None else '-'
+        print(f"{route:<18}{r['requests']:>7}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.2f}"
+              f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{queries:>9}  {r['statuses']}")
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print per-route deltas against a saved run; return the regressed routes"""
+    regressions = []
+    print(f"\ncompared with {baseline.get('label') or 'baseline'}:")
+    for route, r in report['routes'].items():
+        base = baseline['routes'].get(route)
+        if not base:
+            continue
+        parts = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+            if r[key] is None or not base.get(key):
+                continue
+            change = (r[key] - base[key]) / base[key]
+            parts.append(f'{key} {change:+.0%}')
+            if key in ('p95_ms', 'queries_per_request') and change > threshold:
+                regressions.append(route)
+        print(f'  {route:<18}' + '  '.join(parts))
+    return sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='Database created by benchmarks.datagen')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1, help='Threads (in-process mode)')
+    parser.add_argument('--url', help='Send requests over HTTP to a running server instead')
+    parser.add_argument('--processes', type=int, default=4, help='Client processes (HTTP mode)')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--mix', help='Route weights, e.g. cabin_detail=5,book_cabin=1')
+    parser.add_argument('--label', help='Name stored with the results')
+    parser.add_argument('--out', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON to compare against; exit 1 on regression')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix = {name: float(weight) for name, weight in
+               (item.split('=') for item in args.mix.split(','))}
+        unknown = set(mix) - set(DEFAULT_MIX)
+        if unknown:
+            parser.error(f'unknown routes in --mix: {", ".join(sorted(unknown))}')
+
+    if args.url:
+        samples, elapsed, counts = run_over_http(args, mix)
+    else:
+        samples, elapsed, counts = run_in_process(args, mix)
+
+    report = summarize(samples, elapsed)
+    report.update({
+        'label': args.label,
+        'mode': 'http' if args.url else 'in-process',
+        'concurrency': args.processes if args.url else args.concurrency,
+        'mix': mix,
+        'dataset': counts,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    print_report(report)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nresults written to {args.out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f'\nREGRESSION in {", ".join(regressions)} (> {args.threshold:.0%})')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
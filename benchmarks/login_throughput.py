@@ -0,0 +1,113 @@
+"""Measure login throughput against concurrent page loads
+
+Usage: python benchmarks/login_throughput.py --login-threads 16 --page-threads 4
+
+Runs the app in-process on a throwaway database. Login threads post valid
+credentials while page threads load the cabin catalog, first with hashing
+inline in the request threads (workers=0) and then through the hashing
+process pool. Reports logins/sec, pages/sec, page latency and how many
+logins were shed with 503.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run(app, workers, args, emails):
+    import passwords
+    old = app.extensions.pop('password_hasher', None)
+    if old is not None:
+        old.shutdown()
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    app.config['LOGIN_MAX_FAILURES'] = 10 ** 9
+    app.extensions.pop('login_throttle', None)
+
+    counts = {'login': 0, 'shed': 0, 'page': 0}
+    page_times = []
+    lock = threading.Lock()
+    stop = time.monotonic() + args.seconds
+
+    def login_loop(n):
+        client = app.test_client()
+        email = emails[n % len(emails)]
+        while time.monotonic() < stop:
+            status = client.post('/login', data={'email': email, 'password': 'secret'}).status_code
+            with lock:
+                counts['login' if status == 302 else 'shed'] += 1
+
+    # Page clients sign in before the clock starts
+    page_clients = []
+    for _ in range(args.page_threads):
+        client = app.test_client()
+        client.post('/login', data={'email': emails[0], 'password': 'secret'})
+        page_clients.append(client)
+
+    def page_loop(client):
+        while time.monotonic() < stop:
+            t0 = time.perf_counter()
+            client.get('/client/cabins')
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                counts['page'] += 1
+                page_times.append(elapsed)
+
+    with app.app_context():
+        passwords.get_hasher()
+    stop = time.monotonic() + args.seconds
+    threads = [threading.Thread(target=login_loop, args=(i,)) for i in range(args.login_threads)]
+    threads += [threading.Thread(target=page_loop, args=(c,)) for c in page_clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    page_times.sort()
+    p50 = page_times[len(page_times) // 2] if page_times else 0
+    p99 = page_times[int(len(page_times) * 0.99)] if page_times else 0
+    label = 'inline' if workers == 0 else f'pool({workers})'
+    print(f'{label:>10}: {counts["login"] / args.seconds:7.1f} logins/s  '
+          f'{counts["shed"] / args.seconds:6.1f} shed/s  '
+          f'{counts["page"] / args.seconds:7.1f} pages/s  page p50 {p50:.1f} ms  p99 {p99:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--page-threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import app as rentbnb
+    from werkzeug.security import generate_password_hash
+    from db import get_db
+
+    app = rentbnb.app
+    tmp = tempfile.mkdtemp()
+    try:
+        app.config['DATABASE'] = os.path.join(tmp, 'bench.db')
+        emails = [f'bench{i}@example.com' for i in range(args.login_threads)]
+        with app.app_context():
+            db = get_db()
+            db.executemany('INSERT INTO users (name, email, password) VALUES (?, ?, ?)',
+                           [(e, e, generate_password_hash('secret')) for e in emails])
+            db.commit()
+        for workers in (0, args.workers):
+            run(app, workers, args, emails)
+    finally:
+        hasher = app.extensions.get('password_hasher')
+        if hasher is not None:
+            hasher.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Measure template cold start and per-route render time with and without caching
+
+Usage: python -m benchmarks.render_cache --db /tmp/bench.db --requests 50
+
+Cold start: a fresh interpreter imports the app and loads every template,
+first against an empty Jinja bytecode cache directory (parse and compile
+everything, as each worker did before) and then against the directory that
+run filled in. Render time: the catalog, dashboard and search pages are
+requested repeatedly with the cabin fragment cache off and then on, and the
+template time from each response's Server-Timing header is reported.
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+ROUTES = ['/client/cabins', '/client/dashboard', '/client/search?guests=2']
+
+COLD_START = '''
+import time
+started = time.perf_counter()
+import app as rentbnb, fragments
+imported = time.perf_counter()
+timings = fragments.warm_templates(rentbnb.app)
+print(imported - started, sum(timings.values()), len(timings))
+'''
+
+_TEMPLATE_TIME = re.compile(r'tpl;dur=([\d.]+)')
+
+
+def cold_start(cache_dir):
+    env = dict(os.environ, JINJA_BYTECODE_CACHE_DIR=cache_dir)
+    output = subprocess.run([sys.executable, '-c', COLD_START], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[0]), float(output[1]), int(output[2])
+
+
+def render_times(app, routes, requests, fragment_cache):
+    app.config['FRAGMENT_CACHE'] = fragment_cache
+    app.extensions.pop('fragment_cache', None)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=2, role='client', name='bench')
+    results = {}
+    for route in routes:
+        client.get(route)
+        timings = []
+        for _ in range(requests):
+            header = client.get(route).headers.get('Server-Timing', '')
+            match = _TEMPLATE_TIME.search(header)
+            if match:
+                timings.append(float(match.group(1)))
+        timings.sort()
+        results[route] = timings[len(timings) // 2] if timings else 0.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='Database from benchmarks.datagen')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route and mode.')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cold = cold_start(cache_dir)
+        warm = cold_start(cache_dir)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f'{cold[2]} templates')
+    for label, (imported, loaded, _) in (('empty bytecode cache', cold), ('warm bytecode cache', warm)):
+        print(f'{label:>22}: import {imported * 1000:7.1f} ms, load templates {loaded * 1000:6.1f} ms')
+
+    import app as rentbnb
+    app = rentbnb.app
+    app.config['DATABASE'] = os.path.abspath(args.db)
+    app.config['METRICS_SERVER_TIMING'] = True
+    uncached = render_times(app, ROUTES, args.requests, False)
+    cached = render_times(app, ROUTES, args.requests, True)
+    print(f'\n{"median template ms":<28} {"no fragments":>12} {"fragments":>10}')
+    for route in ROUTES:
+        print(f'{route:<28} {uncached[route]:12.2f} {cached[route]:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the cabin search with a date filter against a synthetic database
+
+Usage: python -m benchmarks.search_availability --cabins 10000 --bookings 1000000
+
+Builds a throwaway database with benchmarks.datagen, whose schema, indexes
+and triggers come from the app's own prepare_db, then times search.search
+(what /client/search runs) for random date ranges, party sizes and, for
+half of the queries, a free-text term. Reports latency percentiles and
+exits with status 1 if p99 is above --target-ms.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import datagen  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cabins', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--target-ms', type=float, default=150.0)
+    parser.add_argument('--index', action='store_true',
+                        help='filter dates through the in-memory interval index (AVAILABILITY_INDEX)')
+    args = parser.parse_args()
+
+    import app as rentbnb
+    import search
+    from db import get_db
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        started = time.perf_counter()
+        datagen.generate(path, args.cabins, args.bookings, reviews=0, users=1000, seed=args.seed,
+                         verbose=False)
+        print(f'built {args.cabins} cabins / {args.bookings} bookings in '
+              f'{time.perf_counter() - started:.1f}s')
+
+        rentbnb.app.config['DATABASE'] = path
+        rentbnb.app.config['AVAILABILITY_INDEX'] = args.index
+        rng = random.Random(args.seed + 1)
+        today = date.today()
+        timings = []
+        found = 0
+        with rentbnb.app.app_context():
+            db = get_db()
+            # The first search fills the catalog cache (and warms the index), as
+            # the first request of a worker does
+            search.search(db, guests=1, check_in=today.isoformat(),
+                          check_out=(today + timedelta(days=1)).isoformat())
+            for _ in range(args.queries):
+                check_in = today + timedelta(days=rng.randrange(1, 180))
+                check_out = check_in + timedelta(days=rng.randint(1, 14))
+                text = rng.choice(datagen.WORDS) if rng.random() < 0.5 else ''
+                t0 = time.perf_counter()
+                result = search.search(db, text, guests=rng.randint(1, 8),
+                                       check_in=check_in.isoformat(), check_out=check_out.isoformat())
+                timings.append((time.perf_counter() - t0) * 1000)
+                found += len(result['cabins'])
+        rentbnb.app.extensions.pop('db_pool').close()
+
+    p50, p95, p99 = (percentile(timings, p) for p in (50, 95, 99))
+    print(f'{args.queries} searches, avg {found / args.queries:.0f} cabins returned')
+    print(f'p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms  (target p99 < {args.target_ms} ms)')
+    return 0 if p99 < args.target_ms else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
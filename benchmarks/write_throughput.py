@@ -0,0 +1,171 @@
+"""Stress concurrent booking writes with direct commits and with the write queue
+
+Usage: python -m benchmarks.write_throughput --processes 4 --threads 8 --seconds 10
+
+Mimics several gunicorn workers on one SQLite file: each process runs the
+app in-process with a pool of client threads that book random stays and
+cancel some of them, hammering the write paths as fast as they can. The
+same run is made twice on copies of one prepared database, first with
+every request committing on its own connection and then with WRITE_QUEUE
+on. Reports committed writes/sec, booking conflicts, writes shed with 503,
+and requests that failed with "database is locked".
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+OUTCOMES = ('booked', 'conflict', 'cancelled', 'busy', 'locked', 'error')
+
+
+def worker(database, write_queue, args, first_user, ready, go, results):
+    """One "gunicorn worker": the app plus ``args.threads`` client threads"""
+    os.chdir(ROOT)
+    import sqlite3
+
+    from flask import got_request_exception
+
+    import app as rentbnb
+    import writes
+
+    app = rentbnb.app
+    app.config['DATABASE'] = database
+    app.config['WRITE_QUEUE'] = write_queue
+    app.config['DB_PRAGMAS'] = dict(app.config['DB_PRAGMAS'], synchronous=args.synchronous,
+                                    busy_timeout=args.busy_timeout)
+    app.logger.disabled = True
+
+    counts = dict.fromkeys(OUTCOMES, 0)
+    lock = threading.Lock()
+    failures = threading.local()
+
+    def record_failure(sender, exception, **extra):
+        failures.locked = isinstance(exception, sqlite3.OperationalError) and 'locked' in str(exception)
+
+    got_request_exception.connect(record_failure, app)
+
+    def count(outcome):
+        with lock:
+            counts[outcome] += 1
+
+    def post(client, url, data=None):
+        failures.locked = False
+        response = client.post(url, data=data)
+        if response.status_code == 503:
+            count('busy')
+        elif response.status_code >= 500:
+            count('locked' if failures.locked else 'error')
+        return response
+
+    def client_loop(user_id):
+        rng = random.Random(user_id)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=user_id, role='client', name='bench')
+        reader = sqlite3.connect(database)
+        go.wait()
+        stop_at = time.monotonic() + args.seconds
+        start = date.today() + timedelta(days=1)
+        while time.monotonic() < stop_at:
+            check_in = start + timedelta(days=rng.randrange(args.horizon_days))
+            check_out = check_in + timedelta(days=rng.randint(1, 7))
+            response = post(client, f'/client/cabin/{rng.randint(1, args.cabins)}/book', data={
+                'check_in': check_in.isoformat(), 'check_out': check_out.isoformat(), 'guests': '1'})
+            if response.status_code != 302:
+                continue
+            if not response.headers['Location'].endswith('/client/bookings'):
+                count('conflict')
+                continue
+            count('booked')
+            if rng.random() < args.cancel_ratio:
+                booking_id = reader.execute('SELECT MAX(id) FROM bookings WHERE user_id = ?',
+                                            (user_id,)).fetchone()[0]
+                if post(client, f'/client/booking/{booking_id}/cancel').status_code == 302:
+                    count('cancelled')
+        reader.close()
+
+    # Open the pool (and the writer) before the clock starts
+    with app.app_context():
+        rentbnb.get_db()
+        writes.get_queue()
+    threads = [threading.Thread(target=client_loop, args=(first_user + n,)) for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    ready.put(os.getpid())
+    for t in threads:
+        t.join()
+    writer = app.extensions.get('write_queue')
+    results.put((counts, writer.stats() if writer else None))
+
+
+def run(label, database, write_queue, args):
+    ctx = multiprocessing.get_context('spawn')
+    ready, go, results = ctx.Queue(), ctx.Event(), ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(database, write_queue, args, 2 + n * args.threads,
+                                                  ready, go, results))
+                 for n in range(args.processes)]
+    for p in processes:
+        p.start()
+    for _ in processes:
+        ready.get()
+    go.set()
+    totals = dict.fromkeys(OUTCOMES, 0)
+    batches = writes = 0
+    for _ in processes:
+        counts, stats = results.get()
+        for key, value in counts.items():
+            totals[key] += value
+        if stats:
+            batches += stats['batches']
+            writes += stats['writes'] + stats['failed']
+    for p in processes:
+        p.join()
+    committed = totals['booked'] + totals['cancelled']
+    grouping = f'  {writes / batches:4.1f} writes/commit' if batches else ''
+    print(f'{label:>14}: {committed / args.seconds:8.1f} writes/s  '
+          f'{totals["conflict"]:6d} conflicts  {totals["busy"]:5d} busy  '
+          f'{totals["locked"]:5d} locked  {totals["error"]:4d} other errors{grouping}', flush=True)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='Client threads per process.')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--cabins', type=int, default=200)
+    parser.add_argument('--horizon-days', type=int, default=3 * 365,
+                        help='Stays start within this many days; smaller means more conflicts.')
+    parser.add_argument('--cancel-ratio', type=float, default=0.3)
+    parser.add_argument('--synchronous', default='normal', choices=('off', 'normal', 'full'))
+    parser.add_argument('--busy-timeout', type=int, default=5000, help='SQLite busy_timeout in ms.')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    from benchmarks import datagen
+
+    tmp = tempfile.mkdtemp()
+    try:
+        template = os.path.join(tmp, 'template.db')
+        datagen.generate(template, cabins=args.cabins, bookings=0, reviews=0,
+                         users=args.processes * args.threads, verbose=False)
+        for label, write_queue in (('direct commit', False), ('write queue', True)):
+            database = os.path.join(tmp, f'{label.replace(" ", "_")}.db')
+            shutil.copy(template, database)
+            run(label, database, write_queue, args)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
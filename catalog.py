@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import current_app, request, session, make_response
+
+import assets
+import images
+
+# The version stamp lives in the database so every worker process sees the
+# same value; triggers bump it on any change to the cabins table.
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS catalog_cabins_insert AFTER INSERT ON cabins
+BEGIN UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_cabins_update AFTER UPDATE ON cabins
+BEGIN UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_cabins_delete AFTER DELETE ON cabins
+BEGIN UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1; END;
+'''
+
+
+def ensure_schema(db):
+    db.executescript(CATALOG_SCHEMA)
+
+
+class CatalogCache:
+    """Cabin rows cached per catalog version, with optional TTL and LRU bounds
+
+    Entries remember the version they were loaded at; a lookup with a newer
+    version misses and reloads, so bumping the version invalidates everything
+    at once without having to find the affected keys.
+    """
+
+    def __init__(self, ttl=None, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, loaded_at, value = entry
+                if entry_version == version and (self.ttl is None or now - loaded_at < self.ttl):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (version, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def init_app(app):
+    app.config.setdefault('CATALOG_CACHE_TTL', None)
+    app.config.setdefault('CATALOG_CACHE_MAX_ENTRIES', 1024)
+
+
+def get_cache():
+    cache = current_app.extensions.get('catalog_cache')
+    database = current_app.config['DATABASE']
+    if cache is None or cache.database != database:
+        cache = CatalogCache(ttl=current_app.config.get('CATALOG_CACHE_TTL'),
+                             max_entries=current_app.config.get('CATALOG_CACHE_MAX_ENTRIES', 1024))
+        cache.database = database
+        current_app.extensions['catalog_cache'] = cache
+    return cache
+
+
+def current_version(db):
+    """Return (version, updated_at) for the cabin catalog"""
+    row = db.execute('SELECT version, updated_at FROM catalog_version WHERE id = 1').fetchone()
+    return (row['version'], row['updated_at']) if row else (0, None)
+
+
+def list_cabins(db, version=None):
+    """All cabins ordered by price, served from the cache while the catalog is unchanged"""
+    if version is None:
+        version = current_version(db)[0]
+    return get_cache().get('cabins', version,
+                           lambda: db.execute('SELECT * FROM cabins ORDER BY price_per_night').fetchall())
+
+
+def get_cabin(db, cabin_id, version=None):
+    if version is None:
+        version = current_version(db)[0]
+    return get_cache().get(('cabin', cabin_id), version,
+                           lambda: db.execute('SELECT * FROM cabins WHERE id = ?', (cabin_id,)).fetchone())
+
+
+def _etag(version):
+    # Pages also show the signed-in user's name, so the tag is per user; they
+    # link the fingerprinted assets and switch to srcset once an image's
+    # variants are ready, so a deploy or a finished variant changes it too
+    return (f'catalog-{version}-u{session.get("user_id", 0)}'
+            f'-a{assets.get_manifest().digest}-i{images.variants_version()}')
+
+
+def _last_modified(updated_at):
+    if not updated_at:
+        return None
+    return datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def conditional_render(db, render):
+    """Answer 304 when the client already holds this catalog version, else render
+
+    ``render`` is called with the catalog version and must return the page
+    body. Pages with pending flash messages are always rendered so the
+    message is not swallowed by a cached copy. Only the ETag is checked:
+    Last-Modified follows the cabins table alone and cannot see the other
+    inputs the tag covers.
+    """
+    version, updated_at = current_version(db)
+    tag = _etag(version)
+    last_modified = _last_modified(updated_at)
+    if '_flashes' not in session:
+        if request.if_none_match.contains_weak(tag):
+            return _stamp(make_response('', 304), tag, last_modified)
+    return _stamp(make_response(render(version)), tag, last_modified)
+
+
+def _stamp(response, tag, last_modified):
+    response.set_etag(tag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Let the browser keep the page but revalidate it on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
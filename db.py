@@ -0,0 +1,204 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from urllib.parse import quote
+
+from flask import g, current_app
+
+# Applied to every connection once, right after it is opened
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,  # negative means KiB, so ~16MB per connection
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connect_sqlite(database, pragmas, factory=None, readonly=False):
+    """Open a SQLite connection with name-addressable rows and ``pragmas`` applied"""
+    if readonly:
+        # mode=ro fails on a missing file instead of creating an empty one
+        conn = sqlite3.connect(f'file:{quote(os.path.abspath(database))}?mode=ro', uri=True,
+                               check_same_thread=False, factory=factory or sqlite3.Connection)
+    else:
+        conn = sqlite3.connect(database, check_same_thread=False, factory=factory or sqlite3.Connection)
+    conn.row_factory = sqlite3.Row
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+# Connection openers selected by DB_BACKEND. Each is called as
+# opener(database, pragmas, factory, readonly) and returns a DB-API
+# connection whose rows can be indexed by column name.
+BACKENDS = {'sqlite': connect_sqlite}
+
+
+class ConnectionPool:
+    """A bounded pool of SQLite connections shared by the request threads"""
+
+    def __init__(self, database, size=8, timeout=10.0, pragmas=None, setup=None, trace=None,
+                 factory=None, backend=None, readonly=False):
+        self.database = database
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self._idle = deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._setup = setup
+        self._trace = trace
+        self._factory = factory
+        self._backend = backend or connect_sqlite
+        self._setup_lock = threading.Lock()
+        self._stats = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'connects': 0}
+
+    def _connect(self):
+        conn = self._backend(self.database, self.pragmas, self._factory, self.readonly)
+        if self._trace is not None:
+            conn.set_trace_callback(self._trace)
+        # Schema setup runs once per process, on the first connection opened
+        if self._setup is not None:
+            with self._setup_lock:
+                if self._setup is not None:
+                    try:
+                        self._setup(conn)
+                    except Exception:
+                        conn.close()
+                        raise
+                    self._setup = None
+        return conn
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Connection pool is closed')
+            self._stats['checkouts'] += 1
+            waited = False
+            while not self._idle and self._open >= self.size:
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection free after {self.timeout}s')
+                self._cond.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+            self._stats['connects'] += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                self._open -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._open -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats,
+                        size=self.size,
+                        open=self._open,
+                        idle=len(self._idle),
+                        in_use=self._open - len(self._idle))
+
+
+def init_app(app, setup=None):
+    """Configure pool settings and return connections at the end of each app context
+
+    ``setup`` is called with the first connection the pool opens, so schema
+    upgrades such as new indexes are applied before any request runs.
+    """
+    app.extensions['db_setup'] = setup
+    app.config.setdefault('DATABASE', 'rentbnb.db')
+    app.config.setdefault('DB_BACKEND', 'sqlite')
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10.0)
+    app.config.setdefault('DB_PRAGMAS', DEFAULT_PRAGMAS)
+    # Optional callable receiving every SQL statement run (sqlite3 trace callback)
+    app.config.setdefault('DB_TRACE', None)
+    # Optional sqlite3.Connection subclass used for every pooled connection
+    app.config.setdefault('DB_CONNECTION_FACTORY', None)
+    app.teardown_appcontext(close_db)
+
+
+_pool_lock = threading.Lock()
+
+
+def get_pool(app=None):
+    app = app or current_app
+    pool = app.extensions.get('db_pool')
+    if pool is None or pool.database != app.config['DATABASE']:
+        with _pool_lock:
+            pool = app.extensions.get('db_pool')
+            if pool is None or pool.database != app.config['DATABASE']:
+                if pool is not None:
+                    pool.close()
+                pool = ConnectionPool(app.config['DATABASE'],
+                                      size=app.config['DB_POOL_SIZE'],
+                                      timeout=app.config['DB_POOL_TIMEOUT'],
+                                      pragmas=app.config['DB_PRAGMAS'],
+                                      setup=app.extensions.get('db_setup'),
+                                      trace=app.config['DB_TRACE'],
+                                      factory=app.config['DB_CONNECTION_FACTORY'],
+                                      backend=BACKENDS[app.config['DB_BACKEND']])
+                app.extensions['db_pool'] = pool
+    return pool
+
+
+def get_db():
+    """Return the pooled connection bound to the current app context"""
+    if 'db' not in g:
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    db = g.pop('db', None)
+    if db is not None:
+        g.pop('db_pool').release(db)
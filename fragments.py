@@ -0,0 +1,106 @@
+import time
+
+import click
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from catalog import CatalogCache
+from images import image_variants
+
+FRAGMENTS_TEMPLATE = '_fragments.html'
+
+# Every write to a cabin row, including the rating aggregates the review
+# triggers maintain, stamps it with the next value of one global sequence.
+# Rendered fragments are cached under that stamp; a globally increasing
+# value means a cabin re-created under a reused id never matches old HTML.
+FRAGMENTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fragment_sequence (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    value INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO fragment_sequence (id, value) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS fragments_cabins_insert AFTER INSERT ON cabins
+BEGIN
+    UPDATE fragment_sequence SET value = value + 1 WHERE id = 1;
+    UPDATE cabins SET version = (SELECT value FROM fragment_sequence WHERE id = 1) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS fragments_cabins_update AFTER UPDATE ON cabins
+WHEN NEW.version IS OLD.version
+BEGIN
+    UPDATE fragment_sequence SET value = value + 1 WHERE id = 1;
+    UPDATE cabins SET version = (SELECT value FROM fragment_sequence WHERE id = 1) WHERE id = NEW.id;
+END;
+'''
+
+
+def ensure_schema(db):
+    existing = {row['name'] for row in db.execute('PRAGMA table_info(cabins)')}
+    if 'version' not in existing:
+        db.execute('ALTER TABLE cabins ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    db.executescript(FRAGMENTS_SCHEMA)
+
+
+def get_cache():
+    cache = current_app.extensions.get('fragment_cache')
+    database = current_app.config['DATABASE']
+    if cache is None or cache.database != database:
+        cache = CatalogCache(max_entries=current_app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+        cache.database = database
+        current_app.extensions['fragment_cache'] = cache
+    return cache
+
+
+def _render(name, cabin, args):
+    macro = getattr(current_app.jinja_env.get_template(FRAGMENTS_TEMPLATE).module, name)
+    return Markup(str(macro(cabin, *args)))
+
+
+def fragment(name, cabin, *args):
+    """HTML of the ``name`` macro in _fragments.html for one cabin row, cached
+
+    Registered as a template global. The entry is reused until the cabin's
+    version changes; whether its image variants are ready is part of the
+    key, since the background resize finishes without touching the row.
+    """
+    if not current_app.config['FRAGMENT_CACHE']:
+        return _render(name, cabin, args)
+    key = (name, cabin['id'], args)
+    version = (cabin['version'], image_variants(cabin['image_url']) is not None)
+    return get_cache().get(key, version, lambda: _render(name, cabin, args))
+
+
+def warm_templates(app):
+    """Load every template once; returns {name: seconds}
+
+    With the bytecode cache on, the first worker to load a template writes
+    its compiled code to disk and every later worker reads it back instead
+    of parsing and compiling the source again.
+    """
+    timings = {}
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        started = time.perf_counter()
+        app.jinja_env.get_template(name)
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE', True)
+    app.config.setdefault('FRAGMENT_CACHE_MAX_ENTRIES', 4096)
+    # Compiled templates persist here across workers and restarts; None uses
+    # a per-user directory under the system temp dir, False turns it off
+    app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', None)
+    if app.config['JINJA_BYTECODE_CACHE_DIR'] is not False:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+    app.add_template_global(fragment)
+
+    @app.cli.command('warm-templates')
+    def warm_templates_command():
+        """Compile every template into the bytecode cache and report load times."""
+        timings = warm_templates(app)
+        for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+            click.echo(f'{seconds * 1000:8.2f} ms  {name}')
+        click.echo(f'{len(timings)} templates in {sum(timings.values()) * 1000:.1f} ms')
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+
+import click
+from flask import current_app
+
+import repository
+import writes
+from db import get_db
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # variants are skipped, uploads are still deduplicated
+    Image = None
+
+# Widths generated for every upload: card thumbnails and detail-page images
+VARIANT_WIDTHS = {'thumb': 480, 'medium': 1200}
+VARIANT_DIR = 'variants'
+
+_HASHED_URL = re.compile(r'^/static/uploads/([0-9a-f]{64})\.(\w+)$')
+_EXT_ALIASES = {'jpeg': 'jpg'}
+
+
+def _normalize_ext(filename):
+    ext = filename.rsplit('.', 1)[1].lower()
+    return _EXT_ALIASES.get(ext, ext)
+
+
+def _variant_name(digest, width, fmt):
+    return f'{digest}-{width}.{fmt}'
+
+
+def store_upload(file, upload_folder):
+    """Save an uploaded file under its content hash and return its public URL
+
+    The upload is hashed while it is copied to a temporary file; if a file
+    with the same hash is already stored, the copy is discarded, so
+    identical images are kept only once however often they are uploaded.
+    """
+    ext = _normalize_ext(file.filename)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        name = f'{digest.hexdigest()}.{ext}'
+        path = os.path.join(upload_folder, name)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    enqueue_variants(path)
+    return f'/static/uploads/{name}'
+
+
+def _manifest_path(variant_dir, digest):
+    return os.path.join(variant_dir, f'{digest}.json')
+
+
+def generate_variants(path):
+    """Write the resized JPEG/PNG and WebP variants for one stored original
+
+    Safe to call repeatedly: existing variants are left alone and new ones
+    are written to a temporary name first, so concurrent workers never see
+    half-written files. Images are never enlarged: the first width at or
+    above the original's is written at the original's size and any wider
+    ones are skipped. The real width of each variant goes in a small JSON
+    manifest, written last, which marks the set as complete.
+    """
+    if Image is None:
+        return []
+    folder, name = os.path.split(path)
+    digest, ext = name.rsplit('.', 1)
+    variant_dir = os.path.join(folder, VARIANT_DIR)
+    os.makedirs(variant_dir, exist_ok=True)
+    fallback = 'png' if ext in ('png', 'gif') else 'jpg'
+    written = []
+    widths = {}
+    with Image.open(path) as original:
+        original = ImageOps.exif_transpose(original)
+        for width in sorted(VARIANT_WIDTHS.values()):
+            resized = None
+            for fmt in (fallback, 'webp'):
+                target = os.path.join(variant_dir, _variant_name(digest, width, fmt))
+                if os.path.exists(target):
+                    if fmt == fallback:
+                        with Image.open(target) as existing:
+                            widths[width] = existing.width
+                    continue
+                if resized is None:
+                    resized = original.copy()
+                    resized.thumbnail((width, width * 4))
+                    if fallback == 'jpg' and resized.mode not in ('RGB', 'L'):
+                        resized = resized.convert('RGB')
+                    widths[width] = resized.width
+                tmp = target + '.part'
+                if fmt == 'jpg':
+                    resized.save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+                elif fmt == 'png':
+                    resized.save(tmp, 'PNG', optimize=True)
+                else:
+                    resized.save(tmp, 'WEBP', quality=80, method=4)
+                os.replace(tmp, target)
+                written.append(target)
+            if widths[width] >= original.width:
+                break
+    manifest = _manifest_path(variant_dir, digest)
+    if written or not os.path.exists(manifest):
+        with open(manifest + '.part', 'w') as f:
+            json.dump({str(width): actual for width, actual in widths.items()}, f)
+        os.replace(manifest + '.part', manifest)
+    return written
+
+
+class VariantWorker:
+    """Background thread that generates image variants outside the request"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, path):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='image-variants', daemon=True)
+                self._thread.start()
+        self._queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                generate_variants(path)
+            except Exception:
+                # A corrupt upload should not stop the worker; the page
+                # simply keeps serving the original image.
+                pass
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+_worker = VariantWorker()
+# digest -> {variant file width: real width} for variant sets known to be complete
+_ready = {}
+# Sets from before manifests that have been queued for one
+_upgrading = set()
+
+
+def enqueue_variants(path):
+    if Image is not None:
+        _worker.submit(path)
+
+
+def variants_version():
+    """A stamp that moves whenever a variant is written, by any worker
+
+    Every variant is renamed into VARIANT_DIR, which updates the
+    directory's modification time, so one stat() covers all processes.
+    """
+    try:
+        return os.stat(os.path.join(current_app.config['UPLOAD_FOLDER'], VARIANT_DIR)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def image_variants(url):
+    """Return src/srcset values for a stored image, or None if it has no variants yet
+
+    Registered as a template global; anything that is not a content-hashed
+    upload (external URLs, legacy file names) returns None and templates
+    fall back to the plain URL. Each srcset descriptor is the variant's
+    real width, from the manifest generate_variants writes.
+    """
+    match = _HASHED_URL.match(url or '')
+    if not match:
+        return None
+    digest, ext = match.groups()
+    fallback = 'png' if ext in ('png', 'gif') else 'jpg'
+    widths = _ready.get(digest)
+    if widths is None:
+        folder = os.path.join(current_app.config['UPLOAD_FOLDER'], VARIANT_DIR)
+        try:
+            with open(_manifest_path(folder, digest)) as f:
+                widths = {int(width): actual for width, actual in json.load(f).items()}
+        except (OSError, ValueError):
+            # Sets made before manifests existed get one in the background
+            largest = max(VARIANT_WIDTHS.values())
+            if (digest not in _upgrading
+                    and os.path.exists(os.path.join(folder, _variant_name(digest, largest, 'webp')))):
+                _upgrading.add(digest)
+                enqueue_variants(os.path.join(current_app.config['UPLOAD_FOLDER'], f'{digest}.{ext}'))
+            return None
+        _ready[digest] = widths
+    if not widths:
+        return None
+    base = f'/static/uploads/{VARIANT_DIR}/'
+
+    def srcset(fmt):
+        return ', '.join(f'{base}{_variant_name(digest, width, fmt)} {widths[width]}w'
+                         for width in sorted(widths))
+
+    return {
+        'src': base + _variant_name(digest, min(widths), fallback),
+        'srcset': srcset(fallback),
+        'webp_srcset': srcset('webp'),
+    }
+
+
+def backfill(db, upload_folder, prune=False):
+    """Move legacy uploads to content-hashed names and build their variants
+
+    Returns (moved, duplicates, variants_written). Cabin image URLs are
+    rewritten to the hashed names; with ``prune`` the legacy files are
+    deleted once nothing references them.
+    """
+    moved = duplicates = variants = 0
+    for name in sorted(os.listdir(upload_folder)):
+        path = os.path.join(upload_folder, name)
+        if not os.path.isfile(path) or '.' not in name or name.endswith('.part'):
+            continue
+        if _HASHED_URL.match(f'/static/uploads/{name}'):
+            variants += len(generate_variants(path))
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        hashed = f'{digest.hexdigest()}.{_normalize_ext(name)}'
+        hashed_path = os.path.join(upload_folder, hashed)
+        if os.path.exists(hashed_path):
+            duplicates += 1
+        else:
+            shutil.copy2(path, hashed_path)
+            moved += 1
+            variants += len(generate_variants(hashed_path))
+        writes.run(db, repository.rename_image_url, f'/static/uploads/{name}', f'/static/uploads/{hashed}')
+        if prune:
+            os.remove(path)
+    return moved, duplicates, variants
+
+
+def init_app(app):
+    app.add_template_global(image_variants)
+
+    @app.cli.command('backfill-images')
+    @click.option('--prune', is_flag=True, help='Delete legacy files after rewriting references.')
+    def backfill_images_command(prune):
+        """Store existing uploads by content hash and generate resized variants."""
+        if Image is None:
+            click.echo('Pillow is not installed; variants will not be generated.', err=True)
+        moved, duplicates, variants = backfill(get_db(), app.config['UPLOAD_FOLDER'], prune=prune)
+        click.echo(f'{moved} files stored by hash, {duplicates} duplicates collapsed, '
+                   f'{variants} variants written.')
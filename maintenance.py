@@ -0,0 +1,271 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import click
+from flask import current_app, url_for
+from flask.cli import AppGroup
+
+import migrations
+from db import get_db
+
+# Plan steps that read a whole table; "SCAN t USING INDEX" walks an index in
+# order instead and is reported separately
+FULL_SCAN = 'SCAN'
+SQL_KEYWORDS = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+
+
+def analyze(db, full=False):
+    """Refresh planner statistics: PRAGMA optimize, or a full ANALYZE"""
+    if full:
+        db.execute('ANALYZE')
+    else:
+        db.execute('PRAGMA optimize')
+    db.commit()
+
+
+def vacuum(db, pages=None, full=False):
+    """Return free pages to the filesystem; returns (pages before, pages after)
+
+    With auto_vacuum=INCREMENTAL, up to ``pages`` free pages (all when None)
+    are released in a short write transaction. ``full`` switches the
+    database to incremental mode and rebuilds it with VACUUM, which locks it
+    for the duration; that is needed once per database.
+    """
+    before = db.execute('PRAGMA freelist_count').fetchone()[0]
+    if db.in_transaction:
+        db.commit()
+    if full:
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+    elif db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        raise click.ClickException('auto_vacuum is not INCREMENTAL; run "flask db vacuum --full" once first.')
+    else:
+        db.execute(f'PRAGMA incremental_vacuum({int(pages or 0)})').fetchall()
+    db.commit()
+    return before, db.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def check(db, quick=False):
+    """Integrity and foreign key problems as a list of messages; empty when healthy"""
+    pragma = 'quick_check' if quick else 'integrity_check'
+    problems = [row[0] for row in db.execute(f'PRAGMA {pragma}') if row[0] != 'ok']
+    for table, rowid, parent, _ in db.execute('PRAGMA foreign_key_check').fetchall():
+        # Reviews keep pointing at stays the scheduler moved to bookings_archive
+        if table == 'reviews' and parent == 'bookings' and db.execute('''
+            SELECT 1 FROM reviews r JOIN bookings_archive a ON a.id = r.booking_id WHERE r.rowid = ?
+        ''', (rowid,)).fetchone():
+            continue
+        problems.append(f'{table} row {rowid}: missing {parent} reference')
+    return problems
+
+
+def backup(db, path, pages=-1, progress=None):
+    """Copy the live database to ``path`` with the SQLite online backup API
+
+    The default single step reads one consistent snapshot; in WAL mode a
+    reader never blocks writers, so requests keep committing while it runs.
+    A positive ``pages`` copies in steps, releasing the snapshot between
+    them, and restarts if another connection writes meanwhile. The copy is
+    written next to ``path`` and renamed into place once complete.
+    """
+    partial = f'{path}.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    target = sqlite3.connect(partial)
+    try:
+        if db.in_transaction:
+            db.commit()
+        db.backup(target, pages=pages, progress=progress)
+        problems = [row[0] for row in target.execute('PRAGMA quick_check') if row[0] != 'ok']
+    finally:
+        target.close()
+    if problems:
+        os.remove(partial)
+        raise click.ClickException(f'Backup failed its integrity check: {problems[0]}')
+    os.replace(partial, path)
+    return os.path.getsize(path)
+
+
+def _route_samples(db):
+    """Values for the int URL arguments: an admin, a client and rows they can see"""
+    admin = db.execute("SELECT id FROM users WHERE role = 'admin' ORDER BY id LIMIT 1").fetchone()
+    booking = db.execute('''
+        SELECT b.id, b.user_id, b.cabin_id FROM bookings b JOIN users u ON u.id = b.user_id
+        WHERE u.role = 'client' ORDER BY b.id DESC LIMIT 1
+    ''').fetchone()
+    client = booking['user_id'] if booking else None
+    if client is None:
+        row = db.execute("SELECT id FROM users WHERE role = 'client' ORDER BY id LIMIT 1").fetchone()
+        client = row['id'] if row else None
+    cabin = db.execute('SELECT MIN(id) FROM cabins').fetchone()[0]
+    sessions = [(role, user_id) for role, user_id in (('admin', admin and admin['id']), ('client', client))
+                if user_id is not None]
+    values = {'cabin_id': booking['cabin_id'] if booking else cabin, 'booking_id': booking and booking['id']}
+    return sessions, values
+
+
+def trace_routes(app, modules=('app', 'api')):
+    """Run every GET route defined in ``modules`` and collect the SQL it executes
+
+    Routes are requested as an admin and as a client against a snapshot of
+    the database, with int URL arguments filled from existing rows and other
+    arguments skipped. Returns {normalized sql: (endpoint, sql as run)}.
+    """
+    from metrics import normalize_sql
+
+    db = get_db()
+    sessions, values = _route_samples(db)
+    statements = {}
+    local = {}
+
+    def collect(sql):
+        endpoint = local.get('endpoint')
+        if endpoint and sql.lstrip().upper().startswith(SQL_KEYWORDS):
+            statements.setdefault(normalize_sql(sql), (endpoint, sql))
+
+    original = app.config['DATABASE'], app.config['DB_TRACE'], app.config['DB_REPLICAS']
+    workdir = tempfile.mkdtemp()
+    try:
+        backup(db, os.path.join(workdir, 'snapshot.db'))
+        app.config['DATABASE'] = os.path.join(workdir, 'snapshot.db')
+        app.config['DB_TRACE'] = collect
+        app.config['DB_REPLICAS'] = []
+        with app.app_context():
+            get_db()  # schema setup runs on the first connection, before tracing starts
+        for rule in app.url_map.iter_rules():
+            view = app.view_functions.get(rule.endpoint)
+            if 'GET' not in rule.methods or getattr(view, '__module__', None) not in modules:
+                continue
+            if any(rule._converters[name].__class__.__name__ != 'IntegerConverter' or values.get(name) is None
+                   for name in rule.arguments):
+                continue
+            with app.test_request_context():
+                url = url_for(rule.endpoint, **{name: values[name] for name in rule.arguments})
+            for role, user_id in sessions:
+                client = app.test_client()
+                with client.session_transaction() as session:
+                    session.update(user_id=user_id, role=role, name='explain')
+                # A fresh app context, so the request gets a traced snapshot
+                # connection instead of the caller's g.db
+                with app.app_context():
+                    local['endpoint'] = rule.endpoint
+                    client.get(url)
+                    local['endpoint'] = None
+    finally:
+        app.config['DATABASE'], app.config['DB_TRACE'], app.config['DB_REPLICAS'] = original
+        pool = app.extensions.pop('db_pool', None)
+        if pool is not None:
+            pool.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return statements
+
+
+def full_scans(plan):
+    """Plan steps that read a whole table row by row"""
+    return [detail for detail in plan
+            if detail.startswith(FULL_SCAN + ' ') and ' USING ' not in detail and 'VIRTUAL TABLE' not in detail
+            and detail.split()[1] not in ('CONSTANT', 'sqlite_master', 'sqlite_schema')]
+
+
+def explain(db, statements):
+    """EXPLAIN QUERY PLAN for traced statements: [(endpoint, sql, plan, full scans)]"""
+    report = []
+    for endpoint, sql in sorted(statements.values()):
+        try:
+            plan = [row[3] for row in db.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        except sqlite3.Error as e:
+            plan = [f'error: {e}']
+        report.append((endpoint, sql, plan, full_scans(plan)))
+    return report
+
+
+db_cli = AppGroup('db', help='Schema migrations and database maintenance.')
+
+
+@db_cli.command('migrate')
+@click.option('--to', 'target', type=int, help='Stop after this migration version.')
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    applied = migrations.migrate(get_db(), target)
+    for version, description, _ in migrations.MIGRATIONS:
+        if version in applied:
+            click.echo(f'applied {version}: {description}')
+    click.echo(f'Schema at version {migrations.current_version(get_db())}.')
+
+
+@db_cli.command('status')
+def status_command():
+    """List applied and pending migrations."""
+    db = get_db()
+    migrations.ensure_schema(db)
+    done = migrations.applied(db)
+    for version, description, _ in migrations.MIGRATIONS:
+        state = f'applied {done[version]}' if version in done else 'pending'
+        click.echo(f'{version:4d}  {state:<28} {description}')
+
+
+@db_cli.command('analyze')
+@click.option('--full', is_flag=True, help='Run a full ANALYZE instead of PRAGMA optimize.')
+def analyze_command(full):
+    """Refresh query planner statistics."""
+    started = time.perf_counter()
+    analyze(get_db(), full)
+    click.echo(f'{"ANALYZE" if full else "PRAGMA optimize"} done in {time.perf_counter() - started:.2f}s.')
+
+
+@db_cli.command('vacuum')
+@click.option('--pages', type=int, help='Free at most this many pages (default all).')
+@click.option('--full', is_flag=True, help='Switch to incremental auto-vacuum and rebuild the file (locks it).')
+def vacuum_command(pages, full):
+    """Release free pages with an incremental vacuum."""
+    before, after = vacuum(get_db(), pages, full)
+    click.echo(f'Free pages: {before} -> {after}.')
+
+
+@db_cli.command('check')
+@click.option('--quick', is_flag=True, help='Run quick_check instead of the full integrity_check.')
+def check_command(quick):
+    """Run the integrity and foreign key checks."""
+    problems = check(get_db(), quick)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo('ok')
+
+
+@db_cli.command('backup')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--pages', type=int, default=-1, help='Pages per step; -1 copies one consistent snapshot.')
+def backup_command(path, pages):
+    """Hot-copy the database to PATH while the app keeps running."""
+    started = time.perf_counter()
+    size = backup(get_db(), path, pages)
+    click.echo(f'Backed up {size / 1024 / 1024:.1f} MB to {path} in {time.perf_counter() - started:.2f}s.')
+
+
+@db_cli.command('explain')
+@click.option('--verbose', '-v', is_flag=True, help='Print every plan, not just full scans.')
+@click.option('--strict', is_flag=True, help='Exit non-zero when any statement full-scans a table.')
+def explain_command(verbose, strict):
+    """Replay the page and API GET routes and flag queries whose plan full-scans a table."""
+    report = explain(get_db(), trace_routes(current_app._get_current_object()))
+    flagged = 0
+    for endpoint, sql, plan, scans in report:
+        if scans:
+            flagged += 1
+        if scans or verbose:
+            click.echo(f'{endpoint}: {"FULL SCAN" if scans else "ok"}')
+            click.echo('    ' + ' '.join(sql.split())[:200])
+            for detail in plan:
+                click.echo(f'    {"*" if detail in scans else " "} {detail}')
+    click.echo(f'{len(report)} distinct statements, {flagged} with full table scans.')
+    if strict and flagged:
+        raise SystemExit(1)
+
+
+def init_app(app):
+    app.cli.add_command(db_cli)
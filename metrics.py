@@ -0,0 +1,288 @@
+import hmac
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+from flask import Response, abort, current_app, g, has_app_context, request, session
+from flask.signals import before_render_template, template_rendered
+
+# Request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Distinct normalized statements kept for the slow-query and N+1 series
+MAX_TRACKED_STATEMENTS = 200
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Collapse a statement to its shape: literals become ?, whitespace is squeezed"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(?)', sql)
+    return _SPACE.sub(' ', sql).strip()[:300]
+
+
+class RequestMetrics:
+    """What one request spent, collected on ``g`` while it runs"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+        self.status = 500
+        self._render_started = None
+
+    def query(self, sql, elapsed):
+        self.queries += 1
+        self.sql_time += elapsed
+        self.statements[sql] += 1
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times every statement run through it
+
+    Only the execute call is timed, which for SQLite covers preparing the
+    statement and stepping to the first row; rows fetched later from a
+    lazily iterated cursor are not included.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_query(sql_script, time.perf_counter() - started)
+
+
+def _record_query(sql, elapsed):
+    if not has_app_context():
+        return
+    current = g.get('_metrics')
+    if current is not None:
+        current.query(sql, elapsed)
+    if elapsed * 1000 >= current_app.config['METRICS_SLOW_QUERY_MS']:
+        get_registry().slow_query(normalize_sql(sql), elapsed)
+
+
+class Registry:
+    """Process-wide counters, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._latency = {}
+        self._queries = Counter()
+        self._sql_seconds = Counter()
+        self._template_seconds = Counter()
+        self._slow = {}
+        self._n_plus_one = Counter()
+
+    def observe(self, endpoint, method, status, current):
+        elapsed = time.perf_counter() - current.started
+        with self._lock:
+            self._requests[endpoint, method, status] += 1
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += 1
+            histogram[2] += elapsed
+            self._queries[endpoint] += current.queries
+            self._sql_seconds[endpoint] += current.sql_time
+            self._template_seconds[endpoint] += current.template_time
+
+    def slow_query(self, statement, elapsed):
+        with self._lock:
+            entry = self._slow.get(statement)
+            if entry is None:
+                if len(self._slow) >= MAX_TRACKED_STATEMENTS:
+                    return
+                entry = self._slow[statement] = [0, 0.0]
+                current_app.logger.warning('Slow query (%.0f ms): %s', elapsed * 1000, statement)
+            entry[0] += 1
+            entry[1] = max(entry[1], elapsed)
+
+    def n_plus_one(self, endpoint, statement, repeats):
+        key = (endpoint, statement)
+        with self._lock:
+            if key not in self._n_plus_one:
+                if len(self._n_plus_one) >= MAX_TRACKED_STATEMENTS:
+                    return
+                current_app.logger.warning('Possible N+1 in %s: %d x %s', endpoint, repeats, statement)
+            self._n_plus_one[key] += 1
+
+    def render(self, pool_stats=None):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('rentbnb_requests_total', 'counter', 'Requests handled, by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'rentbnb_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+            family('rentbnb_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+            for endpoint, (counts, total, seconds) in sorted(self._latency.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'rentbnb_request_duration_seconds_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}')
+                lines.append(f'rentbnb_request_duration_seconds_bucket{_labels(endpoint=endpoint, le="+Inf")} {total}')
+                lines.append(f'rentbnb_request_duration_seconds_count{_labels(endpoint=endpoint)} {total}')
+                lines.append(f'rentbnb_request_duration_seconds_sum{_labels(endpoint=endpoint)} {seconds:.6f}')
+
+            family('rentbnb_request_queries_total', 'counter', 'SQL statements run, by endpoint.')
+            for endpoint, count in sorted(self._queries.items()):
+                lines.append(f'rentbnb_request_queries_total{_labels(endpoint=endpoint)} {count}')
+            for name, values, help_text in (
+                ('rentbnb_request_sql_seconds_total', self._sql_seconds, 'Time spent executing SQL, by endpoint.'),
+                ('rentbnb_request_template_seconds_total', self._template_seconds, 'Time spent rendering templates, by endpoint.'),
+            ):
+                family(name, 'counter', help_text)
+                for endpoint, seconds in sorted(values.items()):
+                    lines.append(f'{name}{_labels(endpoint=endpoint)} {seconds:.6f}')
+
+            family('rentbnb_slow_queries_total', 'counter', 'Statements slower than METRICS_SLOW_QUERY_MS, by normalized SQL.')
+            for statement, (count, _) in sorted(self._slow.items()):
+                lines.append(f'rentbnb_slow_queries_total{_labels(sql=statement)} {count}')
+            family('rentbnb_slow_query_max_seconds', 'gauge', 'Slowest run seen of each slow statement.')
+            for statement, (_, longest) in sorted(self._slow.items()):
+                lines.append(f'rentbnb_slow_query_max_seconds{_labels(sql=statement)} {longest:.6f}')
+
+            family('rentbnb_n_plus_one_total', 'counter', 'Requests that repeated one statement at least METRICS_N_PLUS_ONE times.')
+            for (endpoint, statement), count in sorted(self._n_plus_one.items()):
+                lines.append(f'rentbnb_n_plus_one_total{_labels(endpoint=endpoint, sql=statement)} {count}')
+
+        if pool_stats:
+            family('rentbnb_db_pool_connections', 'gauge', 'Database pool connections by state.')
+            for state in ('open', 'idle', 'in_use'):
+                lines.append(f'rentbnb_db_pool_connections{_labels(state=state)} {pool_stats[state]}')
+            for key in ('checkouts', 'waits', 'timeouts', 'connects'):
+                family(f'rentbnb_db_pool_{key}_total', 'counter', f'Database pool {key}.')
+                lines.append(f'rentbnb_db_pool_{key}_total {pool_stats[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def get_registry():
+    registry = current_app.extensions.get('metrics')
+    if registry is None:
+        registry = current_app.extensions.setdefault('metrics', Registry())
+    return registry
+
+
+def _start_request():
+    g._metrics = RequestMetrics()
+
+
+def _before_render(sender, template, context, **extra):
+    current = g.get('_metrics')
+    if current is not None:
+        current._render_started = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    current = g.get('_metrics')
+    if current is not None and current._render_started is not None:
+        current.template_time += time.perf_counter() - current._render_started
+        current._render_started = None
+
+
+def _finish_response(response):
+    current = g.get('_metrics')
+    if current is None:
+        return response
+    current.status = response.status_code
+    if current_app.config['METRICS_SERVER_TIMING']:
+        # Streamed bodies render after this point, so their header shows the work done so far
+        total = (time.perf_counter() - current.started) * 1000
+        response.headers['Server-Timing'] = (
+            f'app;dur={total:.1f}, '
+            f'db;dur={current.sql_time * 1000:.1f};desc="{current.queries} queries", '
+            f'tpl;dur={current.template_time * 1000:.1f}'
+        )
+    return response
+
+
+def _end_request(exc=None):
+    current = g.pop('_metrics', None)
+    if current is None or request.endpoint == 'metrics':
+        return
+    endpoint = request.endpoint or 'unmatched'
+    registry = get_registry()
+    registry.observe(endpoint, request.method, current.status, current)
+    threshold = current_app.config['METRICS_N_PLUS_ONE']
+    if threshold and current.statements:
+        for sql, repeats in current.statements.most_common():
+            if repeats < threshold:
+                break
+            registry.n_plus_one(endpoint, normalize_sql(sql), repeats)
+
+
+def metrics_view():
+    """Prometheus scrape endpoint: an admin session or the METRICS_TOKEN bearer token"""
+    token = current_app.config['METRICS_TOKEN']
+    supplied = request.headers.get('Authorization', '')
+    authorized = session.get('role') == 'admin' or (
+        token and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()))
+    if not authorized:
+        abort(403)
+    from db import get_pool
+    body = get_registry().render(get_pool().stats())
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_SERVER_TIMING', False)
+    app.config.setdefault('METRICS_SLOW_QUERY_MS', 100)
+    # A request running the same statement this many times is reported as N+1
+    app.config.setdefault('METRICS_N_PLUS_ONE', 10)
+    app.config.setdefault('METRICS_TOKEN', None)
+    if not app.config['METRICS_ENABLED']:
+        return
+    if app.config.get('DB_CONNECTION_FACTORY') is None:
+        app.config['DB_CONNECTION_FACTORY'] = InstrumentedConnection
+    app.extensions['metrics'] = Registry()
+    app.before_request(_start_request)
+    app.after_request(_finish_response)
+    app.teardown_request(_end_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,119 @@
+import sqlite3
+from datetime import datetime, timezone
+
+import search
+
+def _recreate_search(db):
+    """Swap the search triggers for their current definitions and rebuild what they maintain"""
+    for trigger in ('search_cabins_insert', 'search_cabins_update', 'search_cabins_delete'):
+        db.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    for statement in _statements(search.SEARCH_SCHEMA + search.REBUILD_SQL):
+        db.execute(statement)
+
+
+# Schema changes on top of schema.sql and the modules' ensure_* setup, in
+# order. Each is (version, description, SQL script or callable taking db);
+# versions are never reused or reordered once released.
+MIGRATIONS = [
+    (1, 'Index reviews by booking for review lookups and upserts',
+     'CREATE INDEX IF NOT EXISTS idx_reviews_booking ON reviews (booking_id)'),
+    # Incremental catalog sync (api.py) walks cabins by their fragments.py
+    # version; deletions leave a tombstone stamped from the same sequence
+    (2, 'Track cabin versions and deletions for incremental catalog sync', '''
+        CREATE INDEX IF NOT EXISTS idx_cabins_version ON cabins (version);
+        -- Cabins from before the version column still hold 0; the update
+        -- trigger gives each one a real stamp
+        UPDATE cabins SET version = version WHERE version = 0;
+        CREATE TABLE IF NOT EXISTS cabin_tombstones (
+            version INTEGER PRIMARY KEY,
+            cabin_id INTEGER NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TRIGGER IF NOT EXISTS cabins_tombstone AFTER DELETE ON cabins
+        BEGIN
+            UPDATE fragment_sequence SET value = value + 1 WHERE id = 1;
+            INSERT INTO cabin_tombstones (version, cabin_id)
+            VALUES ((SELECT value FROM fragment_sequence WHERE id = 1), OLD.id);
+        END;
+    '''),
+    # availability.busy_cabins bounds its range by the longest blocking
+    # stay, read from idx_bookings_status_nights instead
+    (3, 'Drop the bookings num_nights index superseded by (status, num_nights)',
+     'DROP INDEX IF EXISTS idx_bookings_num_nights'),
+    # The search triggers now build the amenity array from json_quote, which
+    # escapes every control character, where before only tab, LF and CR were
+    # replaced; amenities such as "Wi-Fi\x0b" no longer make the JSON invalid
+    # and drop the cabin's whole list
+    (4, 'Recreate the search triggers and re-derive cabin amenities', _recreate_search),
+]
+
+MIGRATIONS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
+'''
+
+
+def ensure_schema(db):
+    db.executescript(MIGRATIONS_SCHEMA)
+
+
+def applied(db):
+    """{version: applied_at} for every migration recorded in this database"""
+    return {row['version']: row['applied_at']
+            for row in db.execute('SELECT version, applied_at FROM schema_migrations')}
+
+
+def pending(db, target=None):
+    done = applied(db)
+    return [m for m in MIGRATIONS if m[0] not in done and (target is None or m[0] <= target)]
+
+
+def current_version(db):
+    return db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations').fetchone()[0]
+
+
+def migrate(db, target=None):
+    """Apply pending migrations in order, each in its own write transaction
+
+    The applied set is re-read under the write lock, so several workers
+    starting at once apply each migration exactly once. Returns the
+    versions this call applied.
+    """
+    ensure_schema(db)
+    done = []
+    for version, description, step in pending(db, target):
+        if db.in_transaction:
+            db.commit()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if db.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                db.rollback()
+                continue
+            if callable(step):
+                step(db)
+            else:
+                for statement in _statements(step):
+                    db.execute(statement)
+            db.execute('INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)',
+                       (version, description, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        done.append(version)
+    return done
+
+
+def _statements(script):
+    # executescript would commit the open transaction, so statements run one by one
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
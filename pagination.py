@@ -0,0 +1,113 @@
+import base64
+import binascii
+
+from flask import current_app, request
+
+MAX_PAGE_SIZE = 500
+
+
+def ensure_indexes(db):
+    """Create the (created_at, id) indexes that the paginated lists walk"""
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings (created_at, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_status_created ON bookings (status, created_at, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_user_created ON bookings (user_id, created_at, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, id)')
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (created_at, id) for a cursor token, or None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return created_at, int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class Page:
+    """One page of rows plus the cursor for the page after it"""
+
+    def __init__(self, rows, next_cursor, cursor, limit):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+        self.limit = limit
+
+    @property
+    def is_first(self):
+        return self.cursor is None
+
+
+class LazyRows:
+    """Iterate a cursor lazily while still answering "is there anything?"
+
+    Templates test the list before looping over it, so the first row is
+    fetched up front and everything after it is pulled as the template
+    renders.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._first = cursor.fetchone()
+
+    def __bool__(self):
+        return self._first is not None
+
+    def __iter__(self):
+        if self._first is None:
+            return
+        yield self._first
+        for row in self._cursor:
+            yield row
+
+
+def page_size(default=None):
+    default = default or current_app.config.get('PAGE_SIZE', 50)
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _ordered(sql, where, alias):
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return sql + f' ORDER BY {alias}.created_at DESC, {alias}.id DESC'
+
+
+def keyset_page(db, sql, where, params, alias, default_limit=None):
+    """Run ``sql`` newest first and return the page after the request's ``cursor``
+
+    ``where`` is a list of SQL conditions and ``params`` their parameters;
+    ``alias`` names the table whose (created_at, id) orders the list.
+    """
+    cursor = decode_cursor(request.args.get('cursor'))
+    limit = page_size(default_limit)
+    where = list(where)
+    params = list(params)
+    if cursor is not None:
+        where.append(f'({alias}.created_at, {alias}.id) < (?, ?)')
+        params.extend(cursor)
+    rows = db.execute(_ordered(sql, where, alias) + ' LIMIT ?', params + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return Page(rows, next_cursor, cursor, limit)
+
+
+def stream_rows(db, sql, where, params, alias):
+    """Same ordering as keyset_page, but every row, fetched as it is rendered"""
+    return LazyRows(db.execute(_ordered(sql, where, alias), list(params)))
+
+
+def wants_stream():
+    return request.args.get('stream') == '1'
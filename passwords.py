@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import writes
+
+# Recent failed logins, one row per attempt and key (the email, and the
+# client address), shared by every worker process
+THROTTLE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS login_failures (
+    key TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_login_failures_key ON login_failures (key, failed_at);
+CREATE INDEX IF NOT EXISTS idx_login_failures_failed_at ON login_failures (failed_at);
+'''
+
+
+class HashingBusy(Exception):
+    """Raised instead of queueing when the hashing pool is saturated"""
+
+
+class PasswordHasher:
+    """Runs password hashing in a bounded pool of worker processes
+
+    scrypt is deliberately CPU-heavy; running it in request threads lets a
+    login burst starve every other route. Here at most ``workers`` hashes
+    run at once, at most ``max_pending`` more may wait, and anything beyond
+    that fails fast with HashingBusy. ``workers=0`` hashes inline.
+    """
+
+    def __init__(self, method='scrypt', workers=2, max_pending=16, timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending) if workers else None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._prefix = None
+        self._dummy = None
+
+    def _run(self, fn, *args):
+        if self._slots is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def dummy_hash(self):
+        """Hash of a random password, checked for unknown emails so they cost as much as known ones"""
+        if self._dummy is None:
+            self._dummy = self.hash(os.urandom(16).hex())
+        return self._dummy
+
+    def needs_rehash(self, pwhash):
+        """True when a stored hash was made with other parameters than ``method``"""
+        if self._prefix is None:
+            # werkzeug fills in default parameters, e.g. "scrypt" -> "scrypt:32768:8:1"
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+class LoginThrottle:
+    """Sliding-window limit on failed logins per email and per client address
+
+    Checked before any hashing, so guessing passwords against one account
+    costs the attacker a rejected request rather than costing us an scrypt.
+    Failures are kept in the login_failures table, so every worker process
+    counts the same attempts; the per-address limit stops one client
+    spreading guesses over many accounts.
+    """
+
+    def __init__(self, max_failures=5, window=300, max_address_failures=50):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_address_failures = max_address_failures
+
+    def _limits(self, email, address):
+        return {f'email:{email}': self.max_failures, f'addr:{address}': self.max_address_failures}
+
+    def allow(self, db, email, address):
+        limits = self._limits(email, address)
+        counts = db.execute('''
+            SELECT key, COUNT(*) FROM login_failures
+            WHERE key IN (?, ?) AND failed_at > ?
+            GROUP BY key
+        ''', list(limits) + [time.time() - self.window]).fetchall()
+        return all(count < limits[key] for key, count in counts)
+
+    def _record(self, db, keys, now):
+        db.executemany('INSERT INTO login_failures (key, failed_at) VALUES (?, ?)', [(key, now) for key in keys])
+        # Expired attempts go with each new one, so the table stays small
+        db.execute('DELETE FROM login_failures WHERE failed_at <= ?', (now - self.window,))
+
+    def record_failure(self, db, email, address):
+        writes.run(db, self._record, list(self._limits(email, address)), time.time())
+
+    def _reset(self, db, key):
+        db.execute('DELETE FROM login_failures WHERE key = ?', (key,))
+
+    def reset(self, db, email):
+        """Forget the email's failures after a successful login; the address keeps its count"""
+        key = f'email:{email}'
+        if db.execute('SELECT 1 FROM login_failures WHERE key = ? LIMIT 1', (key,)).fetchone():
+            writes.run(db, self._reset, key)
+
+
+def ensure_schema(db):
+    db.executescript(THROTTLE_SCHEMA)
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config.setdefault('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 16)
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5.0)
+    app.config.setdefault('LOGIN_MAX_FAILURES', 5)
+    app.config.setdefault('LOGIN_FAILURE_WINDOW', 300)
+    # Per client address, across all emails; several users may share one address
+    app.config.setdefault('LOGIN_MAX_ADDRESS_FAILURES', 50)
+
+
+def get_hasher():
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        config = current_app.config
+        hasher = PasswordHasher(method=config['PASSWORD_HASH_METHOD'],
+                                workers=config['PASSWORD_HASH_WORKERS'],
+                                max_pending=config['PASSWORD_HASH_MAX_PENDING'],
+                                timeout=config['PASSWORD_HASH_TIMEOUT'])
+        current_app.extensions['password_hasher'] = hasher
+    return hasher
+
+
+def get_throttle():
+    throttle = current_app.extensions.get('login_throttle')
+    if throttle is None:
+        throttle = LoginThrottle(max_failures=current_app.config['LOGIN_MAX_FAILURES'],
+                                 window=current_app.config['LOGIN_FAILURE_WINDOW'],
+                                 max_address_failures=current_app.config['LOGIN_MAX_ADDRESS_FAILURES'])
+        current_app.extensions['login_throttle'] = throttle
+    return throttle
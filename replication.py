@@ -0,0 +1,287 @@
+import itertools
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app, g, has_request_context, request, session
+
+import db as dbpool
+from db import get_db
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Session key holding the time of the session's last write request
+WRITTEN_AT = 'db_written_at'
+
+# Written into each replica after a sync so readers can tell how far behind it is
+REPLICA_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS replica_sync (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    synced_at REAL NOT NULL
+);
+'''
+
+# Pragmas that change the file rather than the connection; a read-only
+# connection cannot apply them, so replicas open without them
+WRITE_PRAGMAS = ('journal_mode', 'synchronous')
+
+# A replica's lag is re-read from its replica_sync row at most this often
+LAG_CHECK_INTERVAL = 1.0
+
+_round_robin = itertools.count()
+
+
+class ReplicaPool(dbpool.ConnectionPool):
+    """Read-only pool on one replica file that also tracks how stale the replica is"""
+
+    def __init__(self, database, **kwargs):
+        super().__init__(database, readonly=True, **kwargs)
+        self._synced_at = None
+        self._lag_checked = 0.0
+
+    def lag(self, conn):
+        """Seconds since the snapshot this replica holds; 0 when it was not made by sync()"""
+        now = time.time()
+        if now - self._lag_checked >= LAG_CHECK_INTERVAL:
+            try:
+                row = conn.execute('SELECT synced_at FROM replica_sync WHERE id = 1').fetchone()
+            except sqlite3.OperationalError:
+                row = None
+            self._synced_at = row[0] if row else None
+            self._lag_checked = now
+        return 0.0 if self._synced_at is None else now - self._synced_at
+
+
+_pools_lock = threading.Lock()
+
+
+def replica_pragmas(pragmas):
+    """DB_PRAGMAS without the ones a read-only connection cannot apply"""
+    return {name: value for name, value in pragmas.items() if name not in WRITE_PRAGMAS}
+
+
+def get_replica_pools(app=None):
+    app = app or current_app
+    replicas = list(app.config['DB_REPLICAS'])
+    pools = app.extensions.get('db_replica_pools')
+    if pools is None or [pool.database for pool in pools] != replicas:
+        with _pools_lock:
+            pools = app.extensions.get('db_replica_pools')
+            if pools is None or [pool.database for pool in pools] != replicas:
+                for pool in pools or ():
+                    pool.close()
+                pools = [ReplicaPool(path,
+                                     size=app.config['DB_POOL_SIZE'],
+                                     timeout=app.config['DB_POOL_TIMEOUT'],
+                                     pragmas=replica_pragmas(app.config['DB_PRAGMAS']),
+                                     trace=app.config['DB_TRACE'],
+                                     factory=app.config['DB_CONNECTION_FACTORY'],
+                                     backend=dbpool.BACKENDS[app.config['DB_BACKEND']])
+                         for path in replicas]
+                app.extensions['db_replica_pools'] = pools
+    return pools
+
+
+def _wrote_recently():
+    sticky = current_app.config['DB_REPLICA_STICKY_SECONDS']
+    return session.get(WRITTEN_AT, 0) > time.time() - sticky
+
+
+def _acquire_replica():
+    """A connection to a fresh enough replica for this request, or None to use the primary"""
+    if not current_app.config['DB_REPLICAS'] or not has_request_context():
+        return None
+    if request.method not in SAFE_METHODS or _wrote_recently():
+        return None
+    pools = get_replica_pools()
+    start = next(_round_robin)
+    for i in range(len(pools)):
+        pool = pools[(start + i) % len(pools)]
+        try:
+            conn = pool.acquire()
+        except sqlite3.Error as e:
+            current_app.logger.warning('Replica %s unavailable: %s', pool.database, e)
+            continue
+        if pool.lag(conn) > current_app.config['DB_REPLICA_MAX_LAG']:
+            pool.release(conn)
+            continue
+        g.read_pool = pool
+        return conn
+    return None
+
+
+def get_read_db():
+    """Connection for the read-only queries of the current request
+
+    With DB_REPLICAS set, GET requests read from a replica, round robin.
+    Requests that write, sessions that wrote within
+    DB_REPLICA_STICKY_SECONDS (so they see their own writes) and replicas
+    more than DB_REPLICA_MAX_LAG seconds behind use the primary from
+    get_db() instead, as does everything outside a request.
+    """
+    if 'read_db' in g:
+        return g.read_db
+    conn = _acquire_replica()
+    if conn is None:
+        return get_db()
+    g.read_db = conn
+    return conn
+
+
+def close_read_db(exc=None):
+    conn = g.pop('read_db', None)
+    if conn is not None:
+        g.pop('read_pool').release(conn)
+
+
+def _remember_write(response):
+    if (current_app.config['DB_REPLICAS'] and request.method not in SAFE_METHODS
+            and response.status_code < 400):
+        session[WRITTEN_AT] = time.time()
+    return response
+
+
+def sync(db, replicas):
+    """Copy the primary ``db`` into each replica file in place; returns {path: seconds}
+
+    Uses the online backup API, so the primary keeps taking writes and the
+    replicas' readers keep their snapshot until the copy commits. The time
+    the copy started is recorded in the replica as its sync point.
+    """
+    timings = {}
+    for path in replicas:
+        started = time.time()
+        if db.in_transaction:
+            db.commit()
+        target = sqlite3.connect(path, timeout=30)
+        try:
+            db.backup(target)
+            target.executescript(REPLICA_SCHEMA)
+            target.execute('INSERT OR REPLACE INTO replica_sync (id, synced_at) VALUES (1, ?)', (started,))
+            target.commit()
+        finally:
+            target.close()
+        timings[path] = time.time() - started
+    return timings
+
+
+def mark_synced(replicas, synced_at):
+    """Move each replica's sync point forward without copying, when the primary is unchanged"""
+    for path in replicas:
+        target = sqlite3.connect(path, timeout=30)
+        try:
+            target.execute('UPDATE replica_sync SET synced_at = ? WHERE id = 1', (synced_at,))
+            target.commit()
+        finally:
+            target.close()
+
+
+class ReplicaSyncer:
+    """Copies the primary to every replica each ``interval`` seconds
+
+    Keeps one connection to the primary open: PRAGMA data_version on it
+    changes only when another connection commits, so ticks where nothing
+    was written just move the replicas' sync point forward.
+    """
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='replica-sync', daemon=True)
+        self._data_version = None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def tick(self, conn):
+        replicas = self.app.config['DB_REPLICAS']
+        started = time.time()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            mark_synced(replicas, started)
+            return {}
+        timings = sync(conn, replicas)
+        self._data_version = data_version
+        return timings
+
+    def _run(self):
+        config = self.app.config
+        pool = dbpool.ConnectionPool(config['DATABASE'], size=1, pragmas=config['DB_PRAGMAS'],
+                                     backend=dbpool.BACKENDS[config['DB_BACKEND']])
+        conn = pool.acquire()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.tick(conn)
+                except Exception:
+                    self.app.logger.exception('Replica sync failed')
+                    self._data_version = None
+                self._stop.wait(self.interval)
+        finally:
+            pool.release(conn)
+            pool.close()
+
+
+_start_lock = threading.Lock()
+
+
+def _start_in_process():
+    app = current_app._get_current_object()
+    if not app.config['DB_REPLICA_SYNC_IN_PROCESS'] or not app.config['DB_REPLICAS'] \
+            or 'replica_syncer' in app.extensions:
+        return
+    with _start_lock:
+        if 'replica_syncer' not in app.extensions:
+            syncer = ReplicaSyncer(app, app.config['DB_REPLICA_SYNC_INTERVAL'])
+            app.extensions['replica_syncer'] = syncer
+            syncer.start()
+
+
+def stats(app=None):
+    """Pool stats per replica file"""
+    app = app or current_app
+    return {pool.database: pool.stats() for pool in get_replica_pools(app)}
+
+
+def init_app(app):
+    # Read-only copies of DATABASE; GET requests read from them, round robin
+    app.config.setdefault('DB_REPLICAS', [])
+    # After a write, the session reads from the primary for this long; keep
+    # it above the sync interval plus the time a sync takes
+    app.config.setdefault('DB_REPLICA_STICKY_SECONDS', 5.0)
+    app.config.setdefault('DB_REPLICA_MAX_LAG', 30.0)
+    app.config.setdefault('DB_REPLICA_SYNC_INTERVAL', 1.0)
+    # Sync from a thread in the first worker that serves a request (local
+    # testing); otherwise run "flask sync-replicas" once, next to the workers
+    app.config.setdefault('DB_REPLICA_SYNC_IN_PROCESS', False)
+    app.before_request(_start_in_process)
+    app.after_request(_remember_write)
+    app.teardown_appcontext(close_read_db)
+
+    @app.cli.command('sync-replicas')
+    @click.option('--once', is_flag=True, help='Copy the primary to every replica once and exit.')
+    def sync_replicas_command(once):
+        """Keep the DB_REPLICAS files in sync with the primary database."""
+        replicas = app.config['DB_REPLICAS']
+        if not replicas:
+            raise click.ClickException('DB_REPLICAS is not set.')
+        if once:
+            for path, seconds in sync(get_db(), replicas).items():
+                click.echo(f'{path}: {seconds:.2f}s')
+            return
+        click.echo(f'Syncing {len(replicas)} replicas every {app.config["DB_REPLICA_SYNC_INTERVAL"]}s; '
+                   'Ctrl+C to stop.')
+        syncer = ReplicaSyncer(app, app.config['DB_REPLICA_SYNC_INTERVAL'])
+        conn = get_db()
+        try:
+            while True:
+                for path, seconds in syncer.tick(conn).items():
+                    click.echo(f'{path}: {seconds:.2f}s')
+                time.sleep(syncer.interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,218 @@
+import json
+from datetime import timedelta
+
+import pagination
+
+# The SQL the routes run for users, cabins and bookings. Each function takes
+# the connection to use: routes pass get_read_db() for reads, which may be a
+# replica, and hand the write functions to writes.run, which applies them
+# on the primary. Cached cabin reads are in catalog, booking creation and
+# status changes in availability, and reviews in reviews. Modules that own
+# their tables, triggers or aggregate queries (search, stats, analytics,
+# scheduler, transfers) keep that SQL beside the code that maintains it.
+
+CABIN_FIELDS = ('name', 'cabin_number', 'capacity', 'price_per_night', 'description', 'amenities', 'image_url')
+
+ADMIN_BOOKINGS_QUERY = '''
+    SELECT b.*, c.name as cabin_name, c.cabin_number,
+           u.name as guest_name, u.email as guest_email
+    FROM bookings b
+    JOIN cabins c ON b.cabin_id = c.id
+    JOIN users u ON b.user_id = u.id
+'''
+
+CLIENT_BOOKINGS_QUERY = '''
+    SELECT b.*, c.name as cabin_name, c.cabin_number, c.image_url
+    FROM bookings b
+    JOIN cabins c ON b.cabin_id = c.id
+'''
+
+
+def _listing(db, sql, where, params, alias, stream):
+    """(rows, page) newest first: a keyset page, or every row lazily with page None"""
+    if stream:
+        return pagination.stream_rows(db, sql, where, params, alias), None
+    page = pagination.keyset_page(db, sql, where, params, alias)
+    return page.rows, page
+
+
+# Users
+
+def find_user_by_email(db, email):
+    return db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+
+
+def email_registered(db, email):
+    return db.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone() is not None
+
+
+def create_user(db, name, email, password_hash, phone, role):
+    db.execute('INSERT INTO users (name, email, password, phone, role) VALUES (?, ?, ?, ?, ?)',
+               (name, email, password_hash, phone, role))
+
+
+def set_password(db, user_id, password_hash):
+    db.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
+
+
+def list_users(db, stream=False):
+    return _listing(db, 'SELECT u.* FROM users u', [], [], 'u', stream)
+
+
+# Cabins
+
+def list_cabins_by_number(db):
+    return db.execute('SELECT * FROM cabins ORDER BY cabin_number').fetchall()
+
+
+def find_cabin(db, cabin_id):
+    """The cabin row read directly, bypassing the catalog cache"""
+    return db.execute('SELECT * FROM cabins WHERE id = ?', (cabin_id,)).fetchone()
+
+
+def create_cabin(db, fields):
+    """Insert a cabin from a dict with the CABIN_FIELDS keys"""
+    db.execute(f'''
+        INSERT INTO cabins ({', '.join(CABIN_FIELDS)})
+        VALUES ({', '.join('?' * len(CABIN_FIELDS))})
+    ''', [fields[name] for name in CABIN_FIELDS])
+
+
+def update_cabin(db, cabin_id, fields):
+    return db.execute(f'''
+        UPDATE cabins SET {', '.join(f'{name} = ?' for name in CABIN_FIELDS)}
+        WHERE id = ?
+    ''', [fields[name] for name in CABIN_FIELDS] + [cabin_id]).rowcount
+
+
+def delete_cabin(db, cabin_id):
+    return db.execute('DELETE FROM cabins WHERE id = ?', (cabin_id,)).rowcount
+
+
+def rename_image_url(db, old_url, new_url):
+    return db.execute('UPDATE cabins SET image_url = ? WHERE image_url = ?', (new_url, old_url)).rowcount
+
+
+def cabins_by_ids(db, cabin_ids):
+    """Cabin rows for a list of ids in one query, in id order"""
+    return db.execute('SELECT * FROM cabins WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id',
+                      (json.dumps(cabin_ids),)).fetchall()
+
+
+def cabin_changes(db, since, limit):
+    """(cabin id, version, deleted) for cabins written or deleted after version ``since``, oldest first
+
+    Versions come from one sequence bumped inside each writing transaction,
+    and SQLite commits one writer at a time, so a change can never appear
+    below a version a reader has already passed.
+    """
+    return db.execute('''
+        SELECT id, version, 0 AS deleted FROM cabins WHERE version > ?
+        UNION ALL
+        SELECT cabin_id, version, 1 FROM cabin_tombstones WHERE version > ?
+        ORDER BY version
+        LIMIT ?
+    ''', (since, since, limit)).fetchall()
+
+
+# Bookings
+
+def arrivals(db, day):
+    """Unconfirmed bookings checking in on ``day`` (a range on check_in so the index is used)"""
+    return db.execute('''
+        SELECT b.*, c.name as cabin_name, u.name as guest_name, u.email as guest_email
+        FROM bookings b
+        JOIN cabins c ON b.cabin_id = c.id
+        JOIN users u ON b.user_id = u.id
+        WHERE b.status = 'unconfirmed' AND b.check_in >= ? AND b.check_in < ?
+        ORDER BY b.check_in
+    ''', (day.isoformat(), (day + timedelta(days=1)).isoformat())).fetchall()
+
+
+def recent_bookings(db, limit=10):
+    return db.execute('''
+        SELECT b.*, c.name as cabin_name, u.name as guest_name
+        FROM bookings b
+        JOIN cabins c ON b.cabin_id = c.id
+        JOIN users u ON b.user_id = u.id
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def list_bookings(db, status=None, stream=False):
+    where, params = [], []
+    if status is not None:
+        where.append('b.status = ?')
+        params.append(status)
+    return _listing(db, ADMIN_BOOKINGS_QUERY, where, params, 'b', stream)
+
+
+def recent_user_bookings(db, user_id, limit=5):
+    return db.execute(CLIENT_BOOKINGS_QUERY + '''
+        WHERE b.user_id = ?
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT ?
+    ''', (user_id, limit)).fetchall()
+
+
+def list_user_bookings(db, user_id, stream=False):
+    return _listing(db, CLIENT_BOOKINGS_QUERY, ['b.user_id = ?'], [user_id], 'b', stream)
+
+
+def booking_detail(db, booking_id):
+    """A booking with its cabin and guest, live or archived, for the admin pages"""
+    # Old stays may have been moved to the archive by the scheduler
+    for table in ('bookings', 'bookings_archive'):
+        booking = db.execute(f'''
+            SELECT b.*, c.name as cabin_name, c.cabin_number, c.price_per_night,
+                   u.name as guest_name, u.email as guest_email, u.phone as guest_phone,
+                   u.national_id
+            FROM {table} b
+            JOIN cabins c ON b.cabin_id = c.id
+            JOIN users u ON b.user_id = u.id
+            WHERE b.id = ?
+        ''', (booking_id,)).fetchone()
+        if booking:
+            return booking
+    return None
+
+
+def user_booking_detail(db, booking_id, user_id):
+    """One of the user's bookings with its cabin, live or archived"""
+    for table in ('bookings', 'bookings_archive'):
+        booking = db.execute(f'''
+            SELECT b.*, c.name as cabin_name, c.cabin_number, c.price_per_night, c.image_url
+            FROM {table} b
+            JOIN cabins c ON b.cabin_id = c.id
+            WHERE b.id = ? AND b.user_id = ?
+        ''', (booking_id, user_id)).fetchone()
+        if booking:
+            return booking
+    return None
+
+
+def find_user_booking(db, booking_id, user_id, status=None):
+    """The user's live booking row, optionally only in ``status``"""
+    sql, params = 'SELECT * FROM bookings WHERE id = ? AND user_id = ?', [booking_id, user_id]
+    if status is not None:
+        sql += ' AND status = ?'
+        params.append(status)
+    return db.execute(sql, params).fetchone()
+
+
+def bookings_by_ids(db, booking_ids, user_id=None):
+    """Bookings with these ids, live or archived, in one query; only ``user_id``'s when given"""
+    owner, params = '', [json.dumps(booking_ids)]
+    if user_id is not None:
+        owner = 'AND b.user_id = ?'
+        params.append(user_id)
+    selects = [f'''
+        SELECT b.id, b.user_id, b.cabin_id, b.check_in, b.check_out, b.num_nights, b.num_guests,
+               b.observations, b.breakfast_included, b.total_price, b.status, b.created_at,
+               c.name as cabin_name
+        FROM {table} b
+        JOIN cabins c ON b.cabin_id = c.id
+        WHERE b.id IN (SELECT value FROM json_each(?)) {owner}
+    ''' for table in ('bookings', 'bookings_archive')]
+    return db.execute(' UNION ALL '.join(selects), params * 2).fetchall()
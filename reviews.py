@@ -0,0 +1,101 @@
+import click
+
+import pagination
+from db import get_db
+
+# Per-cabin rating aggregates stored as columns on cabins, so every query
+# that already reads a cabin row gets its rating for free.
+AGGREGATE_COLUMNS = ['review_count', 'rating_sum'] + [f'rating_{n}' for n in range(1, 6)]
+
+REVIEWS_PAGE_SIZE = 10
+
+
+def _delta(row, sign):
+    histogram = ', '.join(f'rating_{n} = rating_{n} {sign} ({row}.rating = {n})' for n in range(1, 6))
+    return f'''
+    UPDATE cabins SET
+        review_count = review_count {sign} 1,
+        rating_sum = rating_sum {sign} {row}.rating,
+        {histogram}
+    WHERE id = {row}.cabin_id;
+'''
+
+
+REVIEW_TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS reviews_aggregate_insert AFTER INSERT ON reviews
+BEGIN {_delta('NEW', '+')} END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_aggregate_delete AFTER DELETE ON reviews
+BEGIN {_delta('OLD', '-')} END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_aggregate_update AFTER UPDATE OF rating, cabin_id ON reviews
+BEGIN {_delta('OLD', '-')} {_delta('NEW', '+')} END;
+'''
+
+
+def ensure_schema(db):
+    """Add the aggregate columns, review index and triggers; backfill on first run"""
+    existing = {row['name'] for row in db.execute('PRAGMA table_info(cabins)')}
+    missing = [name for name in AGGREGATE_COLUMNS if name not in existing]
+    for name in missing:
+        db.execute(f'ALTER TABLE cabins ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_reviews_cabin_created ON reviews (cabin_id, created_at, id)')
+    db.executescript(REVIEW_TRIGGERS)
+    if missing:
+        rebuild(db)
+
+
+def rebuild(db):
+    """Recompute every cabin's rating aggregates from the reviews table"""
+    histogram = ', '.join(
+        f'rating_{n} = (SELECT COUNT(*) FROM reviews r WHERE r.cabin_id = cabins.id AND r.rating = {n})'
+        for n in range(1, 6))
+    db.execute(f'''
+        UPDATE cabins SET
+            review_count = (SELECT COUNT(*) FROM reviews r WHERE r.cabin_id = cabins.id),
+            rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews r WHERE r.cabin_id = cabins.id),
+            {histogram}
+    ''')
+    db.commit()
+
+
+def rating_summary(cabin):
+    """Average, count and 5..1 histogram for a cabin row, for templates"""
+    count = cabin['review_count'] or 0
+    return {
+        'count': count,
+        'average': cabin['rating_sum'] / count if count else None,
+        'histogram': [(n, cabin[f'rating_{n}']) for n in range(5, 0, -1)],
+    }
+
+
+def save_review(db, user_id, cabin_id, booking_id, rating, comment):
+    """Create the booking's review, or replace its rating and comment if it has one"""
+    updated = db.execute('''
+        UPDATE reviews SET rating = ?, comment = ?
+        WHERE booking_id = ?
+    ''', (rating, comment, booking_id)).rowcount
+    if not updated:
+        db.execute('''
+            INSERT INTO reviews (user_id, cabin_id, booking_id, rating, comment)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, cabin_id, booking_id, rating, comment))
+
+
+def review_page(db, cabin_id):
+    """One keyset page of a cabin's reviews, newest first"""
+    return pagination.keyset_page(db, '''
+        SELECT r.*, u.name as user_name
+        FROM reviews r
+        JOIN users u ON r.user_id = u.id
+    ''', ['r.cabin_id = ?'], [cabin_id], 'r', default_limit=REVIEWS_PAGE_SIZE)
+
+
+def init_app(app):
+    app.add_template_global(rating_summary)
+
+    @app.cli.command('rebuild-ratings')
+    def rebuild_ratings_command():
+        """Recompute cabin rating aggregates from the reviews table."""
+        rebuild(get_db())
+        click.echo('Cabin rating aggregates rebuilt.')
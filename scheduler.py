@@ -0,0 +1,274 @@
+import os
+import socket
+import threading
+import time
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+
+import availability
+from db import get_db
+
+BOOKING_COLUMNS = ('id, user_id, cabin_id, check_in, check_out, num_nights, num_guests, '
+                   'observations, breakfast_included, total_price, status, created_at')
+
+# Finished bookings are moved here once they fall behind ARCHIVE_AFTER_DAYS,
+# keeping the hot table and its indexes to the recent and upcoming stays.
+SCHEDULER_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bookings_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    cabin_id INTEGER NOT NULL,
+    check_in DATE NOT NULL,
+    check_out DATE NOT NULL,
+    num_nights INTEGER NOT NULL,
+    num_guests INTEGER NOT NULL,
+    observations TEXT,
+    breakfast_included BOOLEAN DEFAULT 0,
+    total_price REAL NOT NULL,
+    status TEXT NOT NULL,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_user ON bookings_archive (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_check_in ON bookings_archive (check_in);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_status_nights ON bookings_archive (status, num_nights);
+
+-- One row per job: when it last finished, and which worker holds it now
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    last_run REAL,
+    last_result TEXT,
+    lease_owner TEXT,
+    lease_expires REAL
+);
+'''
+
+
+def ensure_schema(db):
+    db.executescript(SCHEDULER_SCHEMA)
+
+
+def _batched(db, select_sql, params, apply, batch_size):
+    """Run ``apply(ids)`` on batches from ``select_sql`` until it returns nothing
+
+    Each batch is its own short write transaction, and the select only
+    matches rows the job has not handled yet, so a crashed or repeated run
+    simply carries on where the last one stopped.
+    """
+    total = 0
+    while True:
+        if db.in_transaction:
+            db.commit()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [row[0] for row in db.execute(select_sql + ' LIMIT ?', params + [batch_size])]
+            if ids:
+                apply(ids)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        for booking_id in ids:
+            availability.release_booking(booking_id)
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+
+
+def _placeholders(ids):
+    return ','.join('?' * len(ids))
+
+
+def expire_unconfirmed(db, today=None, batch_size=None):
+    """Cancel unconfirmed bookings whose check-in passed more than the grace period ago"""
+    today = today or date.today()
+    cutoff = today - timedelta(days=current_app.config['BOOKING_EXPIRE_AFTER_DAYS'])
+    return _batched(db, '''
+        SELECT id FROM bookings WHERE status = "unconfirmed" AND check_in < ?
+    ''', [cutoff.isoformat()], lambda ids: db.execute(f'''
+        UPDATE bookings SET status = "cancelled"
+        WHERE status = "unconfirmed" AND id IN ({_placeholders(ids)})
+    ''', ids), batch_size or current_app.config['JOB_BATCH_SIZE'])
+
+
+def auto_check_out(db, today=None, batch_size=None):
+    """Check out guests whose stay ended before today"""
+    today = today or date.today()
+    return _batched(db, '''
+        SELECT id FROM bookings WHERE status = "checked_in" AND check_out < ?
+    ''', [today.isoformat()], lambda ids: db.execute(f'''
+        UPDATE bookings SET status = "checked_out"
+        WHERE status = "checked_in" AND id IN ({_placeholders(ids)})
+    ''', ids), batch_size or current_app.config['JOB_BATCH_SIZE'])
+
+
+def archive_bookings(db, today=None, batch_size=None):
+    """Move checked-out and cancelled bookings older than the horizon to bookings_archive
+
+    Deleting from ``bookings`` takes the rows out of the dashboard totals via
+    the stats triggers, so the share newly archived is added back in the
+    same transaction; total bookings and sales keep counting archived stays.
+    Reviews keep their booking_id, which then refers to the archived row.
+    """
+    today = today or date.today()
+    cutoff = today - timedelta(days=current_app.config['ARCHIVE_AFTER_DAYS'])
+
+    def move(ids):
+        marks = _placeholders(ids)
+        # INSERT OR IGNORE skips ids the archive already holds, and those are
+        # counted there already, so only the rows it will insert are added back
+        new = f'id IN ({marks}) AND id NOT IN (SELECT id FROM bookings_archive)'
+        db.execute(f'''
+            UPDATE dashboard_stats SET
+                total_bookings = total_bookings + (SELECT COUNT(*) FROM bookings WHERE {new}),
+                total_sales = total_sales + (SELECT COALESCE(SUM(total_price), 0) FROM bookings
+                                             WHERE {new} AND status != 'cancelled')
+            WHERE id = 1
+        ''', ids * 2)
+        db.execute(f'''
+            INSERT OR IGNORE INTO bookings_archive ({BOOKING_COLUMNS})
+            SELECT {BOOKING_COLUMNS} FROM bookings WHERE id IN ({marks})
+        ''', ids)
+        db.execute(f'DELETE FROM bookings WHERE id IN ({marks})', ids)
+
+    return _batched(db, '''
+        SELECT id FROM bookings
+        WHERE status IN ("checked_out", "cancelled") AND check_out < ?
+    ''', [cutoff.isoformat()], move, batch_size or current_app.config['JOB_BATCH_SIZE'])
+
+
+# name -> (function, config key holding its interval in seconds)
+JOBS = {
+    'expire-unconfirmed': (expire_unconfirmed, 'JOB_EXPIRE_INTERVAL'),
+    'auto-check-out': (auto_check_out, 'JOB_CHECKOUT_INTERVAL'),
+    'archive-bookings': (archive_bookings, 'JOB_ARCHIVE_INTERVAL'),
+}
+
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _claim(db, name, owner, interval, force):
+    """Take the job's lease if it is due and no other worker holds it"""
+    now = time.time()
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('INSERT OR IGNORE INTO scheduled_jobs (name) VALUES (?)', (name,))
+        claimed = db.execute('''
+            UPDATE scheduled_jobs SET lease_owner = ?, lease_expires = ?
+            WHERE name = ?
+            AND (lease_owner IS NULL OR lease_expires < ?)
+            AND (? OR last_run IS NULL OR last_run + ? <= ?)
+        ''', (owner, now + current_app.config['JOB_LEASE_SECONDS'], name, now, force, interval, now)).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return claimed == 1
+
+
+def _finish(db, name, owner, result):
+    db.execute('''
+        UPDATE scheduled_jobs SET last_run = ?, last_result = ?, lease_owner = NULL, lease_expires = NULL
+        WHERE name = ? AND lease_owner = ?
+    ''', (time.time(), result, name, owner))
+    db.commit()
+
+
+def run_due_jobs(db, force=False, only=None):
+    """Run every job whose interval has elapsed; returns {name: rows handled}
+
+    The lease in scheduled_jobs makes this safe to call from any number of
+    workers at once: exactly one of them runs a given job per interval.
+    """
+    owner = _worker_id()
+    results = {}
+    for name, (job, interval_key) in JOBS.items():
+        if only and name not in only:
+            continue
+        if not _claim(db, name, owner, current_app.config[interval_key], force):
+            continue
+        try:
+            results[name] = job(db)
+        except Exception as e:
+            current_app.logger.exception('Scheduled job %s failed', name)
+            _finish(db, name, owner, f'error: {e}')
+        else:
+            _finish(db, name, owner, f'{results[name]} rows')
+    return results
+
+
+class Scheduler:
+    """Daemon thread that runs due jobs every ``tick`` seconds inside a web worker"""
+
+    def __init__(self, app, tick):
+        self.app = app
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                with self.app.app_context():
+                    run_due_jobs(get_db())
+            except Exception:
+                self.app.logger.exception('Job scheduler tick failed')
+
+
+_start_lock = threading.Lock()
+
+
+def _start_in_process():
+    app = current_app._get_current_object()
+    if not app.config['SCHEDULER_IN_PROCESS'] or 'scheduler' in app.extensions:
+        return
+    with _start_lock:
+        if 'scheduler' not in app.extensions:
+            scheduler = Scheduler(app, app.config['SCHEDULER_TICK'])
+            app.extensions['scheduler'] = scheduler
+            scheduler.start()
+
+
+def init_app(app):
+    app.config.setdefault('SCHEDULER_IN_PROCESS', False)
+    app.config.setdefault('SCHEDULER_TICK', 60)
+    app.config.setdefault('JOB_BATCH_SIZE', 500)
+    app.config.setdefault('JOB_LEASE_SECONDS', 600)
+    app.config.setdefault('JOB_EXPIRE_INTERVAL', 3600)
+    app.config.setdefault('JOB_CHECKOUT_INTERVAL', 3600)
+    app.config.setdefault('JOB_ARCHIVE_INTERVAL', 86400)
+    # Unconfirmed bookings are cancelled once their check-in is more than this many days past
+    app.config.setdefault('BOOKING_EXPIRE_AFTER_DAYS', 1)
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)
+    # The in-process scheduler starts with the first request a worker serves
+    app.before_request(_start_in_process)
+
+    @app.cli.command('run-jobs')
+    @click.option('--once', is_flag=True, help='Run every job now and exit, ignoring intervals.')
+    @click.option('--job', 'only', multiple=True, type=click.Choice(sorted(JOBS)), help='Limit to these jobs.')
+    def run_jobs_command(once, only):
+        """Run the booking lifecycle and archiving jobs as a worker."""
+        if once:
+            for name, count in run_due_jobs(get_db(), force=True, only=only).items():
+                click.echo(f'{name}: {count} rows')
+            return
+        click.echo(f'Running jobs every {app.config["SCHEDULER_TICK"]}s; Ctrl+C to stop.')
+        try:
+            while True:
+                for name, count in run_due_jobs(get_db(), only=only).items():
+                    click.echo(f'{name}: {count} rows')
+                time.sleep(app.config['SCHEDULER_TICK'])
+        except KeyboardInterrupt:
+            pass
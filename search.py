@@ -0,0 +1,202 @@
+import json
+import re
+
+import click
+
+import availability
+import catalog
+from db import get_db
+
+# bm25 weights for the name, description and amenities columns
+RANK_WEIGHTS = (10.0, 1.0, 5.0)
+
+_TERM = re.compile(r'\w+')
+# Amenity names are trimmed of spaces and control characters at both ends
+_NAME = f"trim(value, char(32, {', '.join(str(code) for code in range(1, 32))}))"
+
+
+def _split(value):
+    """json_each over a comma-separated column, usable inside a trigger
+
+    Triggers cannot run a recursive CTE, so the list is rewritten as a JSON
+    array instead. json_quote escapes quotes, backslashes and control
+    characters, and none of its escapes holds a comma, so splitting the
+    quoted string on commas yields a valid array whatever the column holds.
+    """
+    return f"""json_each('[' || replace(json_quote({value}), ',', '","') || ']')"""
+
+
+def _link_amenities(row):
+    """Statements filing ``row``'s amenities under the shared amenity names"""
+    items = _split(f"COALESCE({row}.amenities, '')")
+    return f'''
+    INSERT OR IGNORE INTO amenities (name)
+        SELECT {_NAME} FROM {items} WHERE {_NAME} != '';
+    INSERT OR IGNORE INTO cabin_amenities (amenity_id, cabin_id)
+        SELECT a.id, {row}.id FROM {items} JOIN amenities a ON a.name = {_NAME};
+'''
+
+
+# cabins_fts is an external-content index over the cabins table, and
+# cabin_amenities is the comma-separated amenities column as rows; the
+# triggers keep both in step with every write to cabins.
+SEARCH_SCHEMA = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS cabins_fts USING fts5(
+    name, description, amenities,
+    content='cabins', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2'
+);
+
+CREATE TABLE IF NOT EXISTS amenities (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE COLLATE NOCASE
+);
+CREATE TABLE IF NOT EXISTS cabin_amenities (
+    amenity_id INTEGER NOT NULL,
+    cabin_id INTEGER NOT NULL,
+    PRIMARY KEY (amenity_id, cabin_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_cabin_amenities_cabin ON cabin_amenities (cabin_id, amenity_id);
+CREATE INDEX IF NOT EXISTS idx_cabins_capacity_price ON cabins (capacity, price_per_night);
+
+CREATE TRIGGER IF NOT EXISTS search_cabins_insert AFTER INSERT ON cabins
+BEGIN
+    INSERT INTO cabins_fts (rowid, name, description, amenities)
+    VALUES (NEW.id, NEW.name, NEW.description, NEW.amenities);
+    {_link_amenities('NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_cabins_update AFTER UPDATE OF name, description, amenities ON cabins
+BEGIN
+    INSERT INTO cabins_fts (cabins_fts, rowid, name, description, amenities)
+    VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.amenities);
+    INSERT INTO cabins_fts (rowid, name, description, amenities)
+    VALUES (NEW.id, NEW.name, NEW.description, NEW.amenities);
+    DELETE FROM cabin_amenities WHERE cabin_id = OLD.id;
+    {_link_amenities('NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_cabins_delete AFTER DELETE ON cabins
+BEGIN
+    INSERT INTO cabins_fts (cabins_fts, rowid, name, description, amenities)
+    VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.amenities);
+    DELETE FROM cabin_amenities WHERE cabin_id = OLD.id;
+END;
+'''
+
+
+# The same tables rebuilt from scratch, for the first run and for migrations
+# that change the triggers
+REBUILD_SQL = f'''
+INSERT INTO cabins_fts (cabins_fts) VALUES ('rebuild');
+DELETE FROM cabin_amenities;
+INSERT OR IGNORE INTO amenities (name)
+    SELECT {_NAME} FROM cabins c, {_split("COALESCE(c.amenities, '')")} WHERE {_NAME} != '';
+INSERT OR IGNORE INTO cabin_amenities (amenity_id, cabin_id)
+    SELECT a.id, c.id FROM cabins c, {_split("COALESCE(c.amenities, '')")} JOIN amenities a ON a.name = {_NAME};
+DELETE FROM amenities WHERE id NOT IN (SELECT amenity_id FROM cabin_amenities);
+'''
+
+
+def ensure_schema(db):
+    """Create the search index, amenity tables and triggers; backfill on first run"""
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'cabins_fts'").fetchone()
+    db.executescript(SEARCH_SCHEMA)
+    if not exists:
+        rebuild(db)
+
+
+def rebuild(db):
+    """Re-index every cabin and re-derive the amenity tables from the cabins table"""
+    db.executescript(REBUILD_SQL)
+    db.commit()
+
+
+def match_expression(text):
+    """FTS5 query for free text: every word must match, as a prefix"""
+    return ' '.join(f'"{term}"*' for term in _TERM.findall(text or '')) or None
+
+
+def search(db, text='', amenities=(), guests=1, min_price=None, max_price=None,
+           check_in=None, check_out=None):
+    """Cabins matching every filter, best match first, plus amenity facet counts
+
+    Returns ``{'cabins': [rows], 'facets': [(amenity, count)]}``; each facet
+    counts the matching cabins that have that amenity, i.e. how many results
+    remain if it is ticked too. Both come back from one statement: the
+    filtered set is built once as a CTE, and the text match, amenity filter
+    and capacity/price range each run off their own index.
+    """
+    joins = ''
+    where = ['c.capacity >= ?']
+    params = [guests]
+    score = '0.0'
+    match = match_expression(text)
+    if match:
+        joins = 'JOIN cabins_fts ON cabins_fts.rowid = c.id'
+        where.append('cabins_fts MATCH ?')
+        params.append(match)
+        score = f'bm25(cabins_fts, {", ".join(map(str, RANK_WEIGHTS))})'
+    if min_price is not None:
+        where.append('c.price_per_night >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        where.append('c.price_per_night <= ?')
+        params.append(max_price)
+    wanted = list({name.strip().lower(): name.strip() for name in amenities if name.strip()}.values())
+    if wanted:
+        where.append(f'''c.id IN (
+            SELECT ca.cabin_id FROM amenities a JOIN cabin_amenities ca ON ca.amenity_id = a.id
+            WHERE a.name IN ({','.join('?' * len(wanted))})
+            GROUP BY ca.cabin_id HAVING COUNT(*) = ?
+        )''')
+        params += wanted + [len(wanted)]
+    # Full rows come from the catalog cache, which is already warm for listings
+    cabins = catalog.list_cabins(db)
+    if check_in and check_out:
+        index = availability.get_index(db)
+        if index is None:
+            busy_sql, busy_params = availability.busy_cabins(db, check_in, check_out)
+            where.append(f'c.id NOT IN ({busy_sql})')
+            params += busy_params
+        else:
+            # The index names the taken cabins without a query; SQLite gets
+            # whichever of the taken or free lists is shorter to filter on
+            busy = set(index.busy(check_in, check_out))
+            free = [cabin['id'] for cabin in cabins if cabin['id'] not in busy]
+            if len(free) < len(busy):
+                where.append('c.id IN (SELECT value FROM json_each(?))')
+                params.append(json.dumps(free))
+            else:
+                where.append('c.id NOT IN (SELECT value FROM json_each(?))')
+                params.append(json.dumps(sorted(busy)))
+
+    # Cabin rows sort by relevance then price; facet rows by count, as -count
+    rows = db.execute(f'''
+        WITH matched AS (
+            SELECT c.id, c.price_per_night, {score} AS score
+            FROM cabins c {joins}
+            WHERE {' AND '.join(where)}
+        )
+        SELECT 'cabin' AS kind, id, NULL AS label, score, price_per_night AS price FROM matched
+        UNION ALL
+        SELECT 'facet', a.id, a.name, -COUNT(*), 0
+        FROM matched m
+        JOIN cabin_amenities ca ON ca.cabin_id = m.id
+        JOIN amenities a ON a.id = ca.amenity_id
+        GROUP BY a.id
+        ORDER BY kind, score, price, label, id
+    ''', params).fetchall()
+
+    by_id = {cabin['id']: cabin for cabin in cabins}
+    return {
+        'cabins': [by_id[row['id']] for row in rows if row['kind'] == 'cabin' and row['id'] in by_id],
+        'facets': [(row['label'], -int(row['score'])) for row in rows if row['kind'] == 'facet'],
+    }
+
+
+def init_app(app):
+    @app.cli.command('rebuild-search')
+    def rebuild_search_command():
+        """Rebuild the cabin full-text index and amenity tables."""
+        rebuild(get_db())
+        click.echo('Cabin search index rebuilt.')
@@ -0,0 +1,64 @@
+// Loads the cabin's availability calendar once and checks the chosen dates
+// against it, so taken dates are reported before the form is submitted.
+(function() {
+    const form = document.getElementById('bookingForm');
+    if (!form || !form.dataset.calendarUrl) {
+        return;
+    }
+    const checkInInput = document.getElementById('check_in');
+    const checkOutInput = document.getElementById('check_out');
+    const warning = document.getElementById('datesUnavailable');
+    const bookedList = document.getElementById('bookedRanges');
+    const submitButton = form.querySelector('button[type="submit"]');
+    let calendar = null;
+
+    function dayIndex(value) {
+        const start = new Date(calendar.start + 'T00:00:00Z');
+        const day = new Date(value + 'T00:00:00Z');
+        return Math.round((day - start) / (1000 * 60 * 60 * 24));
+    }
+
+    function checkDates() {
+        if (!calendar || !checkInInput.value) {
+            return;
+        }
+        const first = dayIndex(checkInInput.value);
+        // With no check-out yet, only the first night is checked
+        const last = checkOutInput.value ? dayIndex(checkOutInput.value) : first + 1;
+        let taken = false;
+        for (let i = Math.max(first, 0); i < Math.min(last, calendar.days.length); i++) {
+            if (!calendar.days[i].available) {
+                taken = true;
+                break;
+            }
+        }
+        warning.style.display = taken ? 'block' : 'none';
+        submitButton.disabled = taken;
+    }
+
+    function showBooked() {
+        if (!calendar.blocked.length) {
+            bookedList.textContent = 'No dates booked in the next 12 months.';
+            return;
+        }
+        const ranges = calendar.blocked.slice(0, 8).map(function(range) {
+            return range.start + ' → ' + range.end;
+        });
+        bookedList.textContent = 'Already booked: ' + ranges.join(', ') +
+            (calendar.blocked.length > 8 ? ' and ' + (calendar.blocked.length - 8) + ' more' : '');
+    }
+
+    fetch(form.dataset.calendarUrl, {credentials: 'same-origin'})
+        .then(function(response) { return response.ok ? response.json() : null; })
+        .then(function(data) {
+            if (!data) {
+                return;
+            }
+            calendar = data;
+            showBooked();
+            checkDates();
+        });
+
+    checkInInput.addEventListener('change', checkDates);
+    checkOutInput.addEventListener('change', checkDates);
+})();
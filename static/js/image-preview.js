@@ -0,0 +1,14 @@
+function previewImage(event) {
+    const file = event.target.files[0];
+    const preview = document.getElementById('preview-container');
+    
+    if (file) {
+        const reader = new FileReader();
+        reader.onload = function(e) {
+            preview.innerHTML = '<img src="' + e.target.result + '" style="max-width: 300px; max-height: 200px; border-radius: 8px; margin-top: 10px;">';
+        };
+        reader.readAsDataURL(file);
+    } else {
+        preview.innerHTML = '';
+    }
+}
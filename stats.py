@@ -0,0 +1,150 @@
+import click
+
+from db import get_db
+
+# Bookings that hold a cabin, and so count towards occupancy
+ACTIVE = "status IN ('unconfirmed', 'checked_in')"
+
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dashboard_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_bookings INTEGER NOT NULL DEFAULT 0,
+    total_sales REAL NOT NULL DEFAULT 0,
+    checked_in INTEGER NOT NULL DEFAULT 0,
+    occupied_cabins INTEGER NOT NULL DEFAULT 0,
+    total_cabins INTEGER NOT NULL DEFAULT 0
+);
+
+-- Number of active bookings per cabin, so occupied_cabins only changes
+-- when a cabin goes from zero active bookings to one and back
+CREATE TABLE IF NOT EXISTS cabin_activity (
+    cabin_id INTEGER PRIMARY KEY,
+    active INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+# Each trigger body is written as "remove OLD" and/or "add NEW", so an update
+# is simply both. Keeping the maintenance in the database means every write
+# path, present or future, keeps the counters right.
+_REMOVE_OLD = f'''
+    UPDATE dashboard_stats SET
+        total_bookings = total_bookings - 1,
+        total_sales = total_sales - CASE WHEN OLD.status != 'cancelled' THEN OLD.total_price ELSE 0 END,
+        checked_in = checked_in - (OLD.status = 'checked_in'),
+        occupied_cabins = occupied_cabins - (OLD.{ACTIVE}
+            AND (SELECT active FROM cabin_activity WHERE cabin_id = OLD.cabin_id) = 1)
+    WHERE id = 1;
+    UPDATE cabin_activity SET active = active - (OLD.{ACTIVE}) WHERE cabin_id = OLD.cabin_id;
+'''
+
+_ADD_NEW = f'''
+    INSERT OR IGNORE INTO cabin_activity (cabin_id, active) VALUES (NEW.cabin_id, 0);
+    UPDATE dashboard_stats SET
+        total_bookings = total_bookings + 1,
+        total_sales = total_sales + CASE WHEN NEW.status != 'cancelled' THEN NEW.total_price ELSE 0 END,
+        checked_in = checked_in + (NEW.status = 'checked_in'),
+        occupied_cabins = occupied_cabins + (NEW.{ACTIVE}
+            AND (SELECT active FROM cabin_activity WHERE cabin_id = NEW.cabin_id) = 0)
+    WHERE id = 1;
+    UPDATE cabin_activity SET active = active + (NEW.{ACTIVE}) WHERE cabin_id = NEW.cabin_id;
+'''
+
+STATS_TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS stats_bookings_insert AFTER INSERT ON bookings
+BEGIN {_ADD_NEW} END;
+
+CREATE TRIGGER IF NOT EXISTS stats_bookings_delete AFTER DELETE ON bookings
+BEGIN {_REMOVE_OLD} END;
+
+CREATE TRIGGER IF NOT EXISTS stats_bookings_update
+AFTER UPDATE OF status, total_price, cabin_id ON bookings
+BEGIN {_REMOVE_OLD} {_ADD_NEW} END;
+
+CREATE TRIGGER IF NOT EXISTS stats_cabins_insert AFTER INSERT ON cabins
+BEGIN UPDATE dashboard_stats SET total_cabins = total_cabins + 1 WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS stats_cabins_delete AFTER DELETE ON cabins
+BEGIN UPDATE dashboard_stats SET total_cabins = total_cabins - 1 WHERE id = 1; END;
+'''
+
+# The same numbers computed from scratch, used to rebuild and to verify.
+# Totals include stays moved to bookings_archive (see scheduler.py).
+LIVE_AGGREGATES = {
+    'total_bookings': 'SELECT (SELECT COUNT(*) FROM bookings) + (SELECT COUNT(*) FROM bookings_archive)',
+    'total_sales': '''
+        SELECT (SELECT COALESCE(SUM(total_price), 0) FROM bookings WHERE status != 'cancelled')
+             + (SELECT COALESCE(SUM(total_price), 0) FROM bookings_archive WHERE status != 'cancelled')
+    ''',
+    'checked_in': "SELECT COUNT(*) FROM bookings WHERE status = 'checked_in'",
+    'occupied_cabins': f'SELECT COUNT(DISTINCT cabin_id) FROM bookings WHERE {ACTIVE}',
+    'total_cabins': 'SELECT COUNT(*) FROM cabins',
+}
+
+
+def ensure_schema(db):
+    """Create the summary tables and triggers, seeding them on first run"""
+    db.executescript(STATS_SCHEMA)
+    db.executescript(STATS_TRIGGERS)
+    if not db.execute('SELECT 1 FROM dashboard_stats WHERE id = 1').fetchone():
+        rebuild(db)
+
+
+def live(db):
+    """The counters computed from scratch, without storing them"""
+    return {name: db.execute(sql).fetchone()[0] for name, sql in LIVE_AGGREGATES.items()}
+
+
+def rebuild(db):
+    """Recompute every counter from the bookings and cabins tables"""
+    values = live(db)
+    db.execute('DELETE FROM cabin_activity')
+    db.execute(f'''
+        INSERT INTO cabin_activity (cabin_id, active)
+        SELECT cabin_id, SUM({ACTIVE}) FROM bookings GROUP BY cabin_id
+    ''')
+    db.execute('''
+        INSERT OR REPLACE INTO dashboard_stats
+            (id, total_bookings, total_sales, checked_in, occupied_cabins, total_cabins)
+        VALUES (1, :total_bookings, :total_sales, :checked_in, :occupied_cabins, :total_cabins)
+    ''', values)
+    db.commit()
+    return values
+
+
+def read(db):
+    """Return the dashboard counters as a dict, in constant time
+
+    ``db`` may be a read-only replica, so a missing row is answered from
+    the live aggregates rather than rebuilt; ensure_schema seeds it on the
+    primary.
+    """
+    row = db.execute('SELECT * FROM dashboard_stats WHERE id = 1').fetchone()
+    return dict(row) if row else live(db)
+
+
+def check(db):
+    """Compare stored counters with live aggregates; return the mismatches"""
+    stored = read(db)
+    mismatches = {}
+    for name, sql in LIVE_AGGREGATES.items():
+        live = db.execute(sql).fetchone()[0]
+        if abs(stored[name] - live) > 0.005:
+            mismatches[name] = (stored[name], live)
+    return mismatches
+
+
+def init_app(app):
+    @app.cli.command('rebuild-stats')
+    @click.option('--check-only', is_flag=True, help='Only compare the counters, do not rebuild them.')
+    def rebuild_stats_command(check_only):
+        """Rebuild dashboard counters and verify them against live aggregates."""
+        db = get_db()
+        if not check_only:
+            values = rebuild(db)
+            click.echo('Rebuilt dashboard stats: ' + ', '.join(f'{k}={v}' for k, v in values.items()))
+        mismatches = check(db)
+        for name, (stored, live) in mismatches.items():
+            click.echo(f'MISMATCH {name}: stored={stored} live={live}', err=True)
+        if mismatches:
+            raise SystemExit(1)
+        click.echo('Dashboard stats match live aggregates.')
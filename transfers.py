@@ -0,0 +1,338 @@
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timezone
+
+import click
+from flask import Response, current_app, stream_with_context
+
+import availability
+from db import get_db
+from replication import get_read_db
+
+FORMATS = ('csv', 'jsonl')
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+# Rejections kept for the report; later ones are only counted
+MAX_REPORTED_REJECTIONS = 1000
+
+# Columns written by export; bookings round-trip through import
+EXPORTS = {
+    'bookings': '''
+        SELECT b.id, u.email AS user_email, b.cabin_id, c.cabin_number, b.check_in, b.check_out,
+               b.num_nights, b.num_guests, b.breakfast_included, b.observations,
+               b.total_price, b.status, b.created_at
+        FROM bookings b
+        LEFT JOIN users u ON u.id = b.user_id
+        LEFT JOIN cabins c ON c.id = b.cabin_id
+        ORDER BY b.id
+    ''',
+    'bookings_archive': '''
+        SELECT b.id, u.email AS user_email, b.cabin_id, c.cabin_number, b.check_in, b.check_out,
+               b.num_nights, b.num_guests, b.breakfast_included, b.observations,
+               b.total_price, b.status, b.created_at, b.archived_at
+        FROM bookings_archive b
+        LEFT JOIN users u ON u.id = b.user_id
+        LEFT JOIN cabins c ON c.id = b.cabin_id
+        ORDER BY b.id
+    ''',
+    'users': 'SELECT id, name, email, phone, role, created_at FROM users ORDER BY id',
+    'reviews': '''
+        SELECT id, user_id, cabin_id, booking_id, rating, comment, created_at
+        FROM reviews ORDER BY id
+    ''',
+}
+
+INSERT_SQL = '''
+    INSERT INTO bookings (user_id, cabin_id, check_in, check_out, num_nights, num_guests,
+                          observations, breakfast_included, total_price, status, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+'''
+
+
+class ImportResult:
+    """Counts and rejected rows from one import; ``rejected`` holds (line, reason)"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.inserted = 0
+        self.rejected = []
+        self.rejected_count = 0
+
+    def reject(self, line, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REPORTED_REJECTIONS:
+            self.rejected.append((line, reason))
+
+
+def guess_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else default
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict or error message) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, f'invalid JSON: {e}'
+                continue
+            yield line_number, row if isinstance(row, dict) else 'expected a JSON object'
+
+
+def _field(row, name):
+    value = row.get(name)
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value == '' else value
+
+
+def _validate(row, cabins, cabin_numbers, users):
+    """Return the booking tuple for INSERT_SQL, or raise ValueError with the reason
+
+    ``users`` maps both the emails and the ids seen in the chunk to user ids.
+    """
+    cabin_id = _field(row, 'cabin_id')
+    if cabin_id is None and _field(row, 'cabin_number') is not None:
+        cabin_id = cabin_numbers.get(str(_field(row, 'cabin_number')))
+    try:
+        cabin = cabins[int(cabin_id)]
+    except (TypeError, ValueError, KeyError):
+        raise ValueError('unknown cabin')
+
+    user_id = _field(row, 'user_id')
+    if user_id is None:
+        # Signup stores emails lowercased
+        user_id = users.get(str(_field(row, 'user_email')).lower())
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        raise ValueError('unknown user')
+    if user_id not in users:
+        raise ValueError('unknown user')
+
+    try:
+        check_in = datetime.strptime(str(_field(row, 'check_in')), '%Y-%m-%d').date()
+        check_out = datetime.strptime(str(_field(row, 'check_out')), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('dates must be YYYY-MM-DD')
+    num_nights = (check_out - check_in).days
+    if num_nights <= 0:
+        raise ValueError('check-out must be after check-in')
+
+    try:
+        num_guests = int(_field(row, 'num_guests') or 0)
+    except (TypeError, ValueError):
+        num_guests = 0
+    if not 1 <= num_guests <= cabin['capacity']:
+        raise ValueError(f'guests must be between 1 and {cabin["capacity"]}')
+
+    status = _field(row, 'status') or 'unconfirmed'
+    if status not in availability.BOOKING_STATUSES:
+        raise ValueError(f'unknown status {status!r}')
+
+    # Lists are paginated on created_at, so it must sort like CURRENT_TIMESTAMP
+    created_at = _field(row, 'created_at')
+    if created_at is not None:
+        try:
+            created = datetime.fromisoformat(str(created_at))
+        except ValueError:
+            raise ValueError('created_at must be YYYY-MM-DD HH:MM:SS')
+        if created.tzinfo is not None:
+            created = created.astimezone(timezone.utc).replace(tzinfo=None)
+        created_at = created.strftime('%Y-%m-%d %H:%M:%S')
+
+    breakfast = _field(row, 'breakfast_included')
+    breakfast = breakfast is True or str(breakfast).lower() in TRUE_VALUES
+    total_price = availability.booking_total(cabin['price_per_night'], num_nights, num_guests, breakfast)
+    return (user_id, int(cabin_id), check_in.isoformat(), check_out.isoformat(), num_nights,
+            num_guests, _field(row, 'observations') or '', breakfast, total_price, status, created_at)
+
+
+def _import_chunk(db, chunk, cabins, cabin_numbers, result, earlier=None):
+    """Validate, overlap-check and insert one chunk inside a single write transaction
+
+    ``earlier`` holds the stays accepted from previous chunks of a dry run,
+    which were rolled back and so are not in the database to be checked.
+    """
+    keys = set()
+    for _, row in chunk:
+        if isinstance(row, dict):
+            if _field(row, 'user_id') is not None:
+                keys.add(str(_field(row, 'user_id')))
+            elif _field(row, 'user_email') is not None:
+                keys.add(str(_field(row, 'user_email')).lower())
+    users = {}
+    if keys:
+        placeholders = ','.join('?' * len(keys))
+        for user in db.execute(f'''
+            SELECT id, email FROM users
+            WHERE email IN ({placeholders}) OR id IN ({placeholders})
+        ''', list(keys) * 2):
+            users[user['email'].lower()] = user['id']
+            users[user['id']] = user['id']
+
+    candidates = []
+    for line, row in chunk:
+        if not isinstance(row, dict):
+            result.reject(line, row)
+            continue
+        try:
+            candidates.append((line, _validate(row, cabins, cabin_numbers, users)))
+        except ValueError as e:
+            result.reject(line, str(e))
+
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Every blocking stay that could collide with this chunk, loaded in one query
+        blocking = [(line, b) for line, b in candidates if b[9] in availability.BLOCKING_STATUSES]
+        calendar = availability.IntervalIndex()
+        if blocking:
+            cabin_ids = sorted({b[1] for _, b in blocking})
+            placeholders = ','.join('?' * len(cabin_ids))
+            existing = db.execute(f'''
+                SELECT id, cabin_id, check_in, check_out FROM bookings
+                WHERE status IN ("unconfirmed", "checked_in")
+                AND cabin_id IN ({placeholders})
+                AND check_in < ? AND check_out > ?
+            ''', cabin_ids + [max(b[3] for _, b in blocking), min(b[2] for _, b in blocking)])
+            for booking in existing:
+                calendar.add(booking['cabin_id'], booking['check_in'], booking['check_out'], booking['id'])
+
+        accepted = []
+        for n, (line, booking) in enumerate(candidates):
+            if booking[9] in availability.BLOCKING_STATUSES:
+                if not calendar.is_free(booking[1], booking[2], booking[3]) or (
+                        earlier is not None and not earlier.is_free(booking[1], booking[2], booking[3])):
+                    result.reject(line, 'overlaps an existing booking')
+                    continue
+                # Later rows in the same file must not overlap this one either
+                calendar.add(booking[1], booking[2], booking[3], -1 - n)
+                if earlier is not None:
+                    earlier.add(booking[1], booking[2], booking[3], -line)
+            accepted.append(booking)
+
+        if accepted:
+            db.executemany(INSERT_SQL, accepted)
+        if result.dry_run:
+            db.rollback()
+        else:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    result.inserted += len(accepted)
+
+
+def import_bookings(db, stream, fmt='csv', dry_run=False, chunk_size=None):
+    """Load bookings from a CSV or JSONL text stream
+
+    Rows are priced with the same rules as the booking form and may name
+    the cabin by ``cabin_id`` or ``cabin_number`` and the guest by
+    ``user_id`` or ``user_email``. Each chunk is committed in its own
+    transaction, so a large file never holds the write lock for long and a
+    bad row only rejects itself.
+    """
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+    cabins = {row['id']: row for row in db.execute('SELECT id, cabin_number, capacity, price_per_night FROM cabins')}
+    cabin_numbers = {str(row['cabin_number']): cabin_id for cabin_id, row in cabins.items()}
+    result = ImportResult(dry_run)
+    earlier = availability.IntervalIndex() if dry_run else None
+    chunk = []
+    for item in read_rows(stream, fmt):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            _import_chunk(db, chunk, cabins, cabin_numbers, result, earlier)
+            chunk = []
+    if chunk:
+        _import_chunk(db, chunk, cabins, cabin_numbers, result, earlier)
+    result.rejected.sort()
+    # Imported stays are not in the in-memory availability index; let it rebuild
+    if result.inserted and not dry_run:
+        current_app.extensions.pop('availability_index', None)
+    return result
+
+
+def export_rows(db, table, fmt, batch_size=1000):
+    """Yield ``table`` as CSV or JSONL text, a batch of rows at a time
+
+    Rows come straight off the cursor, so memory use stays flat however
+    large the table is.
+    """
+    cursor = db.execute(EXPORTS[table])
+    columns = [d[0] for d in cursor.description]
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if fmt == 'csv':
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(columns, row)), default=str))
+                buffer.write('\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(table, fmt):
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    body = stream_with_context(export_rows(get_read_db(), table, fmt))
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={table}.{fmt}',
+        'Cache-Control': 'no-store',
+    })
+
+
+def init_app(app):
+    app.config.setdefault('IMPORT_CHUNK_SIZE', 1000)
+
+    @app.cli.command('import-bookings')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+    @click.option('--dry-run', is_flag=True, help='Validate and check overlaps without saving.')
+    def import_bookings_command(path, fmt, dry_run):
+        """Import bookings from a CSV or JSONL file."""
+        fmt = fmt or guess_format(path)
+        if path == '-':
+            result = import_bookings(get_db(), sys.stdin, fmt, dry_run)
+        else:
+            with open(path, encoding='utf-8', newline='') as f:
+                result = import_bookings(get_db(), f, fmt, dry_run)
+        for line, reason in result.rejected:
+            click.echo(f'line {line}: {reason}', err=True)
+        verb = 'Would import' if dry_run else 'Imported'
+        click.echo(f'{verb} {result.inserted} bookings, rejected {result.rejected_count}.')
+        if result.rejected_count:
+            raise SystemExit(1)
+
+    @app.cli.command('export')
+    @click.argument('table', type=click.Choice(sorted(EXPORTS)))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv')
+    @click.option('--output', '-o', default='-', help='File to write, default stdout.')
+    def export_command(table, fmt, output):
+        """Export bookings, archived bookings, users or reviews as CSV or JSONL."""
+        out = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in export_rows(get_db(), table, fmt):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,204 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app
+
+import db as dbpool
+
+
+class WriteBusy(Exception):
+    """Raised when the write queue is full, or a queued write timed out before it ran"""
+
+
+def apply(db, fn, *args):
+    """Run ``fn(db, *args)`` in its own write transaction on ``db`` and return its result
+
+    BEGIN IMMEDIATE takes the write lock up front, so reads ``fn`` makes
+    before writing (such as an overlap check) cannot be invalidated by a
+    concurrent writer.
+    """
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        result = fn(db, *args)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
+
+
+class WriteQueue:
+    """One writer thread that applies queued mutations in group commits
+
+    Request threads hand ``fn(db, *args)`` to ``submit`` and wait for its
+    result. The writer drains whatever has queued up while the previous
+    batch was committing, runs each mutation in its own savepoint so a
+    failure (a booking conflict, say) rolls back only that one, and commits
+    the batch once. Requests stop contending for the SQLite write lock, and
+    a burst of writes costs one commit instead of one each.
+
+    At most ``max_pending`` writes may wait; beyond that, or after
+    ``timeout`` seconds without a result, ``submit`` raises WriteBusy.
+    """
+
+    def __init__(self, app, max_pending=256, max_batch=64, timeout=5.0):
+        self.app = app
+        self.database = app.config['DATABASE']
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue(max_pending)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._lock = threading.Lock()
+        self._stats = {'writes': 0, 'failed': 0, 'batches': 0, 'largest_batch': 0, 'busy': 0}
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def submit(self, fn, *args):
+        """Queue ``fn(db, *args)`` and return its result once committed, or raise its error"""
+        deadline = time.monotonic() + self.timeout
+        future = Future()
+        try:
+            self._queue.put((future, fn, args), timeout=self.timeout)
+        except queue.Full:
+            self._count('busy')
+            raise WriteBusy()
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            if future.cancel():
+                self._count('busy')
+                raise WriteBusy()
+            # Already in a batch being applied; its outcome must not be lost
+            return future.result()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=self._queue.qsize())
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _run(self):
+        config = self.app.config
+        pool = dbpool.ConnectionPool(self.database, size=1, pragmas=config['DB_PRAGMAS'],
+                                     factory=config['DB_CONNECTION_FACTORY'],
+                                     backend=dbpool.BACKENDS[config['DB_BACKEND']])
+        conn = pool.acquire()
+        try:
+            with self.app.app_context():
+                while not self._stop.is_set():
+                    try:
+                        batch = [self._queue.get(timeout=0.2)]
+                    except queue.Empty:
+                        continue
+                    while len(batch) < self.max_batch:
+                        try:
+                            batch.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    try:
+                        self._apply_batch(conn, batch)
+                    except Exception:
+                        self.app.logger.exception('Write queue batch failed')
+        finally:
+            pool.release(conn)
+            pool.close()
+
+    def _apply_batch(self, conn, batch):
+        # Writes whose caller gave up while they waited are skipped
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute('BEGIN IMMEDIATE')
+            for future, fn, args in batch:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    conn.execute('RELEASE queued_write')
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute('RELEASE queued_write')
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except Exception as e:
+            # The batch never committed, so every write in it failed
+            if conn.in_transaction:
+                conn.rollback()
+            for future, _, _ in batch:
+                future.set_exception(e)
+            self._count('failed', len(batch))
+            raise
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+            for future, result, error in outcomes:
+                self._stats['writes' if error is None else 'failed'] += 1
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The app's running write queue, or None when WRITE_QUEUE is off"""
+    app = current_app._get_current_object()
+    if not app.config['WRITE_QUEUE']:
+        return None
+    writer = app.extensions.get('write_queue')
+    if writer is None or writer.database != app.config['DATABASE']:
+        with _queue_lock:
+            writer = app.extensions.get('write_queue')
+            if writer is None or writer.database != app.config['DATABASE']:
+                if writer is not None:
+                    writer.stop()
+                writer = WriteQueue(app, max_pending=app.config['WRITE_QUEUE_MAX_PENDING'],
+                                    max_batch=app.config['WRITE_QUEUE_MAX_BATCH'],
+                                    timeout=app.config['WRITE_QUEUE_TIMEOUT'])
+                writer.start()
+                app.extensions['write_queue'] = writer
+    return writer
+
+
+def run(db, fn, *args):
+    """Apply the mutation ``fn(db, *args)`` and return its result
+
+    Goes through the group-commit writer when WRITE_QUEUE is on, otherwise
+    runs in a write transaction on the request's own connection. ``fn`` must
+    not commit or roll back itself.
+    """
+    writer = get_queue()
+    if writer is None:
+        return apply(db, fn, *args)
+    return writer.submit(fn, *args)
+
+
+def _busy(error):
+    return 'The server is busy right now. Please try again in a moment.', 503, {'Retry-After': '1'}
+
+
+def init_app(app):
+    app.config.setdefault('WRITE_QUEUE', False)
+    app.config.setdefault('WRITE_QUEUE_MAX_PENDING', 256)
+    app.config.setdefault('WRITE_QUEUE_MAX_BATCH', 64)
+    app.config.setdefault('WRITE_QUEUE_TIMEOUT', 5.0)
+    app.register_error_handler(WriteBusy, _busy)